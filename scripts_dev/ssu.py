@@ -34,6 +34,8 @@ import sys
 import logging
 import ntpath
 import argparse
+import shutil
+import tempfile
 from collections import defaultdict
 
 from biolib.parallel import Parallel
@@ -48,29 +50,43 @@ class SSU(object):
     log_format = logging.Formatter(fmt="[%(asctime)s] %(levelname)s: %(message)s",
                                    datefmt="%Y-%m-%d %H:%M:%S")
 
-  def _producer(self, genome_file):
-    """Process each genome."""
+  def _identification_dir(self, genome_file):
+    """Directory with rRNA genes identified in genome."""
 
     full_genome_dir, _ = ntpath.split(genome_file)
 
-    output_dir = os.path.join(full_genome_dir, self.output_dir)
+    return os.path.join(full_genome_dir, self.identification_dir)
+
+  def _identified(self, genome_file):
+    """Check if rRNA genes have previously been identified in genome."""
+
+    output_dir = self._identification_dir(genome_file)
+
+    # the HMM summary file is only written if genes were identified,
+    # otherwise the output of the last HMM search indicates a completed scan
+    return (os.path.exists(os.path.join(output_dir, '%s.hmm_summary.tsv' % self.rna_gene))
+            or os.path.exists(os.path.join(output_dir, '%s.euk.txt' % self.rna_gene)))
 
-    # clean up old log files
-    log_file = os.path.join(output_dir, 'genometk.log')
-    if os.path.exists(log_file):
-      os.remove(log_file)
+  def _producer(self, genome_file):
+    """Identify and extract rRNA genes in each genome."""
+
+    output_dir = self._identification_dir(genome_file)
+
+    # clean up old log files and previously identified genes
+    for old_file in ['genometk.log', '%s.hmm_summary.tsv' % self.rna_gene, '%s.fna' % self.rna_gene]:
+      old_file = os.path.join(output_dir, old_file)
+      if os.path.exists(old_file):
+        os.remove(old_file)
 
     if self.rna_gene == 'lsu_5S':
         cmd = 'genometk rna --silent --cpus 1 --min_len 80 %s %s %s' % (genome_file, 
                                                                             self.rna_gene, 
                                                                             output_dir)
-        os.system(cmd)
     else:
-        os.system('genometk rna --silent --cpus 1 --db %s --taxonomy_file %s %s %s %s' % (self.db, 
-                                                                                        self.taxonomy, 
-                                                                                        genome_file, 
-                                                                                        self.rna_gene, 
-                                                                                        output_dir))
+        cmd = 'genometk rna --silent --cpus 1 %s %s %s' % (genome_file, 
+                                                            self.rna_gene, 
+                                                            output_dir)
+    os.system(cmd)
 
     return output_dir
 
@@ -79,44 +95,98 @@ class SSU(object):
                                                           total_items,
                                                           processed_items * 100.0 / total_items)
 
-  def run(self, rna_gene, ncbi_genome_dir, user_genome_dir, cpus):
-    """Create metadata by parsing assembly stats files."""
-    
-    print 'Running with GreenGenes database'
-    self._run(rna_gene, ncbi_genome_dir, user_genome_dir, 'GG', cpus)
-    
-    print 'Running with SILVA database'
-    self._run(rna_gene, ncbi_genome_dir, user_genome_dir, 'SILVA', cpus)
-    
-  def _run(self, rna_gene, ncbi_genome_dir, user_genome_dir, ssu_db, cpus):
-    """Create metadata by parsing assembly stats files."""
+  def _classify(self, genome_files, db, taxonomy, output_dir, cpus):
+    """Classify rRNA genes of all genomes against a reference database with a single BLAST search.
+
+    Genes of all genomes are combined into a single file with the index of the
+    genome prepended to each gene identifier. Results are split by genome and
+    written to the specified output directory of each genome.
+    """
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+      rrna_file = os.path.join(tmp_dir, '%s.fna' % self.rna_gene)
+      fout = open(rrna_file, 'w')
+      classified_genomes = set()
+      for genome_index, genome_file in enumerate(genome_files):
+        genome_rrna_file = os.path.join(self._identification_dir(genome_file), '%s.fna' % self.rna_gene)
+        if not os.path.exists(genome_rrna_file):
+          continue
+
+        classified_genomes.add(genome_index)
+        for line in open(genome_rrna_file):
+          if line[0] == '>':
+            line = '>%d~%s' % (genome_index, line[1:])
+          fout.write(line)
+      fout.close()
+
+      print 'Classifying rRNA genes from %d genomes.' % len(classified_genomes)
+      if not classified_genomes:
+        return
+
+      # genometk requires a genome file, which must exist even though
+      # it is not read when rRNA genes are given
+      classify_dir = os.path.join(tmp_dir, 'classify')
+      os.system('genometk rna --silent --cpus %d --db %s --taxonomy_file %s --rrna_file %s %s %s %s' % (cpus,
+                                                                                                       db,
+                                                                                                       taxonomy,
+                                                                                                       rrna_file,
+                                                                                                       genome_files[min(classified_genomes)],
+                                                                                                       self.rna_gene,
+                                                                                                       classify_dir))
+
+      classification_file = os.path.join(classify_dir, '%s.taxonomy.tsv' % self.rna_gene)
+      if not os.path.exists(classification_file):
+        raise RuntimeError('genometk did not classify rRNA genes against %s.' % db)
+
+      with open(classification_file) as f:
+        header = f.readline()
+
+        genome_hits = defaultdict(list)
+        for line in f:
+          genome_index, hit = line.split('~', 1)
+          genome_hits[int(genome_index)].append(hit)
+
+      for genome_index in classified_genomes:
+        full_genome_dir, _ = ntpath.split(genome_files[genome_index])
+        genome_output_dir = os.path.join(full_genome_dir, output_dir)
+        if not os.path.exists(genome_output_dir):
+          os.makedirs(genome_output_dir)
+
+        fout = open(os.path.join(genome_output_dir, '%s.taxonomy.tsv' % self.rna_gene), 'w')
+        fout.write(header)
+        fout.writelines(genome_hits[genome_index])
+        fout.close()
+    finally:
+      shutil.rmtree(tmp_dir)
+
+  def run(self, rna_gene, ncbi_genome_dir, user_genome_dir, cpus, rescan):
+    """Identify rRNA genes in each genome once and classify them against each database."""
     
     self.rna_gene = rna_gene
     
-    if ssu_db == 'GG':
-        # Greengenes data files and desired output
-        if rna_gene == 'ssu':
-            self.db = '/srv/db/gg/2013_08/gg_13_8_otus/rep_set/99_otus.fasta'
-            self.taxonomy = '/srv/db/gg/2013_08/gg_13_8_otus/taxonomy/99_otu_taxonomy.txt'
-            self.output_dir = 'ssu_gg'
-        elif rna_gene == 'lsu_23S':
-            print 'There is no 23S LSU database for GG.'
-            return
-        elif rna_gene == 'lsu_5S':
-            return
-    elif ssu_db == 'SILVA':
-        # Silva info
-        if rna_gene == 'ssu':
-            self.db = '/srv/whitlam/bio/db/silva/123.1/SILVA_123.1_SSURef_Nr99_tax_silva.fasta'
-            self.taxonomy = '/srv/whitlam/bio/db/silva/123.1/silva_taxonomy.ssu.tsv'
-            self.output_dir = 'rna_silva'
-        elif rna_gene == 'lsu_23S':
-            self.db = '/srv/db/silva/123.1/SILVA_123.1_LSURef_tax_silva.fasta'
-            self.taxonomy = '/srv/whitlam/bio/db/silva/123.1/silva_taxonomy.lsu.tsv'
-            self.output_dir = 'rna_silva'
-        elif rna_gene == 'lsu_5S':
-            print 'We currently do not curate against a 5S database, but do identify these sequences for quality assessment purposes.'
-            self.output_dir = 'lsu_5S'
+    # Greengenes and SILVA data files and desired output
+    databases = []
+    if rna_gene == 'ssu':
+        self.identification_dir = 'rna_silva'
+        databases.append(('GG',
+                          '/srv/db/gg/2013_08/gg_13_8_otus/rep_set/99_otus.fasta',
+                          '/srv/db/gg/2013_08/gg_13_8_otus/taxonomy/99_otu_taxonomy.txt',
+                          'ssu_gg'))
+        databases.append(('SILVA',
+                          '/srv/whitlam/bio/db/silva/123.1/SILVA_123.1_SSURef_Nr99_tax_silva.fasta',
+                          '/srv/whitlam/bio/db/silva/123.1/silva_taxonomy.ssu.tsv',
+                          'rna_silva'))
+    elif rna_gene == 'lsu_23S':
+        print 'There is no 23S LSU database for GG.'
+        self.identification_dir = 'rna_silva'
+        databases.append(('SILVA',
+                          '/srv/db/silva/123.1/SILVA_123.1_LSURef_tax_silva.fasta',
+                          '/srv/whitlam/bio/db/silva/123.1/silva_taxonomy.lsu.tsv',
+                          'rna_silva'))
+    elif rna_gene == 'lsu_5S':
+        print 'We currently do not curate against a 5S database, but do identify these sequences for quality assessment purposes.'
+        self.identification_dir = 'lsu_5S'
 
     input_files = []
 
@@ -140,9 +210,6 @@ class SSU(object):
 
               full_assembly_dir = os.path.join(full_species_dir, assembly_dir)
 
-              #if os.path.exists(os.path.join(full_assembly_dir, self.output_dir)):
-              #  continue
-
               genome_file = os.path.join(full_assembly_dir, assembly_dir + '_genomic.fna')
               input_files.append(genome_file)
 
@@ -157,23 +224,31 @@ class SSU(object):
           for genome_id in os.listdir(full_user_dir):
             full_genome_dir = os.path.join(full_user_dir, genome_id)
 
-            if os.path.exists(os.path.join(full_genome_dir, self.output_dir)):
-                continue
-
             genome_file = os.path.join(full_genome_dir, genome_id + '_genomic.fna')
             input_files.append(genome_file)
 
     print 'Identified %d genomes to process.' % len(input_files)
 
-    # process each genome
-    print 'Generating metadata for each genome:'
+    # identify rRNA genes in genomes not previously scanned
+    if rescan:
+        scan_files = input_files
+    else:
+        scan_files = [f for f in input_files if not self._identified(f)]
+
+    print 'Identifying rRNA genes in %d genomes:' % len(scan_files)
     parallel = Parallel(cpus = cpus)
-    if len(input_files) > 0 :
+    if len(scan_files) > 0 :
         parallel.run(self._producer,
                      None,
-                     input_files,
+                     scan_files,
                      self._progress)
 
+    # classify identified rRNA genes against each database
+    for db_name, db, taxonomy, output_dir in databases:
+        print 'Running with %s database' % db_name
+        if len(input_files) > 0:
+            self._classify(input_files, db, taxonomy, output_dir, cpus)
+
 if __name__ == '__main__':
   print __prog_name__ + ' v' + __version__ + ': ' + __prog_desc__
   print '  by ' + __author__ + ' (' + __email__ + ')' + '\n'
@@ -183,6 +258,7 @@ if __name__ == '__main__':
   parser.add_argument('ncbi_genome_dir', help='base directory leading to NCBI archaeal and bacterial genome assemblies')
   parser.add_argument('user_genome_dir', help='base directory leading to user genomes or NONE to skip')
   parser.add_argument('-t', '--threads', help='number of CPUs to use', type=int, default=32)
+  parser.add_argument('--rescan', help='identify rRNA genes in genomes that were previously scanned', action='store_true')
 
   args = parser.parse_args()
 
@@ -190,7 +266,7 @@ if __name__ == '__main__':
 
   try:
     p = SSU()
-    p.run(args.rna_gene, args.ncbi_genome_dir, args.user_genome_dir, args.threads)
+    p.run(args.rna_gene, args.ncbi_genome_dir, args.user_genome_dir, args.threads, args.rescan)
   except SystemExit:
     print "\nControlled exit resulting from an unrecoverable error or warning."
   except:
@@ -212,7 +212,38 @@ def CreateTreeData(db, args):
                            rep_genome_ids,
                            not args.no_alignment,
                            args.individual,
-                           not args.no_tree)
+                           not args.no_tree,
+                           args.previous_dir,
+                           args.previous_prefix,
+                           args.binary,
+                           args.compression,
+                           args.progress)
+
+
+def SubsetTreeData(db, args):
+    return db.SubsetTreeData(args.source_dir,
+                             args.source_prefix,
+                             args.genome_list_ids,
+                             args.genome_ids,
+                             args.taxa_filter,
+                             args.quality_threshold,
+                             args.quality_weight,
+                             args.comp_threshold,
+                             args.cont_threshold,
+                             args.min_perc_taxa,
+                             args.consensus,
+                             args.min_perc_aa,
+                             not args.no_alignment,
+                             args.binary,
+                             args.out_dir,
+                             args.prefix,
+                             not args.no_tree)
+
+
+def WriteArbMetadata(db, args):
+    return db.WriteArbMetadata(args.out_dir,
+                               args.prefix,
+                               not args.no_alignment)
 
 
 def ViewGenomes(db, args):
@@ -1292,13 +1323,102 @@ if __name__ == '__main__':
                                               help='Remove concatenated alignment in ARB metadata file.')
     optional_markers_create_tree.add_argument('--individual', action='store_true',
                                               help='Create individual FASTA files for each marker.')
+    optional_markers_create_tree.add_argument('--individual_compression', dest='compression', choices=('gzip', 'zstd'), default=None,
+                                              help='Compress individual FASTA files for each marker (zstd requires the zstandard package).')
+    optional_markers_create_tree.add_argument('--binary', action='store_true',
+                                              help='Also write the untrimmed alignment and mask to a binary container (<prefix>_concatenated.bin).')
 
     optional_markers_create_tree.add_argument('--no_tree', dest='no_tree', action="store_true",
                                               help="Output tree data, but do not infer a tree.")
+    optional_markers_create_tree.add_argument('--progress', action='store_true',
+                                              help='Report progress of the running stage (time, SQL statements, memory) on stderr.')
     optional_markers_create_tree.add_argument('-h', '--help', action="help",
                                               help="Show help message.")
 
-    parser_tree_create.set_defaults(func=CreateTreeData)
+    parser_tree_create.set_defaults(func=CreateTreeData, previous_dir=None, previous_prefix=None)
+
+# -------- Update Tree Data
+    parser_tree_update = tree_category_subparser.add_parser('update',
+                                                            add_help=False,
+                                                            parents=[parser_tree_create],
+                                                            formatter_class=CustomHelpFormatter,
+                                                            help='Update previously created tree data, reusing alignments of unchanged genomes.')
+
+    required_update_tree = parser_tree_update.add_argument_group('tree update arguments')
+    required_update_tree.add_argument('--previous_dir', dest='previous_dir', required=True,
+                                      help='Directory containing tree data created by "tree create" or "tree update"; may be the --output directory to update tree data in place.')
+    required_update_tree.add_argument('--previous_prefix', dest='previous_prefix', default=None,
+                                      help='Prefix of files in previous tree data (default: same as --prefix).')
+
+    parser_tree_update.set_defaults(func=CreateTreeData)
+
+# -------- Subset Tree Data
+    parser_tree_subset = tree_category_subparser.add_parser('subset',
+                                                            add_help=False,
+                                                            formatter_class=CustomHelpFormatter,
+                                                            help='Create tree data for a subset of genomes in existing tree data.')
+
+    required_tree_subset = parser_tree_subset.add_argument_group('required arguments')
+    required_tree_subset.add_argument('--source_dir', dest='source_dir', required=True,
+                                      help='Directory containing tree data created by "tree create" or "tree update".')
+    required_tree_subset.add_argument('--output', dest='out_dir', required=True,
+                                      help='Directory to output files.')
+
+    optional_tree_subset = parser_tree_subset.add_argument_group('optional arguments')
+    optional_tree_subset.add_argument('--source_prefix', default='gtdb',
+                                      help='Prefix of files in source tree data.')
+    optional_tree_subset.add_argument('--taxa_filter',
+                                      help='Retain genomes within specific taxonomic groups (comma separated, e.g., p__Proteobacteria,p__Actinobacteria).')
+    optional_tree_subset.add_argument('--genome_list_ids', dest='genome_list_ids', default=None,
+                                      help='Retain genomes in genome lists (comma separated).')
+    optional_tree_subset.add_argument('--genome_ids', dest='genome_ids', default=None,
+                                      help='Retain genomes with the specified IDs (comma separated).')
+    optional_tree_subset.add_argument('--quality_threshold', type=float, default=None,
+                                      help='Filter genomes with a quality (completeness - weight*contamination) below threshold.')
+    optional_tree_subset.add_argument('--quality_weight', type=float, default=DefaultValues.DEFAULT_QUALITY_WEIGHT,
+                                      help='Weighting used to assess genome quality (completeness - weight*contamination).')
+    optional_tree_subset.add_argument('--completeness_threshold', dest='comp_threshold', type=float, default=None,
+                                      help='Filter genomes below completeness threshold.')
+    optional_tree_subset.add_argument('--contamination_threshold', dest='cont_threshold', type=float, default=None,
+                                      help='Filter genomes above contamination threshold.')
+    optional_tree_subset.add_argument('--min_perc_aa', type=float, default=50,
+                                      help='Report genomes with an insufficient percentage of AA in the trimmed MSA.')
+    optional_tree_subset.add_argument('--min_perc_taxa', type=float, default=50,
+                                      help='minimum percentage of taxa required required to retain column.')
+    optional_tree_subset.add_argument('--consensus', type=float, default=25,
+                                      help='minimum percentage of the same amino acid required to retain column.')
+    optional_tree_subset.add_argument('--prefix', required=False, default='gtdb',
+                                      help='Desired prefix for output files.')
+    optional_tree_subset.add_argument('--no_alignment', action='store_true',
+                                      help='Remove concatenated alignment in ARB metadata file.')
+    optional_tree_subset.add_argument('--binary', action='store_true',
+                                      help='Also write the untrimmed alignment and mask to a binary container (<prefix>_concatenated.bin).')
+    optional_tree_subset.add_argument('--no_tree', dest='no_tree', action="store_true",
+                                      help="Output tree data, but do not infer a tree.")
+    optional_tree_subset.add_argument('-h', '--help', action="help",
+                                      help="Show help message.")
+
+    parser_tree_subset.set_defaults(func=SubsetTreeData)
+
+# -------- Write ARB metadata for Tree Data
+    parser_tree_arb = tree_category_subparser.add_parser('arb',
+                                                         add_help=False,
+                                                         formatter_class=CustomHelpFormatter,
+                                                         help='Write ARB metadata for existing tree data using its stored alignment.')
+
+    required_tree_arb = parser_tree_arb.add_argument_group('required arguments')
+    required_tree_arb.add_argument('--tree_dir', dest='out_dir', required=True,
+                                   help='Directory containing tree data created by "tree create" or "tree update".')
+
+    optional_tree_arb = parser_tree_arb.add_argument_group('optional arguments')
+    optional_tree_arb.add_argument('--prefix', required=False, default='gtdb',
+                                   help='Prefix of tree data files.')
+    optional_tree_arb.add_argument('--no_alignment', action='store_true',
+                                   help='Remove concatenated alignment in ARB metadata file.')
+    optional_tree_arb.add_argument('-h', '--help', action="help",
+                                   help="Show help message.")
+
+    parser_tree_arb.set_defaults(func=WriteArbMetadata)
 
 # -------- Generate Tree Data
     parser_db_stats_view = db_stats_category_subparser.add_parser('view',
@@ -1444,7 +1564,8 @@ if __name__ == '__main__':
         loggerSetup(None, args.release, args.silent)
 
     # Special parser checks
-    if (args.category_parser_name == 'tree' and args.tree_subparser_name == 'create'):
+    if (args.category_parser_name == 'tree' and args.tree_subparser_name in ('create', 'update')):
+        parser_tree = parser_tree_create if args.tree_subparser_name == 'create' else parser_tree_update
         if (not args.all_dereplicated and
                 not args.ncbi_dereplicated and
                 not args.user_genomes and
@@ -1455,11 +1576,11 @@ if __name__ == '__main__':
                 not args.genome_list_ids and
                 not args.genome_ids and
                 not args.genome_batchfile):
-            parser_tree_create.error(
+            parser_tree.error(
                 'Need to specify at least one of --all_dereplicated, --ncbi_dereplicated, --user_genomes, --donovan_sra_dereplicated, --all_genomes, --ncbi_genomes, --user_genomes --genome_list_ids, --genome_ids, or --genome_batchfile.')
 
         if (not args.marker_set_ids and not args.marker_ids and not args.marker_batchfile):
-            parser_tree_create.error(
+            parser_tree.error(
                 'Need to specify at least one of --marker_set_ids, --marker_ids or --marker_batchfile.')
 
     if (args.category_parser_name == 'genomes' and args.genome_subparser_name == 'view'):
@@ -16,22 +16,96 @@
 ###############################################################################
 
 import os
+import sys
+import math
+import time
 import logging
+import traceback
 import multiprocessing
 import tempfile
 import subprocess
 import shutil
-import time
+from StringIO import StringIO
 
 import psycopg2
 
 import ConfigMetadata
+import DefaultValues
+from Exceptions import GenomeDatabaseError
 from GenomeDatabaseConnection import GenomeDatabaseConnection
-from Tools import fastaPathGenerator, splitchunks
+from Tools import fastaPathGenerator, generateTempTableName
 
 from biolib.seq_io import read_fasta
 
 
+# state used by worker processes, set by _initAlignWorker
+# so it is inherited by forked workers rather than pickled
+_worker_state = {}
+
+
+def _initAlignWorker(aligned_mngr):
+    """Initialize worker process for aligning marker genes."""
+
+    _worker_state['aligned_mngr'] = aligned_mngr
+
+
+def _alignWithRetries(genome_plans):
+    """Align marker genes for genomes, retrying on failure."""
+
+    error = None
+    for _attempt in xrange(DefaultValues.HMMALIGN_RETRIES + 1):
+        try:
+            return _worker_state['aligned_mngr']._runHmmMultiAlign(genome_plans), None
+        except Exception:
+            error = traceback.format_exc()
+
+    return None, error
+
+
+def _alignWorker(genome_plans):
+    """Align marker genes for a batch of genomes.
+
+    If the batch can not be processed, genomes are processed
+    individually so only genomes which fail are reported.
+
+    Parameters
+    ----------
+    genome_plans : list
+        Genome id, path to genomic FASTA file, and markers to align for each genome.
+
+    Returns
+    -------
+    int
+        Number of genomes in batch.
+    list
+        Rows to insert into aligned_markers table.
+    list
+        Database identifiers of genomes which could not be processed.
+    str
+        Description of errors, or None on success.
+    """
+
+    rows, error = _alignWithRetries(genome_plans)
+    if error is None:
+        return len(genome_plans), rows, [], None
+
+    if len(genome_plans) == 1:
+        return 1, [], [genome_plans[0][0]], error
+
+    rows = []
+    failed_genome_ids = []
+    errors = []
+    for genome_plan in genome_plans:
+        genome_rows, error = _alignWithRetries([genome_plan])
+        if error is None:
+            rows.extend(genome_rows)
+        else:
+            failed_genome_ids.append(genome_plan[0])
+            errors.append(error)
+
+    return len(genome_plans), rows, failed_genome_ids, '\n'.join(errors) or None
+
+
 class AlignedMarkerManager(object):
     ''''Manage the processing of Aligned Markers and querying marker information.'''
 
@@ -72,91 +146,221 @@ class AlignedMarkerManager(object):
         self.logger.info('Aligning marker genes not already in the database.')
         # return True
 
+        # identify markers to align for each genome, skipping
+        # genomes with all markers already aligned
+        marker_plan = self._missingMarkers(db_genome_ids, marker_ids)
+        if not marker_plan:
+            self.logger.info('All marker genes are already aligned.')
+            return True
+
+        self.logger.info('Aligning marker genes in %d genomes.' % len(marker_plan))
+
         # We need to rebuild the path to each
         genome_dirs_query = ("SELECT g.id, g.genes_file_location,gs.external_id_prefix "
                              "FROM genomes g " +
                              "LEFT JOIN genome_sources gs ON gs.id = g.genome_source_id " +
                              "WHERE g.id in %s")
-        self.cur.execute(genome_dirs_query, (tuple(db_genome_ids),))
+        self.cur.execute(genome_dirs_query, (tuple(marker_plan.keys()),))
         raw_results = self.cur.fetchall()
         genome_dirs = {a: fastaPathGenerator(b, c) for a, b, c in raw_results}
 
-        manager = multiprocessing.Manager()
-        out_q = manager.Queue()
-        procs = []
-        nprocs = self.threads
-        for item in splitchunks(genome_dirs, nprocs):
-            p = multiprocessing.Process(
-                target=self._hmmWorker,
-                args=(item, marker_ids, out_q))
-            procs.append(p)
-            p.start()
-
-        # Collect all results into a single result dict. We know how many dicts
-        # with results to expect.
-        while out_q.empty():
-            time.sleep(1)
-
-        # Wait for all worker processes to finish
-        for p in procs:
-            p.join()
+        # genomes are processed in small batches which are handed to
+        # workers as they become free so all workers remain busy
+        genome_plans = [(genome_id, path, marker_plan[genome_id]) for genome_id, path in sorted(genome_dirs.items())]
+        batch_size = int(math.ceil(float(len(genome_plans)) / (4 * self.threads)))
+        batch_size = max(1, min(DefaultValues.HMMALIGN_BATCH_SIZE, batch_size))
+        batches = [genome_plans[i:i + batch_size] for i in xrange(0, len(genome_plans), batch_size)]
+
+        pool = multiprocessing.Pool(self.threads, _initAlignWorker, (self,))
+        try:
+            # load aligned markers into the database as they are produced
+            failed_genome_ids = self._loadAlignedMarkers(pool.imap_unordered(_alignWorker, batches),
+                                                         len(genome_plans))
+            pool.close()
+            pool.join()
+        finally:
+            pool.terminate()
+
+        if failed_genome_ids:
+            raise GenomeDatabaseError("Unable to align marker genes for %d genomes: %s"
+                                      % (len(failed_genome_ids), ', '.join(map(str, sorted(failed_genome_ids)))))
 
         return True
 
-    def _hmmWorker(self, subdict_genomes, marker_ids, out_q):
+    def _missingMarkers(self, db_genome_ids, marker_ids):
         '''
-        The worker function, invoked in a process.
+        Identify markers that are not aligned for each genome.
 
-        :param subdict_genomes: sub dictionary of genomes
-        :param marker_ids: list of marker ids for one or many marker sets
-        :param out_q: manager.Queue()
+        :param db_genome_ids: list of genome ids
+        :param marker_ids: list of marker ids for the selected sets
 
+        Returns
+        --------------
+        Dictionary indicating the markers to align for each genome, indexed by
+        genome id, marker database (PFAM or TIGR), and marker id in the marker database
         '''
 
-        for db_genome_id, path in subdict_genomes.items():
-            self._runHmmMultiAlign(db_genome_id, path, marker_ids)
-        out_q.put("True")
-        return True
-
-    def _runHmmMultiAlign(self, db_genome_id, path, marker_ids):
+        query = ("SELECT g.id, md.external_id_prefix, m.id_in_database, m.marker_file_location, m.size, m.id " +
+                 "FROM genomes as g " +
+                 "CROSS JOIN markers as m " +
+                 "JOIN marker_databases as md ON md.id = m.marker_database_id " +
+                 "WHERE g.id = ANY(%s) " +
+                 "AND m.id = ANY(%s) " +
+                 "AND md.external_id_prefix IN ('PFAM', 'TIGR') " +
+                 "AND NOT EXISTS (" +
+                 "SELECT 1 FROM aligned_markers as am " +
+                 "WHERE am.genome_id = g.id and am.marker_id = m.id)")
+        self.cur.execute(query, (list(db_genome_ids), list(marker_ids)))
+
+        marker_plan = {}
+        for genome_id, marker_db, id_in_database, marker_path, size, db_marker_id in self.cur:
+            genome_plan = marker_plan.setdefault(genome_id, {})
+            genome_plan.setdefault(marker_db, {})[id_in_database] = {"path": marker_path,
+                                                                     "size": size,
+                                                                     "db_marker_id": db_marker_id}
+
+        return marker_plan
+
+    def _loadAlignedMarkers(self, results, num_genomes):
         '''
-        Selects markers that are not aligned for a specific genome.
+        Load aligned markers produced by workers into the database.
 
-        :param db_genome_id: Selected genome
-        :param path: Path to the genomic fasta file for the genome
-        :param marker_ids: list of marker ids for the selected sets
+        Rows for each batch of genomes are copied into a staging
+        table and merged into the aligned_markers table with a
+        single INSERT ... ON CONFLICT statement.
+
+        :param results: iterator over (number of genomes, rows, failed genome ids, error) for each batch of genomes
+        :param num_genomes: total number of genomes being processed
+
+        Returns
+        --------------
+        List of genome ids which could not be processed
         '''
 
         temp_con = GenomeDatabaseConnection()
         temp_con.MakePostgresConnection(self.release)
         temp_cur = temp_con.cursor()
 
+        staging_table = generateTempTableName()
+        temp_cur.execute("CREATE TEMP TABLE %s (LIKE aligned_markers)" % staging_table)
+
+        # each genome is aligned once per batch and only its best hit to a
+        # marker is kept, but ON CONFLICT fails if a row is affected twice
+        # so duplicates are resolved deterministically by highest bitscore
+        merge_query = ("INSERT INTO aligned_markers (genome_id, marker_id, sequence, multiple_hits, evalue, bitscore) " +
+                       "SELECT DISTINCT ON (genome_id, marker_id) " +
+                       "genome_id, marker_id, sequence, multiple_hits, evalue, bitscore " +
+                       "FROM {0} " +
+                       "ORDER BY genome_id, marker_id, " +
+                       "NULLIF(bitscore, '')::double precision DESC NULLS LAST, " +
+                       "NULLIF(evalue, '')::double precision ASC NULLS LAST, sequence " +
+                       "ON CONFLICT (genome_id, marker_id) DO UPDATE " +
+                       "SET sequence = EXCLUDED.sequence, " +
+                       "multiple_hits = EXCLUDED.multiple_hits, " +
+                       "evalue = EXCLUDED.evalue, " +
+                       "bitscore = EXCLUDED.bitscore").format(staging_table)
+
+        start_time = time.time()
+        processed_genomes = 0
+        failed_genome_ids = []
+        for num_batch_genomes, rows, batch_failed_genome_ids, error in results:
+            if batch_failed_genome_ids:
+                self.logger.error('Failed to align marker genes for genomes %s:\n%s'
+                                  % (', '.join(map(str, batch_failed_genome_ids)), error))
+                failed_genome_ids.extend(batch_failed_genome_ids)
+
+            if rows:
+                self._copyAlignedMarkers(temp_cur, staging_table, rows)
+                temp_cur.execute(merge_query)
+                temp_cur.execute("TRUNCATE %s" % staging_table)
+                temp_con.commit()
+
+            processed_genomes += num_batch_genomes
+            elapsed_time = max(time.time() - start_time, 1e-6)
+            statusStr = '==> Finished processing %d of %d (%.2f%%) genomes [%.2f genomes/s].' % (processed_genomes,
+                                                                                                num_genomes,
+                                                                                                float(processed_genomes) * 100 / num_genomes,
+                                                                                                processed_genomes / elapsed_time)
+            sys.stdout.write('%s\r' % statusStr)
+            sys.stdout.flush()
+
+        if num_genomes:
+            sys.stdout.write('\n')
+
+        temp_cur.execute("DROP TABLE %s" % staging_table)
+        temp_con.commit()
+        temp_cur.close()
+        temp_con.ClosePostgresConnection()
+
+        return failed_genome_ids
+
+    def _copyAlignedMarkers(self, cur, table_name, rows):
+        '''
+        Copy aligned marker rows into a table.
+
+        :param cur: database cursor
+        :param table_name: table with the columns of the aligned_markers table
+        :param rows: list of (genome id, marker id, sequence, multiple hits, evalue, bitscore)
+        '''
+
+        def copy_value(value):
+            if value is None:
+                return '\\N'
+            if isinstance(value, bool):
+                return 't' if value else 'f'
+            return str(value)
+
+        buf = StringIO()
+        for row in rows:
+            buf.write('\t'.join([copy_value(v) for v in row]) + '\n')
+        buf.seek(0)
+
+        cur.copy_from(buf, table_name, columns=('genome_id', 'marker_id', 'sequence',
+                                                'multiple_hits', 'evalue', 'bitscore'))
+
+    def _runHmmMultiAlign(self, genome_plans):
+        '''
+        Aligns markers that are not aligned for a batch of genomes.
+
+        :param genome_plans: list of (genome id, path to the genomic fasta file, markers to align) for each genome
+
+        Returns
+        --------------
+        List of tuple to be inserted in aligned_markers table
+        '''
+
         # gather information for all marker genes
-        final_genome = []
-        final_markerid = []
-        final_seq = []
-        final_multihits = []
-        final_evalue = []
-        final_bitscore = []
+        aligned_rows = []
+        marker_hits = []
+        for db_genome_id, path, genome_plan in genome_plans:
+            aligned_rows.extend(self._markerHits(db_genome_id, path, genome_plan, marker_hits))
+
+        aligned_rows.extend(self._runHmmAlign(marker_hits))
+
+        return aligned_rows
+
+    def _markerHits(self, db_genome_id, path, genome_plan, marker_hits):
+        '''
+        Identify genes to align for markers that are not aligned for a specific genome.
+
+        :param db_genome_id: Selected genome
+        :param path: Path to the genomic fasta file for the genome
+        :param genome_plan: markers to align for the genome, indexed by marker database
+        :param marker_hits: list extended with (genome id, marker information) for each gene to align
+
+        Returns
+        --------------
+        List of tuple to be inserted in aligned_markers table for markers absent from the genome
+        '''
+
+        missing_markers = []
 
         marker_dbs = {"PFAM": self.pfam_top_hit_suffix,
                       "TIGR": self.tigrfam_top_hit_suffix}
         for marker_db, marker_suffix in marker_dbs.iteritems():
-            query = ("SELECT m.id_in_database,m.marker_file_location,m.size,m.id " +
-                     "FROM genomes as g, markers as m " +
-                     "LEFT JOIN marker_databases as md " +
-                     "ON md.id=m.marker_database_id " +
-                     "WHERE NOT EXISTS (" +
-                     "SELECT * FROM aligned_markers as am " +
-                     "WHERE am.genome_id = g.id and am.marker_id = m.id) " +
-                     "AND g.id = %s " +
-                     "AND m.id in %s " +
-                     "AND md.external_id_prefix like %s")
-            temp_cur.execute(
-                query, (db_genome_id, tuple(marker_ids,), marker_db))
-            raw_results = temp_cur.fetchall()
-            marker_dict_original = {
-                a: {"path": b, "size": c, "db_marker_id": d} for a, b, c, d in raw_results}
+            marker_dict_original = genome_plan.get(marker_db)
+            if not marker_dict_original:
+                continue
 
             # get all gene sequences
             genome_path = str(path)
@@ -222,103 +426,98 @@ class AlignedMarkerManager(object):
 
             for mid, info in marker_dict_original.iteritems():
                 if mid not in gene_dict:
-                    final_genome.append(db_genome_id)
-                    final_markerid.append(info.get("db_marker_id"))
-                    final_seq.append("-" * info.get("size"))
-                    final_multihits.append(False)
-                    final_evalue.append(None)
-                    final_bitscore.append(None)
-
-            result_aligns = self._runHmmAlign(gene_dict, db_genome_id)
-            for result_align in result_aligns:
-                final_genome.append(result_align[0])
-                final_markerid.append(result_align[1])
-                final_seq.append(result_align[2])
-                final_multihits.append(result_align[3])
-                final_evalue.append(result_align[4])
-                final_bitscore.append(result_align[5])
-
-        if final_genome:
-            query = "SELECT upsert_aligned_markers(%s,%s,%s,%s,%s,%s)"
-            temp_cur.execute(query, (final_genome,
-                                     final_markerid,
-                                     final_seq,
-                                     final_multihits,
-                                     final_evalue,
-                                     final_bitscore))
-        temp_con.commit()
-        temp_cur.close()
-        temp_con.ClosePostgresConnection()
+                    missing_markers.append((db_genome_id,
+                                            info.get("db_marker_id"),
+                                            "-" * info.get("size"),
+                                            False,
+                                            None,
+                                            None))
 
-        return True
+            for marker_info in gene_dict.itervalues():
+                marker_hits.append((db_genome_id, marker_info))
+
+        return missing_markers
 
-    def _runHmmAlign(self, marker_dict, genome):
+    def _runHmmAlign(self, marker_hits):
         '''
-        Run hmmalign for a set of genes for a specific genome. This is run in a temp folder.
+        Run hmmalign for a set of genes from one or more genomes. Genes
+        are grouped by marker and each marker is aligned with a single
+        call to hmmalign. This is run in a temp folder.
 
-        :param marker_dict: list of markers that need to be aligned
-        :param genome: specific genome id
+        :param marker_hits: list of (genome id, marker information) for each gene to align
 
         Returns
         --------------
         List of tuple to be inserted in aligned_markers table
         '''
+
+        # group genes by marker HMM
+        genes_by_marker = {}
+        for genome, marker_info in marker_hits:
+            genes_by_marker.setdefault(marker_info.get("marker_path"), []).append((genome, marker_info))
+
         result_genomes_dict = []
         hmmalign_dir = tempfile.mkdtemp()
-        input_count = 0
-        for _markerid, marker_info in marker_dict.iteritems():
-            hmmalign_gene_input = os.path.join(
-                hmmalign_dir, "input_gene{0}.fa".format(input_count))
-            input_count += 1
-            out_fh = open(hmmalign_gene_input, 'wb')
-            out_fh.write(">{0}\n".format(marker_info.get("gene")))
-            out_fh.write("{0}".format(marker_info.get("gene_seq")))
-            out_fh.close()
-            proc = subprocess.Popen(["hmmalign", "--outformat", "Pfam", marker_info.get(
-                "marker_path"), hmmalign_gene_input], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            proc.wait()
-
-            for line in proc.stderr:
-                print "TODO"
-            result = self._getAlignedMarker(
-                marker_info.get("gene"), proc.stdout)
-            if len(result) < 1:
-                return "TODO"
-            result_genomes_dict.append((genome, marker_info.get("db_marker_id"), result, marker_info.get(
-                "multihit"), marker_info.get("evalue"), marker_info.get("bitscore")))
-            input_count += 1
-        shutil.rmtree(hmmalign_dir)
+        try:
+            for input_count, (marker_path, genes) in enumerate(sorted(genes_by_marker.iteritems())):
+                hmmalign_gene_input = os.path.join(
+                    hmmalign_dir, "input_gene{0}.fa".format(input_count))
+
+                # genes are given unique names as gene names are
+                # only unique within a genome
+                out_fh = open(hmmalign_gene_input, 'wb')
+                for gene_index, (genome, marker_info) in enumerate(genes):
+                    out_fh.write(">gene{0}_{1}\n".format(gene_index, genome))
+                    out_fh.write("{0}\n".format(marker_info.get("gene_seq")))
+                out_fh.close()
+
+                proc = subprocess.Popen(["hmmalign", "--outformat", "Pfam", marker_path, hmmalign_gene_input],
+                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                stdout, stderr = proc.communicate()
+                if proc.returncode != 0:
+                    raise Exception("hmmalign failed for {0}: {1}".format(marker_path, stderr))
+
+                aligned_markers = self._getAlignedMarkers(stdout.splitlines(True))
+                for gene_index, (genome, marker_info) in enumerate(genes):
+                    result = aligned_markers.get("gene{0}_{1}".format(gene_index, genome))
+                    if result is None:
+                        raise Exception("Unable to get alignment of {0} from hmm align result file".format(marker_info.get("gene")))
+                    result_genomes_dict.append((genome, marker_info.get("db_marker_id"), result, marker_info.get(
+                        "multihit"), marker_info.get("evalue"), marker_info.get("bitscore")))
+        finally:
+            shutil.rmtree(hmmalign_dir)
         return result_genomes_dict
 
-    def _getAlignedMarker(self, hit_name, result_file):
+    def _getAlignedMarkers(self, result_file):
         '''
-        Parse the output of Hmmalign
+        Parse the output of Hmmalign for one or more sequences
 
-        :param hit_name: gene name
-        :param result_file: output file from Hmmalign
+        :param result_file: output file from Hmmalign in Pfam format
+
+        Returns
+        --------------
+        Dictionary of aligned sequences, restricted to the consensus columns, indexed by sequence name
         '''
-        hit_seq = None
+        hit_seqs = {}
         mask_seq = None
 
         for line in result_file:
-            splitline = line.split(" ", 1)
-            if splitline[0] == hit_name.split(" ", 1)[0]:
-                rsplitline = line.rsplit(" ", 1)
-                hit_seq = rsplitline[-1]
-                continue
             if line[0:len("#=GC RF")] == "#=GC RF":
                 rsplitline = line.rsplit(" ", 1)
                 mask_seq = rsplitline[-1]
+                continue
+            if not line.strip() or line[0] == '#' or line.startswith("//"):
+                continue
+            splitline = line.split(" ", 1)
+            rsplitline = line.rsplit(" ", 1)
+            hit_seqs[splitline[0]] = rsplitline[-1]
 
         if mask_seq is None:
             raise Exception("Unable to get mask from hmm align result file")
 
-        if hit_seq is None:
-            return None
+        mask_cols = [pos for pos in xrange(0, len(mask_seq)) if mask_seq[pos] == 'x']
 
-        aligned_marker = ""
-        for pos in xrange(0, len(mask_seq)):
-            if mask_seq[pos] != 'x':
-                continue
-            aligned_marker += hit_seq[pos]
-        return aligned_marker
+        aligned_markers = {}
+        for hit_name, hit_seq in hit_seqs.iteritems():
+            aligned_markers[hit_name] = ''.join([hit_seq[pos] for pos in mask_cols])
+        return aligned_markers
@@ -0,0 +1,312 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import struct
+
+import numpy as np
+
+from Exceptions import GenomeDatabaseError
+
+
+class AlignmentContainer(object):
+    """Binary container holding a concatenated alignment as a uint8 matrix.
+
+    The container consists of a fixed size header, an index of
+    genome identifiers followed by the column mask, and the untrimmed
+    alignment as a row-major uint8 matrix starting at a page boundary
+    so it can be memory-mapped:
+
+        magic           8 bytes, 'GTDBMSA\\0'
+        format_version  uint32
+        has_mask        uint32
+        num_rows        uint64
+        align_len       uint64
+        index_offset    uint64
+        index_length    uint64
+        data_offset     uint64
+
+    All integers are little-endian. The index contains one genome
+    identifier per line and, if present, the mask as a string of
+    '0' and '1' characters of length align_len.
+
+    Example
+    -------
+    container = AlignmentContainer('gtdb_concatenated.bin')
+    container.writeFasta('subset.faa', ['G000005845', 'G000006925'])
+    """
+
+    MAGIC = 'GTDBMSA\0'
+    FORMAT_VERSION = 1
+    HEADER = struct.Struct('<8sIIQQQQQ')
+
+    # alignment of matrix within file
+    PAGE_SIZE = 4096
+
+    # number of rows copied at once when writing
+    BLOCK_ROWS = 4096
+
+    def __init__(self, container_file):
+        """Open container.
+
+        Parameters
+        ----------
+        container_file : str
+            Path to container.
+        """
+
+        self.container_file = container_file
+
+        with open(container_file, 'rb') as f:
+            header = f.read(self.HEADER.size)
+            if len(header) != self.HEADER.size:
+                raise GenomeDatabaseError('File %s is not an alignment container.' % container_file)
+
+            (magic,
+             format_version,
+             has_mask,
+             num_rows,
+             align_len,
+             index_offset,
+             index_length,
+             data_offset) = self.HEADER.unpack(header)
+
+            if magic != self.MAGIC:
+                raise GenomeDatabaseError('File %s is not an alignment container.' % container_file)
+            if format_version != self.FORMAT_VERSION:
+                raise GenomeDatabaseError('Alignment container %s has unsupported format version %d.'
+                                          % (container_file, format_version))
+
+            f.seek(index_offset)
+            index = f.read(index_length)
+
+        if has_mask:
+            index, mask = index[0:len(index) - align_len], index[len(index) - align_len:]
+            self.mask = np.frombuffer(mask, dtype=np.uint8) == ord('1')
+        else:
+            self.mask = np.ones(align_len, dtype=bool)
+
+        self.genome_ids = index.split('\n')[0:num_rows]
+        self.row_index = {genome_id: row for row, genome_id in enumerate(self.genome_ids)}
+
+        if num_rows and align_len:
+            self.matrix = np.memmap(container_file,
+                                    dtype=np.uint8,
+                                    mode='r',
+                                    offset=data_offset,
+                                    shape=(num_rows, align_len))
+        else:
+            self.matrix = np.zeros((num_rows, align_len), dtype=np.uint8)
+
+    @classmethod
+    def write(cls, container_file, genome_ids, matrix, mask=None):
+        """Write alignment to container.
+
+        Parameters
+        ----------
+        container_file : str
+            Path to container.
+        genome_ids : list
+            Identifier of genome in each row of the matrix.
+        matrix : numpy.ndarray
+            Matrix (genomes x alignment length) of uint8 character codes.
+        mask : numpy.ndarray
+            Boolean mask indicating columns retained after trimming, or None.
+        """
+
+        num_rows, align_len = matrix.shape
+        if len(genome_ids) != num_rows:
+            raise GenomeDatabaseError('Alignment matrix has %d rows, but %d genome ids were given.'
+                                      % (num_rows, len(genome_ids)))
+
+        index = '\n'.join(genome_ids) + '\n'
+        if mask is not None:
+            if len(mask) != align_len:
+                raise GenomeDatabaseError('Mask has length %d, expected %d.' % (len(mask), align_len))
+            index += ''.join(['1' if m else '0' for m in mask])
+
+        index_offset = cls.HEADER.size
+        data_offset = index_offset + len(index)
+        data_offset += (cls.PAGE_SIZE - data_offset % cls.PAGE_SIZE) % cls.PAGE_SIZE
+
+        with open(container_file, 'wb') as fout:
+            fout.write(cls.HEADER.pack(cls.MAGIC,
+                                       cls.FORMAT_VERSION,
+                                       1 if mask is not None else 0,
+                                       num_rows,
+                                       align_len,
+                                       index_offset,
+                                       len(index),
+                                       data_offset))
+            fout.write(index)
+            fout.write('\0' * (data_offset - fout.tell()))
+
+            for start in xrange(0, num_rows, cls.BLOCK_ROWS):
+                fout.write(np.ascontiguousarray(matrix[start:start + cls.BLOCK_ROWS]).tostring())
+
+    def __len__(self):
+        return len(self.genome_ids)
+
+    def rows(self, genome_ids=None):
+        """Get rows of genomes in the matrix.
+
+        Parameters
+        ----------
+        genome_ids : iterable
+            Identifiers of genomes, or None for all genomes.
+
+        Returns
+        -------
+        numpy.ndarray
+            Row of each genome.
+        """
+
+        if genome_ids is None:
+            return np.arange(len(self.genome_ids), dtype=np.int64)
+
+        rows = []
+        for genome_id in genome_ids:
+            if genome_id not in self.row_index:
+                raise GenomeDatabaseError('Genome %s is not in alignment container %s.'
+                                          % (genome_id, self.container_file))
+            rows.append(self.row_index[genome_id])
+
+        return np.array(rows, dtype=np.int64)
+
+    def subset(self, genome_ids=None, trimmed=True):
+        """Get alignment of genomes.
+
+        Parameters
+        ----------
+        genome_ids : iterable
+            Identifiers of genomes, or None for all genomes.
+        trimmed : boolean
+            Flag indicating if only columns retained by the mask should be returned.
+
+        Returns
+        -------
+        numpy.ndarray
+            Matrix (genomes x columns) of uint8 character codes.
+        """
+
+        matrix = self.matrix[self.rows(genome_ids)]
+        if trimmed:
+            matrix = matrix[:, self.mask]
+
+        return matrix
+
+    def sequences(self, genome_ids=None, trimmed=True):
+        """Get aligned sequences of genomes.
+
+        Parameters
+        ----------
+        genome_ids : iterable
+            Identifiers of genomes, or None for all genomes.
+        trimmed : boolean
+            Flag indicating if only columns retained by the mask should be returned.
+
+        Returns
+        -------
+        generator
+            Identifier and aligned sequence of each genome.
+        """
+
+        cols = np.flatnonzero(self.mask) if trimmed else slice(None)
+        for row in self.rows(genome_ids):
+            yield self.genome_ids[row], self.matrix[row, cols].tostring()
+
+    def trim(self, min_perc_taxa, consensus, min_perc_aa, genome_ids=None):
+        """Trim alignment of genomes with new trimming parameters.
+
+        Parameters
+        ----------
+        min_perc_taxa : float
+            Minimum percentage of taxa required to retain a column [0,100].
+        consensus : float
+            Minimum percentage of the most common amino acid required to retain a column [0,100].
+        min_perc_aa : float
+            Minimum percentage of amino acids required to retain a genome [0,100].
+        genome_ids : iterable
+            Identifiers of genomes, or None for all genomes.
+
+        Returns
+        -------
+        numpy.ndarray
+            Boolean mask indicating retained columns.
+        numpy.ndarray
+            Boolean array indicating pruned genomes.
+        int
+            Number of columns removed due to insufficient taxa.
+        int
+            Number of columns removed due to poor consensus.
+        """
+
+        from TreeManager import TreeManager
+
+        matrix = self.matrix if genome_ids is None else self.subset(genome_ids, trimmed=False)
+        return TreeManager._trim_seqs(matrix, min_perc_taxa / 100.0, consensus / 100.0, min_perc_aa / 100.0)
+
+    def setMask(self, mask):
+        """Set mask used to trim alignment.
+
+        Parameters
+        ----------
+        mask : numpy.ndarray
+            Boolean mask indicating retained columns.
+        """
+
+        if len(mask) != self.matrix.shape[1]:
+            raise GenomeDatabaseError('Mask has length %d, expected %d.' % (len(mask), self.matrix.shape[1]))
+
+        self.mask = np.asarray(mask, dtype=bool)
+
+    def writeFasta(self, output_file, genome_ids=None, trimmed=True):
+        """Write alignment of genomes in FASTA format.
+
+        Parameters
+        ----------
+        output_file : str
+            Path to output file.
+        genome_ids : iterable
+            Identifiers of genomes, or None for all genomes.
+        trimmed : boolean
+            Flag indicating if only columns retained by the mask should be written.
+        """
+
+        with open(output_file, 'wb') as fout:
+            for genome_id, seq in self.sequences(genome_ids, trimmed):
+                fout.write('>%s\n%s\n' % (genome_id, seq))
+
+    def writePhylip(self, output_file, genome_ids=None, trimmed=True):
+        """Write alignment of genomes in relaxed sequential PHYLIP format.
+
+        Parameters
+        ----------
+        output_file : str
+            Path to output file.
+        genome_ids : iterable
+            Identifiers of genomes, or None for all genomes.
+        trimmed : boolean
+            Flag indicating if only columns retained by the mask should be written.
+        """
+
+        rows = self.rows(genome_ids)
+        align_len = int(self.mask.sum()) if trimmed else self.matrix.shape[1]
+
+        with open(output_file, 'wb') as fout:
+            fout.write('%d %d\n' % (len(rows), align_len))
+            for genome_id, seq in self.sequences(genome_ids, trimmed):
+                fout.write('%s %s\n' % (genome_id, seq))
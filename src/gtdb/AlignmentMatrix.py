@@ -0,0 +1,148 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import numpy as np
+
+from Exceptions import GenomeDatabaseError
+
+
+GAP_CHAR = ord('-')
+
+
+def encodeSeq(seq):
+    """Encode an aligned sequence as an array of uint8 character codes.
+
+    Parameters
+    ----------
+    seq : str
+        Aligned sequence.
+
+    Returns
+    -------
+    numpy.ndarray
+        Character codes of sequence.
+    """
+
+    return np.frombuffer(seq, dtype=np.uint8)
+
+
+class AlignmentMatrix(object):
+    """Aligned sequences encoded as a uint8 matrix for vectorized comparisons."""
+
+    # number of rows compared at once, used to bound
+    # the size of temporary arrays
+    BLOCK_ROWS = 4096
+
+    def __init__(self, seq_ids, matrix):
+        """Initialize.
+
+        Parameters
+        ----------
+        seq_ids : list
+            Identifier of sequence in each row of the matrix.
+        matrix : numpy.ndarray
+            Matrix (rows x alignment length) of uint8 character codes.
+        """
+
+        if len(seq_ids) != matrix.shape[0]:
+            raise GenomeDatabaseError('Alignment matrix has %d rows, but %d sequence ids were given.'
+                                      % (matrix.shape[0], len(seq_ids)))
+
+        self.seq_ids = list(seq_ids)
+        self.matrix = matrix
+
+    @classmethod
+    def fromSeqs(cls, seq_ids, seqs):
+        """Create matrix from aligned sequences.
+
+        Parameters
+        ----------
+        seq_ids : list
+            Identifier of each sequence.
+        seqs : list
+            Aligned sequences, all of the same length.
+
+        Returns
+        -------
+        AlignmentMatrix
+            Encoded alignment.
+        """
+
+        if not seqs:
+            return cls([], np.zeros((0, 0), dtype=np.uint8))
+
+        align_len = len(seqs[0])
+        matrix = np.empty((len(seqs), align_len), dtype=np.uint8)
+        for i, seq in enumerate(seqs):
+            if len(seq) != align_len:
+                raise GenomeDatabaseError('Aligned sequence %s has length %d, expected %d.'
+                                          % (seq_ids[i], len(seq), align_len))
+            matrix[i] = encodeSeq(seq)
+
+        return cls(seq_ids, matrix)
+
+    def __len__(self):
+        return len(self.seq_ids)
+
+    def mismatches(self, query_seq, rows=None):
+        """Count mismatches between a query and sequences in the matrix.
+
+        Mismatches are only counted across positions where
+        both sequences have an amino acid. This is identical
+        to GenomeRepresentativeManager._aai_mismatches, but
+        without early termination.
+
+        Parameters
+        ----------
+        query_seq : str
+            Aligned query sequence.
+        rows : numpy.ndarray
+            Rows to compare to query, or None to compare all rows.
+
+        Returns
+        -------
+        numpy.ndarray
+            Number of mismatches to each compared row of the matrix.
+        """
+
+        num_rows = len(self.seq_ids) if rows is None else len(rows)
+        counts = np.zeros(num_rows, dtype=np.int64)
+        if num_rows == 0:
+            return counts
+
+        query = encodeSeq(query_seq)
+        if query.shape[0] != self.matrix.shape[1]:
+            raise GenomeDatabaseError('Query sequence has length %d, expected %d.'
+                                      % (query.shape[0], self.matrix.shape[1]))
+
+        # only columns where the query has an amino acid can contribute
+        cols = np.flatnonzero(query != GAP_CHAR)
+        if cols.shape[0] == 0:
+            return counts
+        query = query[cols]
+
+        for start in xrange(0, num_rows, self.BLOCK_ROWS):
+            end = min(start + self.BLOCK_ROWS, num_rows)
+            # gaps are identified per block, so a memory-mapped
+            # matrix is never copied into memory in full
+            if rows is None:
+                block = self.matrix[start:end, cols]
+            else:
+                block = self.matrix[rows[start:end, np.newaxis], cols]
+            counts[start:end] = ((block != query) & (block != GAP_CHAR)).sum(axis=1)
+
+        return counts
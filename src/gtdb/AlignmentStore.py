@@ -0,0 +1,360 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import os
+import logging
+import tempfile
+
+import numpy as np
+
+from biolib.common import make_sure_path_exists
+
+from AlignmentMatrix import AlignmentMatrix, encodeSeq
+from Exceptions import GenomeDatabaseError
+
+
+class AlignmentStore(object):
+    """Persistent store of concatenated alignments packed into a memory-mapped matrix.
+
+    Alignments are stored per marker set as a uint8 matrix
+    with one row per genome. An index file records the genome
+    in each row along with a version string derived from the
+    genome's rows in the aligned_markers table, allowing the
+    alignment of individual genomes to be refreshed when their
+    aligned markers change.
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, cur, store_dir):
+        """Initialize.
+
+        Parameters
+        ----------
+        cur : psycopg2.cursor
+            Database cursor.
+        store_dir : str
+            Directory containing packed alignments.
+        """
+
+        self.logger = logging.getLogger()
+
+        self.cur = cur
+        self.store_dir = store_dir
+
+    def markerIndex(self, marker_ids):
+        """Get canonical order of markers within concatenated alignments.
+
+        Parameters
+        ----------
+        marker_ids : iterable
+            Identifiers of markers.
+
+        Returns
+        -------
+        d[marker_id] -> index
+            Position of each marker in concatenated alignments.
+        """
+
+        return {marker_id: i for i, marker_id in enumerate(sorted(marker_ids))}
+
+    def genomeVersions(self, genome_ids, marker_ids):
+        """Get version of aligned markers for each genome.
+
+        The version is a digest over the marker identifiers and
+        row versions (xmin) of a genome's aligned markers so it
+        changes whenever rows are inserted, updated, or deleted.
+
+        Parameters
+        ----------
+        genome_ids : iterable
+            Database identifiers of genomes.
+        marker_ids : iterable
+            Identifiers of markers.
+
+        Returns
+        -------
+        d[genome_id] -> version
+            Version of each genome with aligned markers.
+        """
+
+        if not genome_ids:
+            return {}
+
+        self.cur.execute("SELECT genome_id, " +
+                         "md5(string_agg(marker_id || ':' || xmin::text, ',' ORDER BY marker_id)) " +
+                         "FROM aligned_markers " +
+                         "WHERE genome_id = ANY(%s) " +
+                         "AND marker_id = ANY(%s) " +
+                         "GROUP BY genome_id", (list(genome_ids), list(marker_ids)))
+
+        return {genome_id: version for genome_id, version in self.cur}
+
+    def fetchAlignments(self, genome_ids, marker_ids):
+        """Get concatenated alignments for genomes directly from the database.
+
+        Markers absent from the aligned_markers table are
+        represented by gaps.
+
+        Parameters
+        ----------
+        genome_ids : iterable
+            Database identifiers of genomes.
+        marker_ids : iterable
+            Identifiers of markers.
+
+        Returns
+        -------
+        d[genome_id] -> str
+            Concatenated alignment of each genome.
+        """
+
+        if not genome_ids:
+            return {}
+
+        marker_index = self.markerIndex(marker_ids)
+
+        self.cur.execute("SELECT id, size FROM markers WHERE id = ANY(%s)", (marker_index.keys(),))
+        gap_seqs = [None] * len(marker_index)
+        for marker_id, size in self.cur:
+            gap_seqs[marker_index[marker_id]] = '-' * size
+
+        aligns = {}
+        for genome_id in genome_ids:
+            aligns[genome_id] = list(gap_seqs)
+
+        self.cur.execute("SELECT genome_id, marker_id, sequence " +
+                         "FROM aligned_markers " +
+                         "WHERE genome_id = ANY(%s) " +
+                         "AND marker_id = ANY(%s) " +
+                         "AND sequence IS NOT NULL", (list(genome_ids), marker_index.keys()))
+        for genome_id, marker_id, sequence in self.cur:
+            aligns[genome_id][marker_index[marker_id]] = sequence
+
+        return {genome_id: ''.join(seqs) for genome_id, seqs in aligns.iteritems()}
+
+    def _indexFile(self, marker_set_id):
+        """Get path to index file for marker set."""
+
+        return os.path.join(self.store_dir, 'marker_set_%d.idx' % marker_set_id)
+
+    def _readIndex(self, marker_set_id, marker_ids):
+        """Read index of packed alignments for marker set.
+
+        Returns
+        -------
+        str
+            Path to packed alignment matrix.
+        int
+            Length of concatenated alignments.
+        list
+            Genome in each row of the matrix.
+        list
+            Version of each genome.
+
+        All values are None if the index is missing, of a different
+        format version, or for a different set of markers.
+        """
+
+        index_file = self._indexFile(marker_set_id)
+        if not os.path.exists(index_file):
+            return None, None, None, None
+
+        header = {}
+        genome_ids = []
+        versions = []
+        with open(index_file) as f:
+            for line in f:
+                if line.startswith('#'):
+                    key, value = line[1:].rstrip('\n').split('=', 1)
+                    header[key] = value
+                else:
+                    genome_id, version = line.rstrip('\n').split('\t')
+                    genome_ids.append(int(genome_id))
+                    versions.append(version)
+
+        stored_marker_ids = [int(x) for x in header.get('marker_ids', '').split(',') if x]
+        if (header.get('format_version') != str(self.FORMAT_VERSION)
+                or stored_marker_ids != sorted(marker_ids)):
+            return None, None, None, None
+
+        data_file = os.path.join(self.store_dir, header['data_file'])
+        if genome_ids and not os.path.exists(data_file):
+            return None, None, None, None
+
+        return data_file, int(header['align_len']), genome_ids, versions
+
+    def versions(self, marker_set_id, marker_ids):
+        """Get version of each genome in the store.
+
+        Parameters
+        ----------
+        marker_set_id : int
+            Identifier of marker set.
+        marker_ids : iterable
+            Identifiers of markers in the marker set.
+
+        Returns
+        -------
+        d[genome_id] -> version
+            Version of aligned markers for each stored genome.
+        """
+
+        _data_file, _align_len, stored_ids, stored_versions = self._readIndex(marker_set_id, marker_ids)
+        if stored_ids is None:
+            return {}
+
+        return dict(zip(stored_ids, stored_versions))
+
+    def _writeStore(self, marker_set_id, marker_ids, align_len, genome_ids, versions, rows):
+        """Write packed alignment matrix and its index.
+
+        The matrix is written to a new file and the index is
+        atomically replaced so concurrent readers always see a
+        consistent matrix and index.
+
+        Returns
+        -------
+        str
+            Path to packed alignment matrix.
+        """
+
+        make_sure_path_exists(self.store_dir)
+
+        fd, data_file = tempfile.mkstemp(prefix='marker_set_%d.' % marker_set_id,
+                                         suffix='.aln',
+                                         dir=self.store_dir)
+        os.close(fd)
+
+        if genome_ids:
+            matrix = np.memmap(data_file, dtype=np.uint8, mode='w+', shape=(len(genome_ids), align_len))
+            for i, row in enumerate(rows):
+                matrix[i] = row
+            matrix.flush()
+            del matrix
+
+        fd, tmp_index_file = tempfile.mkstemp(suffix='.idx.tmp', dir=self.store_dir)
+        with os.fdopen(fd, 'w') as fout:
+            fout.write('#format_version=%d\n' % self.FORMAT_VERSION)
+            fout.write('#marker_ids=%s\n' % ','.join(map(str, sorted(marker_ids))))
+            fout.write('#align_len=%d\n' % align_len)
+            fout.write('#data_file=%s\n' % os.path.basename(data_file))
+            for genome_id, version in zip(genome_ids, versions):
+                fout.write('%d\t%s\n' % (genome_id, version))
+
+        # matrix referenced by the current index, which may be
+        # for a different format version or set of markers
+        old_data_file = None
+        if os.path.exists(self._indexFile(marker_set_id)):
+            for line in open(self._indexFile(marker_set_id)):
+                if line.startswith('#data_file='):
+                    old_data_file = os.path.join(self.store_dir, line.rstrip('\n').split('=', 1)[1])
+                    break
+
+        os.rename(tmp_index_file, self._indexFile(marker_set_id))
+
+        if old_data_file and old_data_file != data_file and os.path.exists(old_data_file):
+            os.remove(old_data_file)
+
+        return data_file
+
+    def alignments(self, marker_set_id, marker_ids, genome_ids):
+        """Get packed concatenated alignments for genomes.
+
+        Genomes missing from the store, or whose aligned markers
+        have changed, are retrieved from the database in a single
+        query and the store is updated. Rows are returned in the
+        order they are stored, which may differ from genome_ids.
+
+        Parameters
+        ----------
+        marker_set_id : int
+            Identifier of marker set.
+        marker_ids : iterable
+            Identifiers of markers in the marker set.
+        genome_ids : iterable
+            Database identifiers of genomes.
+
+        Returns
+        -------
+        AlignmentMatrix
+            Concatenated alignments backed by a read-only memory map.
+        """
+
+        genome_ids = list(genome_ids)
+        requested = set(genome_ids)
+        db_versions = self.genomeVersions(genome_ids, marker_ids)
+
+        data_file, align_len, stored_ids, stored_versions = self._readIndex(marker_set_id, marker_ids)
+        if stored_ids is None:
+            stored_ids = []
+            stored_versions = []
+
+        stored_matrix = None
+        if stored_ids:
+            stored_matrix = np.memmap(data_file, dtype=np.uint8, mode='r', shape=(len(stored_ids), align_len))
+
+        # retain rows of requested genomes which are up-to-date
+        retained = []
+        for row, (genome_id, version) in enumerate(zip(stored_ids, stored_versions)):
+            if genome_id in requested and db_versions.get(genome_id, '') == version:
+                retained.append((genome_id, version, row))
+
+        retained_ids = set(genome_id for genome_id, _version, _row in retained)
+        stale_ids = [genome_id for genome_id in genome_ids if genome_id not in retained_ids]
+
+        if not stale_ids and len(retained) == len(stored_ids):
+            if not stored_ids:
+                return AlignmentMatrix.fromSeqs([], [])
+            return AlignmentMatrix(stored_ids, stored_matrix)
+
+        self.logger.info('Updating packed alignments for %d genomes in marker set %d.'
+                         % (len(stale_ids), marker_set_id))
+        new_aligns = self.fetchAlignments(stale_ids, marker_ids)
+
+        if new_aligns:
+            new_align_len = len(new_aligns.itervalues().next())
+            if retained and new_align_len != align_len:
+                # marker sizes have changed so all rows must be rebuilt
+                retained = []
+                stale_ids = genome_ids
+                new_aligns = self.fetchAlignments(stale_ids, marker_ids)
+            align_len = new_align_len
+
+        new_ids = [genome_id for genome_id, _version, _row in retained] + stale_ids
+        if not align_len:
+            # nothing to pack for an empty marker set
+            return AlignmentMatrix.fromSeqs(new_ids, [''] * len(new_ids))
+
+        def rows():
+            for _genome_id, _version, row in retained:
+                yield stored_matrix[row]
+            for genome_id in stale_ids:
+                if len(new_aligns[genome_id]) != align_len:
+                    raise GenomeDatabaseError('Concatenated alignment of genome %d has length %d, expected %d.'
+                                              % (genome_id, len(new_aligns[genome_id]), align_len))
+                yield encodeSeq(new_aligns[genome_id])
+
+        new_versions = [version for _genome_id, version, _row in retained] + [db_versions.get(genome_id, '')
+                                                                                for genome_id in stale_ids]
+        data_file = self._writeStore(marker_set_id, marker_ids, align_len, new_ids, new_versions, rows())
+        stored_matrix = None
+
+        if not new_ids:
+            return AlignmentMatrix.fromSeqs([], [])
+
+        return AlignmentMatrix(new_ids, np.memmap(data_file, dtype=np.uint8, mode='r', shape=(len(new_ids), align_len)))
@@ -0,0 +1,215 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+# PostgreSQL type codes of columns returned as floats
+FLOAT_TYPE_CODES = (700, 701)
+
+# PostgreSQL type codes of columns returned as strings
+TEXT_TYPE_CODES = (18, 19, 25, 1042, 1043)
+
+
+def _formatFloat(value):
+    """Format value of a float column."""
+
+    if value is None:
+        return 'None'
+
+    return '%.4g' % value
+
+
+def _formatText(value):
+    """Format value of a text column, replacing equal signs as these are incompatible with the ARB parser."""
+
+    if value is None:
+        return 'None'
+
+    return str(value).replace('=', '/')
+
+
+def _formatValue(value):
+    """Format value of a column of any type."""
+
+    if isinstance(value, float):
+        return '%.4g' % value
+
+    return str(value).replace('=', '/')
+
+
+class ArbMetadataWriter(object):
+    """Write ARB import filter and metadata records for genomes.
+
+    The formatting function of each metadata field and a template
+    for complete records are determined once from the columns of the
+    metadata query, so each record is produced by a single string
+    formatting operation and records are written in large blocks.
+    """
+
+    # number of records written at once
+    WRITE_BLOCK_RECORDS = 1000
+
+    # size of output buffer
+    BUFFER_SIZE = 1 << 20
+
+    def __init__(self, description, num_marker_genes):
+        """Initialize.
+
+        Parameters
+        ----------
+        description : list
+            Description of columns in metadata query (psycopg2 cursor.description).
+        num_marker_genes : int
+            Number of marker genes in MSA.
+        """
+
+        col_headers = [desc[0] for desc in description]
+        type_codes = [desc[1] if len(desc) > 1 else None for desc in description]
+
+        self.genome_id_index = col_headers.index('id')
+        self.genome_name_index = col_headers.index('accession')
+        self.num_marker_genes = num_marker_genes
+
+        # metadata fields written to records, excluding the genome
+        # identifier and name which are handled as a special case
+        self.field_indices = [i for i in xrange(len(col_headers))
+                              if i not in (self.genome_id_index, self.genome_name_index)]
+        self.metadata_fields = [col_headers[i] for i in self.field_indices]
+
+        self.formatters = []
+        for i in self.field_indices:
+            if type_codes[i] in FLOAT_TYPE_CODES:
+                self.formatters.append(_formatFloat)
+            elif type_codes[i] in TEXT_TYPE_CODES:
+                self.formatters.append(_formatText)
+            else:
+                self.formatters.append(_formatValue)
+
+        # NCBI genomes are labelled with their NCBI organism name
+        self.organism_name_pos = None
+        self.ncbi_organism_name_pos = None
+        if 'organism_name' in self.metadata_fields and 'ncbi_organism_name' in self.metadata_fields:
+            self.organism_name_pos = self.metadata_fields.index('organism_name')
+            self.ncbi_organism_name_pos = self.metadata_fields.index('ncbi_organism_name')
+
+        self.record_template = ('BEGIN\ndb_name=%s\n'
+                                + ''.join(['%s=%%s\n' % field.replace('%', '%%') for field in self.metadata_fields])
+                                + 'msa_gene_count=%d\n'
+                                + 'msa_num_marker_genes=%d\n'
+                                + 'msa_aa_count=%d\n'
+                                + 'msa_length=%d\n'
+                                + 'multiple_homologs=%d\n'
+                                + 'aligned_seq=%s\n'
+                                + 'END\n\n')
+
+    def writeImportFilter(self, output_file):
+        """Create ARB import filter.
+
+        Parameters
+        ----------
+        output_file : str
+            Name of output file.
+        """
+        fout = open(output_file, 'w')
+        fout.write('AUTODETECT\t"BEGIN"\n\n')
+        fout.write('BEGIN\t"BEGIN*"\n\n')
+
+        fout.write('MATCH\t"%s\\=*"\n' % 'db_name')
+        fout.write('\tSRT "*\\=="\n')
+        fout.write('\tWRITE "%s"\n\n' % 'name')
+
+        # place organism name near top for convenience
+        fout.write('MATCH\t"%s\\=*"\n' % 'organism_name')
+        fout.write('\tSRT "*\\=="\n')
+        fout.write('\tWRITE "%s"\n\n' % 'organism_name')
+
+        fields = self.metadata_fields + ['msa_gene_count',
+                                         'msa_num_marker_genes',
+                                         'msa_aa_count',
+                                         'msa_length',
+                                         'multiple_homologs']
+        for field in fields:
+            if field != 'organism_name':
+                fout.write('MATCH\t"%s\\=*"\n' % field)
+                fout.write('\tSRT "*\\=="\n')
+                fout.write('\tWRITE "%s"\n\n' % field)
+
+        fout.write('SEQUENCEAFTER\t"multiple_homologs*"\n')
+        fout.write('SEQUENCESRT\t"*\\=="\n')
+        fout.write('SEQUENCEEND\t"END"\n\n')
+        fout.write('END\t"END"\n')
+
+        fout.close()
+
+    def record(self, genome_metadata, multiple_hit_count, msa_gene_count, aligned_seq, aa_count):
+        """Create ARB record for genome.
+
+        Parameters
+        ----------
+        genome_metadata : tuple
+            Row of metadata query for genome.
+        multiple_hit_count : int
+            Number of markers with multiple hits.
+        msa_gene_count : int
+            Number of markers with a single hit.
+        aligned_seq : str
+            Trimmed concatenated alignment of genome, or an empty string.
+        aa_count : int
+            Number of non-gap characters in aligned_seq.
+
+        Returns
+        -------
+        str
+            ARB record.
+        """
+
+        external_genome_id = genome_metadata[self.genome_name_index]
+
+        values = [fmt(genome_metadata[i]) for fmt, i in zip(self.formatters, self.field_indices)]
+        if (self.organism_name_pos is not None
+                and (external_genome_id.startswith('GB') or external_genome_id.startswith('RS'))):
+            values[self.organism_name_pos] = values[self.ncbi_organism_name_pos]
+
+        return self.record_template % tuple([external_genome_id]
+                                             + values
+                                             + [msa_gene_count,
+                                                self.num_marker_genes,
+                                                aa_count,
+                                                len(aligned_seq),
+                                                multiple_hit_count,
+                                                aligned_seq])
+
+    def write(self, output_file, records):
+        """Write ARB metadata file.
+
+        Parameters
+        ----------
+        output_file : str
+            Name of output file.
+        records : iterable
+            Arguments of record() for each genome.
+        """
+
+        fout = open(output_file, 'wb', self.BUFFER_SIZE)
+
+        block = []
+        for record_args in records:
+            block.append(self.record(*record_args))
+            if len(block) == self.WRITE_BLOCK_RECORDS:
+                fout.write(''.join(block))
+                block = []
+        fout.write(''.join(block))
+
+        fout.close()
@@ -0,0 +1,293 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import os
+import logging
+import tempfile
+
+import numpy as np
+
+from biolib.common import make_sure_path_exists
+
+from AlignmentMatrix import AlignmentMatrix, GAP_CHAR, encodeSeq
+from Exceptions import GenomeDatabaseError
+
+
+class CandidateIndex(object):
+    """Pre-filter identifying representatives which may be assigned to a genome.
+
+    The index holds the representative alignments restricted
+    to a fixed subset of highly variable columns. Mismatches
+    are only counted at positions where both sequences have an
+    amino acid, so the mismatches between a genome and a
+    representative across these columns is a lower bound on
+    their mismatches across the full alignment.
+
+    A representative is only assigned to a genome if it has
+    zero mismatches, or fewer than the maximum allowed number
+    of mismatches (see GenomeRepresentativeManager._closestRepresentative).
+    Representatives with a lower bound that is both non-zero and
+    at least the maximum allowed number of mismatches can
+    therefore never be assigned and are pruned. All other
+    representatives, including every representative with the
+    minimum number of mismatches below the threshold, are retained
+    so assignments are identical to those without pre-filtering.
+    """
+
+    FORMAT_VERSION = 1
+
+    # maximum number of rows used to select columns
+    SAMPLE_ROWS = 1024
+
+    def __init__(self, store_dir, marker_set_id, num_columns):
+        """Initialize.
+
+        Parameters
+        ----------
+        store_dir : str
+            Directory containing index.
+        marker_set_id : int
+            Identifier of marker set.
+        num_columns : int
+            Number of alignment columns used by the pre-filter.
+        """
+
+        self.logger = logging.getLogger()
+
+        self.store_dir = store_dir
+        self.marker_set_id = marker_set_id
+        self.num_columns = num_columns
+
+        self.align_len = None
+        self.columns = None
+        self.bounds = None
+
+    def _indexFile(self):
+        """Get path to index file."""
+
+        return os.path.join(self.store_dir, 'marker_set_%d.cand' % self.marker_set_id)
+
+    def _readIndex(self, align_len):
+        """Read index of pre-filter for marker set.
+
+        Returns
+        -------
+        str
+            Path to column subset matrix.
+        list
+            Alignment columns in matrix.
+        list
+            Genome in each row of the matrix.
+        list
+            Version of each genome.
+
+        All values are None if the index is missing, of a different
+        format version, or for alignments of a different length.
+        """
+
+        index_file = self._indexFile()
+        if not os.path.exists(index_file):
+            return None, None, None, None
+
+        header = {}
+        genome_ids = []
+        versions = []
+        with open(index_file) as f:
+            for line in f:
+                if line.startswith('#'):
+                    key, value = line[1:].rstrip('\n').split('=', 1)
+                    header[key] = value
+                else:
+                    genome_id, version = line.rstrip('\n').split('\t')
+                    genome_ids.append(int(genome_id))
+                    versions.append(version)
+
+        if (header.get('format_version') != str(self.FORMAT_VERSION)
+                or header.get('align_len') != str(align_len)
+                or header.get('num_columns') != str(self.num_columns)):
+            return None, None, None, None
+
+        columns = [int(x) for x in header.get('columns', '').split(',') if x]
+        data_file = os.path.join(self.store_dir, header['data_file'])
+        if genome_ids and not os.path.exists(data_file):
+            return None, None, None, None
+
+        return data_file, columns, genome_ids, versions
+
+    def _selectColumns(self, rep_matrix):
+        """Select the most variable alignment columns.
+
+        Columns are scored by the probability that two randomly
+        chosen representatives both have an amino acid in the
+        column and differ, estimated from a sample of rows.
+
+        Parameters
+        ----------
+        rep_matrix : AlignmentMatrix
+            Alignments of representatives.
+
+        Returns
+        -------
+        numpy.ndarray
+            Selected columns in ascending order.
+        """
+
+        num_rows, align_len = rep_matrix.matrix.shape
+        num_columns = min(self.num_columns, align_len)
+
+        rows = np.unique(np.linspace(0, num_rows - 1, min(num_rows, self.SAMPLE_ROWS)).astype(np.int64))
+        sample = np.asarray(rep_matrix.matrix[rows])
+
+        non_gap = (sample != GAP_CHAR).sum(axis=0).astype(np.float64)
+        same_pairs = np.zeros(align_len, dtype=np.float64)
+        for code in np.unique(sample):
+            if code == GAP_CHAR:
+                continue
+            count = (sample == code).sum(axis=0).astype(np.float64)
+            same_pairs += count * count
+
+        score = (non_gap * non_gap - same_pairs) / (float(len(rows)) ** 2)
+
+        # stable sort so ties are broken by column position
+        columns = np.argsort(-score, kind='mergesort')[0:num_columns]
+        return np.sort(columns)
+
+    def load(self, rep_matrix, versions):
+        """Load pre-filter for representatives, updating it as required.
+
+        Rows for representatives already in the index are reused
+        and only new or changed representatives are read from their
+        full alignments.
+
+        Parameters
+        ----------
+        rep_matrix : AlignmentMatrix
+            Alignments of representatives.
+        versions : d[genome_id] -> version
+            Version of aligned markers for each representative.
+        """
+
+        num_rows, align_len = rep_matrix.matrix.shape
+        self.align_len = align_len
+        if num_rows == 0 or align_len == 0:
+            self.columns = np.zeros(0, dtype=np.int64)
+            self.bounds = AlignmentMatrix(rep_matrix.seq_ids, np.zeros((num_rows, 0), dtype=np.uint8))
+            return
+
+        data_file, columns, stored_ids, stored_versions = self._readIndex(align_len)
+        if columns is None:
+            columns = self._selectColumns(rep_matrix)
+            stored_ids = []
+            stored_versions = []
+        else:
+            columns = np.array(columns, dtype=np.int64)
+
+        rep_versions = [versions.get(genome_id, '') for genome_id in rep_matrix.seq_ids]
+        if stored_ids == rep_matrix.seq_ids and stored_versions == rep_versions:
+            self.columns = columns
+            self.bounds = AlignmentMatrix(stored_ids, np.memmap(data_file,
+                                                                dtype=np.uint8,
+                                                                mode='r',
+                                                                shape=(num_rows, len(columns))))
+            return
+
+        stored_row = {}
+        for row, (genome_id, version) in enumerate(zip(stored_ids, stored_versions)):
+            stored_row[(genome_id, version)] = row
+
+        stored_matrix = None
+        if stored_ids:
+            stored_matrix = np.memmap(data_file, dtype=np.uint8, mode='r', shape=(len(stored_ids), len(columns)))
+
+        make_sure_path_exists(self.store_dir)
+        fd, new_data_file = tempfile.mkstemp(prefix='marker_set_%d.' % self.marker_set_id,
+                                             suffix='.cand',
+                                             dir=self.store_dir)
+        os.close(fd)
+
+        num_new = 0
+        matrix = np.memmap(new_data_file, dtype=np.uint8, mode='w+', shape=(num_rows, len(columns)))
+        for row, (genome_id, version) in enumerate(zip(rep_matrix.seq_ids, rep_versions)):
+            stored = stored_row.get((genome_id, version))
+            if stored is not None:
+                matrix[row] = stored_matrix[stored]
+            else:
+                matrix[row] = rep_matrix.matrix[row, columns]
+                num_new += 1
+        matrix.flush()
+        del matrix
+        stored_matrix = None
+
+        self.logger.info('Added %d representatives to pre-filter for marker set %d.' % (num_new, self.marker_set_id))
+
+        fd, tmp_index_file = tempfile.mkstemp(suffix='.cand.tmp', dir=self.store_dir)
+        with os.fdopen(fd, 'w') as fout:
+            fout.write('#format_version=%d\n' % self.FORMAT_VERSION)
+            fout.write('#align_len=%d\n' % align_len)
+            fout.write('#num_columns=%d\n' % self.num_columns)
+            fout.write('#columns=%s\n' % ','.join(map(str, columns)))
+            fout.write('#data_file=%s\n' % os.path.basename(new_data_file))
+            for genome_id, version in zip(rep_matrix.seq_ids, rep_versions):
+                fout.write('%d\t%s\n' % (genome_id, version))
+
+        # matrix referenced by the current index, which may be
+        # for a different format version or alignment length
+        old_data_file = None
+        if os.path.exists(self._indexFile()):
+            for line in open(self._indexFile()):
+                if line.startswith('#data_file='):
+                    old_data_file = os.path.join(self.store_dir, line.rstrip('\n').split('=', 1)[1])
+                    break
+
+        os.rename(tmp_index_file, self._indexFile())
+
+        if old_data_file and old_data_file != new_data_file and os.path.exists(old_data_file):
+            os.remove(old_data_file)
+
+        self.columns = columns
+        self.bounds = AlignmentMatrix(rep_matrix.seq_ids, np.memmap(new_data_file,
+                                                                    dtype=np.uint8,
+                                                                    mode='r',
+                                                                    shape=(num_rows, len(columns))))
+
+    def candidates(self, query_seq, max_mismatches):
+        """Identify representatives which may be assigned to a genome.
+
+        Parameters
+        ----------
+        query_seq : str
+            Aligned query sequence.
+        max_mismatches : float
+            Maximum allowed mismatches.
+
+        Returns
+        -------
+        numpy.ndarray
+            Rows of representatives which can not be excluded.
+        """
+
+        if len(self.columns) == 0:
+            return np.arange(len(self.bounds), dtype=np.int64)
+
+        if len(query_seq) != self.align_len:
+            raise GenomeDatabaseError('Query sequence has length %d, expected %d.'
+                                      % (len(query_seq), self.align_len))
+
+        query = encodeSeq(query_seq)[self.columns].tostring()
+        lower_bounds = self.bounds.mismatches(query)
+
+        return np.flatnonzero((lower_bounds < max_mismatches) | (lower_bounds == 0))
@@ -24,6 +24,8 @@ GTDB_DPRCTD_RSQ_DIR = GTDB_DPRCTD_ROOT
 NCBI_ANNOTATION_DIR = 'prodigal'
 USER_ANNOTATION_DIR = NCBI_ANNOTATION_DIR
 
+GTDB_CACHE_DIR = GTDB_GENOME_ROOT + 'cache/'  # SET TO None TO DISABLE CACHING
+
 # Block Insertion/Deletion of genomes during updates
 # True : Stops Add/Delete
 # False : Allows Add/Delete
@@ -23,6 +23,30 @@ DEFAULT_QUALITY_WEIGHT = 5
 AAI_CLUSTERING_THRESHOLD = 0.995
 DEFAULT_DOMAIN_THRESHOLD = 10.0
 
+# NUMBER OF GENOMES RETRIEVED FROM THE DATABASE AT ONCE WHEN ASSIGNING REPRESENTATIVES
+REP_ASSIGNMENT_BATCH_SIZE = 1000
+
+# NUMBER OF ALIGNMENT COLUMNS USED TO PRE-FILTER CANDIDATE REPRESENTATIVES
+REP_PREFILTER_COLUMNS = 2048
+
+# NUMBER OF GENOMES WHOSE GENES ARE ALIGNED WITH A SINGLE CALL TO HMMALIGN PER MARKER
+HMMALIGN_BATCH_SIZE = 100
+
+# NUMBER OF TIMES ALIGNMENT OF A BATCH OF GENOMES IS RETRIED BEFORE IT IS REPORTED AS FAILED
+HMMALIGN_RETRIES = 2
+
+# NUMBER OF SECONDS BETWEEN UPDATES OF THE PROGRESS LINE OF A RUNNING STAGE
+PROGRESS_INTERVAL = 5
+
+# NUMBER OF GENOMES PER WORKER THAT MAY WAIT FOR EACH STAGE OF THE PIPELINE FOR ADDING GENOMES
+GENOME_PIPELINE_QUEUED_PER_WORKER = 2
+
+# NUMBER OF GENOMES INSERTED INTO A METADATA TABLE WITH A SINGLE STATEMENT
+METADATA_INSERT_BATCH_SIZE = 1000
+
+# MINIMUM NUMBER OF AMBIGUOUS BASES SEPARATING CONTIGS WITHIN A SCAFFOLD
+CONTIG_BREAK = 10
+
 # PARAMETERS FOR EXCEPTION LIST CREATION
 EXCEPTION_FILTER_ONE_CHECKM_COMPLETENESS = 50.0
 EXCEPTION_FILTER_ONE_CHECKM_CONTAMINATION = 15.0
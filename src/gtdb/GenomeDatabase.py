@@ -35,6 +35,7 @@ from MetadataManager import MetadataManager
 from TreeManager import TreeManager
 from AlignedMarkerManager import AlignedMarkerManager
 from GenomeRepresentativeManager import GenomeRepresentativeManager
+from RunProfiler import RunProfiler
 from PowerUserManager import PowerUserManager
 
 
@@ -754,108 +755,230 @@ class GenomeDatabase(object):
                      rep_genome_ids,
                      alignment,
                      individual,
-                     build_tree=True):
+                     build_tree=True,
+                     previous_dir=None,
+                     previous_prefix=None,
+                     binary=False,
+                     compression=None,
+                     progress=False):
+
+        # check for optional packages before any work starts
+        if individual and compression == 'zstd':
+            try:
+                TreeManager._zstandard()
+            except GenomeDatabaseError as e:
+                self.ReportError(e.message)
+                return False
+
+        profiler = RunProfiler('tree_data', progress)
+        profiler.parameters = {'genomes': len(genome_ids),
+                               'markers': len(marker_ids),
+                               'threads': self.threads,
+                               'min_perc_aa': min_perc_aa,
+                               'min_perc_taxa': min_perc_taxa,
+                               'consensus': consensus,
+                               'previous_dir': previous_dir}
+        profiler.instrumentConnection(self.conn.conn)
 
         try:
-            cur = self.conn.cursor()
+            try:
+                cur = self.conn.cursor()
+
+                # ensure all genomes have been assigned to a representatives
+                with profiler.stage('assign_representatives'):
+                    genome_rep_mngr = GenomeRepresentativeManager(cur, self.currentUser, self.threads, self.db_release)
+                    genome_rep_mngr.assignToRepresentative()
+
+                with profiler.stage('select_genomes'):
+                    # get all guaranteed genomes
+                    genome_mngr = GenomeManager(cur, self.currentUser)
+                    genome_list_mngr = GenomeListManager(cur, self.currentUser)
+
+                    guaranteed_ids = set()
+                    if guaranteed_genome_ids:
+                        list_genome_ids = [x.strip()
+                                           for x in guaranteed_genome_ids.split(",")]
+                        db_genome_ids = genome_mngr.externalGenomeIdsToGenomeIds(list_genome_ids)
+                        guaranteed_ids.update(db_genome_ids)
+
+                    if guaranteed_genome_list_ids:
+                        guaranteed_genome_list_ids = [x.strip()
+                                                      for x in guaranteed_genome_list_ids.split(",")]
+                        db_genome_ids = genome_list_mngr.getGenomeIdsFromGenomeListIds(
+                            guaranteed_genome_list_ids)
+                        guaranteed_ids.update(db_genome_ids)
+
+                    if guaranteed_batchfile:
+                        batch_genome_id = []
+                        for line in open(guaranteed_batchfile):
+                            if line[0] == '#':
+                                continue
+                            batch_genome_id.append(line.strip().split('\t')[0])
+
+                        db_genome_ids = genome_mngr.externalGenomeIdsToGenomeIds(batch_genome_id)
+                        guaranteed_ids.update(db_genome_ids)
+
+                    # genome all genomes marked for exclusion
+                    genomes_to_exclude = set()
+                    if excluded_genome_ids:
+                        excluded_genome_ids = [x.strip()
+                                               for x in excluded_genome_ids.split(",")]
+                        db_genome_ids = genome_mngr.externalGenomeIdsToGenomeIds(excluded_genome_ids)
+                        genomes_to_exclude.update(db_genome_ids)
+
+                    if excluded_genome_list_ids:
+                        excluded_genome_list_ids = [x.strip()
+                                                    for x in excluded_genome_list_ids.split(",")]
+                        db_genome_ids = genome_list_mngr.getGenomeIdsFromGenomeListIds(excluded_genome_list_ids)
+                        genomes_to_exclude.update(db_genome_ids)
+
+                # make sure all markers are aligned
+                with profiler.stage('align_markers'):
+                    aligned_mngr = AlignedMarkerManager(cur, self.threads, self.db_release)
+                    aligned_mngr.calculateAlignedMarkerSets(genome_ids, marker_ids)
+
+                # create tree data
+                self.logger.info('Creating tree data for %d genomes using %d marker genes.' %
+                                 (len(genome_ids), len(marker_ids)))
+                self.logger.info('Tree contains %d representative genomes.' % len(rep_genome_ids))
+
+                tree_mngr = TreeManager(cur, self.currentUser, self.threads, self.db_release)
+
+                # read previous genomes before filtering overwrites them
+                # when tree data is updated in place
+                if previous_prefix is None:
+                    previous_prefix = prefix
+                previous_genomes = None
+                if previous_dir:
+                    previous_genomes = tree_mngr.previousGenomes(previous_dir, previous_prefix)
+
+                with profiler.stage('filter_genomes'):
+                    genomes_to_retain, chosen_markers_order, chosen_markers = tree_mngr.filterGenomes(marker_ids,
+                                                                                                      genome_ids,
+                                                                                                      quality_threshold,
+                                                                                                      quality_weight,
+                                                                                                      comp_threshold,
+                                                                                                      cont_threshold,
+                                                                                                      min_perc_aa,
+                                                                                                      min_rep_perc_aa,
+                                                                                                      taxa_filter,
+                                                                                                      guaranteed_taxa_filter,
+                                                                                                      genomes_to_exclude,
+                                                                                                      guaranteed_ids,
+                                                                                                      rep_genome_ids,
+                                                                                                      directory,
+                                                                                                      prefix)
+
+                if len(genomes_to_retain) == 0:
+                    self.logger.warning('No genomes left after filtering.')
+                    return True
+
+                with profiler.stage('write_files'):
+                    msa_file = tree_mngr.writeFiles(marker_ids,
+                                                    genomes_to_retain,
+                                                    min_perc_taxa,
+                                                    consensus,
+                                                    min_perc_aa,
+                                                    chosen_markers_order,
+                                                    chosen_markers,
+                                                    alignment,
+                                                    individual,
+                                                    directory,
+                                                    prefix,
+                                                    previous_dir,
+                                                    previous_prefix,
+                                                    binary,
+                                                    compression,
+                                                    previous_genomes)
+
+                self.conn.commit()
+
+            except GenomeDatabaseError as e:
+                self.ReportError(e.message)
+                return False
+
+            if build_tree:
+                self.logger.info(
+                    'Inferring tree for %d genomes under the WAG and GAMMA models.' % len(genomes_to_retain))
+
+                with profiler.stage('infer_tree'):
+                    output_tree = os.path.join(
+                        directory, prefix + '_phylogeny.wag_gamma.tree')
+                    output_tree_log = os.path.join(directory, prefix + '_fasttree.log')
+                    log_file = os.path.join(directory, prefix + '_fasttree_output.txt')
+
+                    fasttree = FastTree(multithreaded=True)
+                    fasttree.run(
+                        msa_file, 'prot', 'wag', output_tree, output_tree_log, log_file)
+        finally:
+            profiler.releaseConnection()
+            profiler.writeReport(os.path.join(directory, prefix + '_run_report.json'))
 
-            # ensure all genomes have been assigned to a representatives
-            genome_rep_mngr = GenomeRepresentativeManager(cur, self.currentUser, self.threads, self.db_release)
-            genome_rep_mngr.assignToRepresentative()
-
-            # get all guaranteed genomes
-            genome_mngr = GenomeManager(cur, self.currentUser)
-            genome_list_mngr = GenomeListManager(cur, self.currentUser)
+        self.logger.info('Done.')
 
-            guaranteed_ids = set()
-            if guaranteed_genome_ids:
-                list_genome_ids = [x.strip()
-                                   for x in guaranteed_genome_ids.split(",")]
-                db_genome_ids = genome_mngr.externalGenomeIdsToGenomeIds(list_genome_ids)
-                guaranteed_ids.update(db_genome_ids)
-
-            if guaranteed_genome_list_ids:
-                guaranteed_genome_list_ids = [x.strip()
-                                              for x in guaranteed_genome_list_ids.split(",")]
-                db_genome_ids = genome_list_mngr.getGenomeIdsFromGenomeListIds(
-                    guaranteed_genome_list_ids)
-                guaranteed_ids.update(db_genome_ids)
-
-            if guaranteed_batchfile:
-                batch_genome_id = []
-                for line in open(guaranteed_batchfile):
-                    if line[0] == '#':
-                        continue
-                    batch_genome_id.append(line.strip().split('\t')[0])
-
-                db_genome_ids = genome_mngr.externalGenomeIdsToGenomeIds(batch_genome_id)
-                guaranteed_ids.update(db_genome_ids)
-
-            # genome all genomes marked for exclusion
-            genomes_to_exclude = set()
-            if excluded_genome_ids:
-                excluded_genome_ids = [x.strip()
-                                       for x in excluded_genome_ids.split(",")]
-                db_genome_ids = genome_mngr.externalGenomeIdsToGenomeIds(excluded_genome_ids)
-                genomes_to_exclude.update(db_genome_ids)
-
-            if excluded_genome_list_ids:
-                excluded_genome_list_ids = [x.strip()
-                                            for x in excluded_genome_list_ids.split(",")]
-                db_genome_ids = genome_list_mngr.getGenomeIdsFromGenomeListIds(excluded_genome_list_ids)
-                genomes_to_exclude.update(db_genome_ids)
-
-            # make sure all markers are aligned
-            aligned_mngr = AlignedMarkerManager(cur, self.threads, self.db_release)
-            aligned_mngr.calculateAlignedMarkerSets(genome_ids, marker_ids)
-
-            # create tree data
-            self.logger.info('Creating tree data for %d genomes using %d marker genes.' %
-                             (len(genome_ids), len(marker_ids)))
-            self.logger.info('Tree contains %d representative genomes.' % len(rep_genome_ids))
-
-            tree_mngr = TreeManager(cur, self.currentUser)
-            genomes_to_retain, chosen_markers_order, chosen_markers = tree_mngr.filterGenomes(marker_ids,
-                                                                                              genome_ids,
-                                                                                              quality_threshold,
-                                                                                              quality_weight,
-                                                                                              comp_threshold,
-                                                                                              cont_threshold,
-                                                                                              min_perc_aa,
-                                                                                              min_rep_perc_aa,
-                                                                                              taxa_filter,
-                                                                                              guaranteed_taxa_filter,
-                                                                                              genomes_to_exclude,
-                                                                                              guaranteed_ids,
-                                                                                              rep_genome_ids,
-                                                                                              directory,
-                                                                                              prefix)
-
-            if len(genomes_to_retain) == 0:
-                self.logger.warning('No genomes left after filtering.')
-                return True
+        return True
 
-            msa_file = tree_mngr.writeFiles(marker_ids,
-                                            genomes_to_retain,
-                                            min_perc_taxa,
-                                            consensus,
-                                            min_perc_aa,
-                                            chosen_markers_order,
-                                            chosen_markers,
-                                            alignment,
-                                            individual,
-                                            directory,
-                                            prefix)
+    def SubsetTreeData(self,
+                       source_dir,
+                       source_prefix,
+                       genome_list_ids,
+                       genome_ids,
+                       taxa_filter,
+                       quality_threshold,
+                       quality_weight,
+                       comp_threshold,
+                       cont_threshold,
+                       min_perc_taxa,
+                       consensus,
+                       min_perc_aa,
+                       alignment,
+                       binary,
+                       directory,
+                       prefix,
+                       build_tree=True):
+        try:
+            cur = self.conn.cursor()
 
-            self.conn.commit()
+            selected_ids = None
+            if genome_list_ids or genome_ids:
+                selected_ids = set()
+
+                if genome_list_ids:
+                    genome_list_mngr = GenomeListManager(cur, self.currentUser)
+                    genome_list_ids = [x.strip() for x in genome_list_ids.split(",")]
+                    selected_ids.update(genome_list_mngr.getGenomeIdsFromGenomeListIds(genome_list_ids))
+
+                if genome_ids:
+                    genome_mngr = GenomeManager(cur, self.currentUser)
+                    genome_ids = [x.strip() for x in genome_ids.split(",")]
+                    selected_ids.update(genome_mngr.externalGenomeIdsToGenomeIds(genome_ids))
+
+            tree_mngr = TreeManager(cur, self.currentUser, self.threads, self.db_release)
+            msa_file = tree_mngr.subsetTreeData(source_dir,
+                                                source_prefix,
+                                                selected_ids,
+                                                taxa_filter,
+                                                quality_threshold,
+                                                quality_weight,
+                                                comp_threshold,
+                                                cont_threshold,
+                                                min_perc_taxa,
+                                                consensus,
+                                                min_perc_aa,
+                                                alignment,
+                                                binary,
+                                                directory,
+                                                prefix)
+
+            if not msa_file:
+                return True
 
         except GenomeDatabaseError as e:
             self.ReportError(e.message)
             return False
 
         if build_tree:
-            self.logger.info(
-                'Inferring tree for %d genomes under the WAG and GAMMA models.' % len(genomes_to_retain))
+            self.logger.info('Inferring tree under the WAG and GAMMA models.')
 
             output_tree = os.path.join(
                 directory, prefix + '_phylogeny.wag_gamma.tree')
@@ -870,6 +993,19 @@ class GenomeDatabase(object):
 
         return True
 
+    def WriteArbMetadata(self, directory, prefix, alignment):
+        try:
+            cur = self.conn.cursor()
+
+            tree_mngr = TreeManager(cur, self.currentUser, self.threads, self.db_release)
+            tree_mngr.writeArbMetadata(directory, prefix, alignment)
+
+        except GenomeDatabaseError as e:
+            self.ReportError(e.message)
+            return False
+
+        return True
+
     def CreateGenomeList(self, batchfile, external_ids, name, description, private=None):
         try:
             cur = self.conn.cursor()
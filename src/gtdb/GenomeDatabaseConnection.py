@@ -23,6 +23,10 @@ import Config
 
 class GenomeDatabaseConnection(object):
 
+    # cursor factory of new connections, or None for the psycopg2 default
+    # (set while a run is profiled, see RunProfiler)
+    cursor_factory = None
+
     def __init__(self):
         self.conn = None
         self.conn_pool = None
@@ -36,7 +40,10 @@ class GenomeDatabaseConnection(object):
             release, Config.GTDB_USERNAME,
             Config.DB_SERVERS.get(release), Config.GTDB_PASSWORD
         )
-        self.conn = pg.connect(conn_string)
+        if self.cursor_factory is not None:
+            self.conn = pg.connect(conn_string, cursor_factory=self.cursor_factory)
+        else:
+            self.conn = pg.connect(conn_string)
 
     # Function: ClosePostgresConnection
     # Closes an open connection to the PostgreSQL database.
@@ -21,12 +21,11 @@ import shutil
 import logging
 import datetime
 import sys
-import multiprocessing
 import psycopg2
-import time
 
 import Config
 import ConfigMetadata
+import DefaultValues
 import Tools
 
 from Exceptions import GenomeDatabaseError
@@ -34,10 +33,11 @@ from MetadataManager import MetadataManager
 from Prodigal import Prodigal
 from TigrfamSearch import TigrfamSearch
 from PfamSearch import PfamSearch
+from GenomePipeline import GenomePipeline, PipelineStage
 
 from biolib.checksum import sha256
 from biolib.common import make_sure_path_exists
-from Tools import splitchunks, confirm
+from Tools import confirm
 from psycopg2.extensions import AsIs
 
 
@@ -130,51 +130,26 @@ class GenomeManager(object):
             checkm_results_dict = self._processCheckM(checkm_file)
 
             genomic_files = self._addGenomeBatch(batchfile, self.tmp_output_dir)
+            if not genomic_files:
+                self.logger.warning("No genomes to add.")
+                return []
 
-            self.logger.info("Running Prodigal to identify genes.")
-            prodigal = Prodigal(self.threads)
-            file_paths = prodigal.run(genomic_files)
-
-            self.logger.info("Calculating and storing metadata for each genome.")
-            manager = multiprocessing.Manager()
-
-            progress_queue = multiprocessing.Queue()
-            progress_proc = multiprocessing.Process(target=self._progress, args=(len(genomic_files), progress_queue))
-            progress_proc.start()
-
-            out_q = multiprocessing.Manager().Queue()
-
-            procs = []
-            nprocs = self.threads
-            for item in splitchunks(genomic_files, 1):
-                p = multiprocessing.Process(
-                    target=self._addGenomesWorker,
-                    args=(item, file_paths, checkm_results_dict, study_id, out_q, progress_queue))
-                procs.append(p)
-                p.start()
-
-            # Pierre: why is this needed?
-            while out_q.empty():
-                time.sleep(1)
-
-            # wait for all worker processes to finish
-            for p in procs:
-                p.join()
-
-            self.logger.info("Waiting for progress process.")
-            progress_queue.put(None)
-            progress_proc.join()
-
-            # annotated genes against TIGRfam and Pfam databases
-            self.logger.info("Identifying TIGRfam protein families.")
-            gene_files = [file_paths[db_genome_id]['aa_gene_path']
-                          for db_genome_id in genomic_files]
-            tigr_search = TigrfamSearch(self.cur, self.currentUser, self.threads)
-            tigr_search.run(gene_files)
-
-            self.logger.info("Identifying Pfam protein families.")
-            pfam_search = PfamSearch(self.cur, self.currentUser, self.threads)
-            pfam_search.run(gene_files)
+            for db_genome_id, values in genomic_files.iteritems():
+                if values['checkm_bin_id'] not in checkm_results_dict:
+                    raise GenomeDatabaseError(
+                        "Couldn't find CheckM result for bin %s." % values['checkm_bin_id'])
+
+            self.logger.info("Identifying genes, calculating metadata, and identifying TIGRfam and Pfam protein families.")
+            metadata = self._runGenomePipeline(genomic_files)
+
+            self.logger.info("Storing metadata for each genome.")
+            self.cur.execute("UPDATE genomes SET study_id = %s WHERE id IN %s",
+                             (study_id, tuple(genomic_files.keys())))
+
+            metadata_mngr = MetadataManager(self.cur, self.currentUser)
+            metadata_mngr.storeGenomesMetadata({db_genome_id: checkm_results_dict[values['checkm_bin_id']]
+                                                for db_genome_id, values in genomic_files.iteritems()},
+                                               metadata)
         except:
             if os.path.exists(self.tmp_output_dir):
                 shutil.rmtree(self.tmp_output_dir)
@@ -182,58 +157,92 @@ class GenomeManager(object):
 
         return genomic_files.keys()
 
-    def _progress(self, num_genomes, progress_queue):
-        """Track progress of large parallel jobs."""
+    def _runGenomePipeline(self, genomic_files):
+        """Identify genes, calculate metadata, and annotate genes of genomes.
 
-        processed_genomes = 0
-        while True:
-            bin_id = progress_queue.get(block=True, timeout=None)
-            if bin_id is None:
-                break
+        Each genome moves through the stages independently. No
+        database queries are made by the stages. Metadata is parsed
+        by the workers and returned to the calling process, which
+        stores it once the pipeline has finished.
 
-            processed_genomes += 1
-            statusStr = '==> Finished processing %d of %d (%.2f%%) genomes.' % (processed_genomes,
-                                                                                num_genomes,
-                                                                                float(processed_genomes) * 100 / num_genomes)
-            sys.stdout.write('%s\r' % statusStr)
-            sys.stdout.flush()
-
-        sys.stdout.write('\n')
+        Parameters
+        ----------
+        genomic_files : dict
+            Dictionary indicating the genomic and gene file for each genome.
 
-    def _addGenomesWorker(self, genomic_files, file_paths, checkm_results_dict, study_id, out_q, progress_queue):
-        '''
-        The worker function, invoked in a process.
+        Returns
+        -------
+        dict
+            Table, field, and value of each metadata item of each genome.
+        """
 
-        :param genomic_files: dictionary {genome_id:{checkm_bin_id:value,aa_gene_path:value,fasta_path:value}}
-        :param file_paths : dictionary generated from Prodigal
-        :param checkm_results_dict: dictionary of checkm results
-        :param study_id = study id
-        '''
-        metadata_mngr = MetadataManager(self.cur, self.currentUser)
-        for db_genome_id, values in genomic_files.iteritems():
+        prodigal = Prodigal(self.threads)
+        metadata_mngr = MetadataManager(None, self.currentUser)
+
+        tigr_search = TigrfamSearch(self.cur, self.currentUser, self.threads)
+        tigr_search.cpus_per_genome = max(1, self.threads / len(genomic_files))
+        pfam_search = PfamSearch(self.cur, self.currentUser, self.threads)
+        pfam_search.cpus_per_genome = max(1, self.threads / len(genomic_files))
+
+        def call_genes(db_genome_id, file_paths):
+            return prodigal.callGenes(file_paths)
+
+        def calculate_metadata(db_genome_id, file_paths):
+            output_dir, _file = os.path.split(file_paths["fasta_path"])
+            genome_stats = metadata_mngr.calculateMetadata(file_paths["fasta_path"],
+                                                           file_paths["gff_path"],
+                                                           output_dir)
+            file_paths["metadata"] = metadata_mngr.parseMetadata(output_dir, genome_stats)
+            return file_paths
+
+        def search_tigrfam(db_genome_id, file_paths):
+            tigr_search.searchGeneFile(file_paths["aa_gene_path"])
+            return file_paths
+
+        def search_pfam(db_genome_id, file_paths):
+            pfam_search.searchGeneFile(file_paths["aa_gene_path"])
+            return file_paths
+
+        # each stage can use all threads, but the number of genomes
+        # processed at the same time by all stages is limited to the
+        # number of threads
+        queue_size = DefaultValues.GENOME_PIPELINE_QUEUED_PER_WORKER * self.threads
+        pipeline = GenomePipeline([PipelineStage('Prodigal', call_genes, self.threads, queue_size),
+                                   PipelineStage('Metadata', calculate_metadata, self.threads, queue_size),
+                                   PipelineStage('TIGRfam', search_tigrfam, self.threads, queue_size),
+                                   PipelineStage('Pfam', search_pfam, self.threads, queue_size)],
+                                  max_active=self.threads)
+
+        metadata = {}
+        errors = []
+        for db_genome_id, genome_file_paths, error in pipeline.run(genomic_files.iteritems()):
+            if error is None:
+                metadata[db_genome_id] = genome_file_paths["metadata"]
+            else:
+                errors.append('Genome %s: %s' % (db_genome_id, error))
 
-            self.cur.execute("UPDATE genomes SET study_id = %s WHERE id = %s",
-                             (study_id, db_genome_id))
+            processed_genomes = len(metadata) + len(errors)
+            statusStr = '==> Finished processing %d of %d (%.2f%%) genomes.' % (processed_genomes,
+                                                                                len(genomic_files),
+                                                                                float(processed_genomes) * 100 / len(genomic_files))
+            sys.stdout.write('%s\r' % statusStr)
+            sys.stdout.flush()
 
-            genome_file_paths = file_paths[db_genome_id]
-            output_dir, _file = os.path.split(
-                genome_file_paths["fasta_path"])
+            # keep the idle database connection from timing out
+            if (processed_genomes % 200) == 0:
+                self.cur.execute("SELECT 1")
 
-            bin_id = values['checkm_bin_id']
-            if bin_id not in checkm_results_dict:
-                raise GenomeDatabaseError(
-                    "Couldn't find CheckM result for bin %s." % bin_id)
+        sys.stdout.write('\n')
 
-            metadata_mngr.addMetadata(db_genome_id,
-                                      genome_file_paths["fasta_path"],
-                                      genome_file_paths["gff_path"],
-                                      checkm_results_dict[bin_id],
-                                      output_dir)
+        if errors:
+            raise GenomeDatabaseError("Unable to process %d genomes:\n%s" % (len(errors), '\n'.join(errors)))
 
-            progress_queue.put(bin_id)
+        missing_genomes = set(genomic_files.keys()) - set(metadata.keys())
+        if missing_genomes:
+            raise GenomeDatabaseError("Genome pipeline did not return results for %d genomes: %s"
+                                      % (len(missing_genomes), ', '.join(map(str, sorted(missing_genomes)))))
 
-        out_q.put("True")
-        return True
+        return metadata
 
     def allGenomeIds(self):
         """Get genome identifiers for all genomes.
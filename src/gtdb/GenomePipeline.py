@@ -0,0 +1,234 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import Queue
+import threading
+import traceback
+import multiprocessing as mp
+
+from Exceptions import GenomeDatabaseError
+
+
+class PipelineStage(object):
+    """Stage of a genome pipeline."""
+
+    def __init__(self, name, function, workers, queue_size):
+        """Initialize.
+
+        Parameters
+        ----------
+        name : str
+            Name of stage.
+        function : callable
+            Function called with the identifier and data of a genome, returning the updated data.
+        workers : int
+            Number of worker processes.
+        queue_size : int
+            Maximum number of genomes waiting to be processed by the stage.
+        """
+
+        self.name = name
+        self.function = function
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+
+
+class GenomePipeline(object):
+    """Process genomes through a sequence of stages.
+
+    Each stage has its own pool of worker processes reading from a
+    bounded queue. A genome is passed to the next stage as soon as it
+    has been processed, so genomes move through the pipeline
+    independently. A worker blocks once the queue of the next stage
+    is full, which limits the number of genomes in flight and
+    prevents a fast stage from running ahead of a slow one.
+
+    Genomes for which a stage fails are passed through the remaining
+    stages unprocessed and are reported with the error. If a worker
+    process dies (e.g., killed or crashed in a C extension), the
+    pipeline is stopped and an exception raised, since the genome it
+    was processing is lost.
+
+    The number of genomes processed at the same time, summed over all
+    stages, can be limited with max_active. Workers waiting for a genome
+    or for space in the queue of the next stage do not count against
+    this limit.
+
+    Worker processes are forked, so stage functions may be bound
+    methods of objects created before the pipeline is run, but must
+    not use database cursors.
+    """
+
+    def __init__(self, stages, max_active=None):
+        """Initialize.
+
+        Parameters
+        ----------
+        stages : list
+            PipelineStage objects in order of processing.
+        max_active : int
+            Maximum number of genomes processed at the same time by all stages, or None for no limit.
+        """
+
+        self.stages = stages
+        self.max_active = max_active
+
+    def _stageWorker(self, stage, in_queue, out_queue, active_slots):
+        """Process genomes from the queue of a stage."""
+
+        while True:
+            item = in_queue.get(block=True, timeout=None)
+            if item is None:
+                break
+
+            genome_id, data, error = item
+            if error is None:
+                if active_slots is not None:
+                    active_slots.acquire()
+                try:
+                    data = stage.function(genome_id, data)
+                except Exception:
+                    error = '%s failed: %s' % (stage.name, traceback.format_exc())
+                finally:
+                    if active_slots is not None:
+                        active_slots.release()
+
+            out_queue.put((genome_id, data, error))
+
+    def _feeder(self, genomes, queue, num_workers):
+        """Place genomes in the queue of the first stage."""
+
+        for genome_id, data in genomes:
+            queue.put((genome_id, data, None))
+
+        for _ in xrange(num_workers):
+            queue.put(None)
+
+    def _failedWorkers(self, stage_procs):
+        """Stage name and exit code of worker processes that exited abnormally."""
+
+        failed_workers = []
+        for stage, procs in zip(self.stages, stage_procs):
+            for p in procs:
+                if p.exitcode is not None and p.exitcode != 0:
+                    failed_workers.append((stage.name, p.exitcode))
+
+        return failed_workers
+
+    def _coordinator(self, stage_procs, queues, failed_workers):
+        """Signal each stage to finish once all workers of the preceding stage have finished.
+
+        Workers of all stages are checked while waiting. If a worker
+        exited abnormally, the stage name and exit code are added to
+        failed_workers and the end of the output is signalled at once.
+        """
+
+        stage_index = 0
+        pending_signals = 0
+        while stage_index < len(stage_procs):
+            failed_workers.extend(self._failedWorkers(stage_procs))
+            if failed_workers:
+                queues[-1].put(None)
+                return
+
+            if pending_signals:
+                try:
+                    queues[stage_index].put(None, block=True, timeout=1)
+                    pending_signals -= 1
+                except Queue.Full:
+                    pass
+                continue
+
+            running = [p for p in stage_procs[stage_index] if p.is_alive()]
+            if running:
+                running[0].join(1)
+                continue
+
+            stage_index += 1
+            if stage_index < len(stage_procs):
+                pending_signals = len(stage_procs[stage_index])
+            else:
+                queues[-1].put(None)
+
+    def run(self, genomes):
+        """Run genomes through the pipeline.
+
+        Parameters
+        ----------
+        genomes : iterable
+            Identifier and data of each genome.
+
+        Returns
+        -------
+        generator
+            Identifier, processed data, and error message (None on success) of
+            each genome in the order genomes leave the pipeline.
+        """
+
+        queues = [mp.Queue(stage.queue_size) for stage in self.stages]
+        queues.append(mp.Queue())
+
+        active_slots = None
+        if self.max_active:
+            active_slots = mp.BoundedSemaphore(self.max_active)
+
+        stage_procs = []
+        failed_workers = []
+        try:
+            for stage_index, stage in enumerate(self.stages):
+                procs = [mp.Process(target=self._stageWorker,
+                                    args=(stage, queues[stage_index], queues[stage_index + 1], active_slots))
+                         for _ in xrange(stage.workers)]
+                for p in procs:
+                    p.daemon = True
+                    p.start()
+                stage_procs.append(procs)
+
+            feeder = threading.Thread(target=self._feeder,
+                                      args=(genomes, queues[0], self.stages[0].workers))
+            feeder.daemon = True
+            feeder.start()
+
+            coordinator = threading.Thread(target=self._coordinator,
+                                           args=(stage_procs, queues, failed_workers))
+            coordinator.daemon = True
+            coordinator.start()
+
+            while True:
+                item = queues[-1].get(block=True, timeout=None)
+                if item is None:
+                    break
+
+                yield item
+
+            coordinator.join()
+            if failed_workers:
+                raise GenomeDatabaseError('Genome pipeline stopped as worker processes exited abnormally: %s'
+                                          % ', '.join(['%s (exit code %d)' % (stage_name, exitcode)
+                                                       for stage_name, exitcode in failed_workers]))
+
+            feeder.join()
+        finally:
+            for procs in stage_procs:
+                for p in procs:
+                    if p.is_alive():
+                        p.terminate()
+
+            # genomes left in the queues of a stopped pipeline must not
+            # block the exit of this process
+            for queue in queues:
+                queue.cancel_join_thread()
@@ -15,10 +15,17 @@
 #                                                                             #
 ###############################################################################
 
+import os
+import sys
+import shutil
 import logging
+import tempfile
 import itertools
+import multiprocessing
+from StringIO import StringIO
 
 import psycopg2
+import numpy as np
 
 from biolib.parallel import Parallel
 
@@ -26,7 +33,71 @@ from Exceptions import GenomeDatabaseError
 from GenomeManager import GenomeManager
 from MarkerSetManager import MarkerSetManager
 from AlignedMarkerManager import AlignedMarkerManager
+from AlignmentStore import AlignmentStore
+from CandidateIndex import CandidateIndex
 import DefaultValues
+import Config
+import Tools
+
+
+# representative alignments used by worker processes, set by
+# _initAssignWorker so they are inherited by forked workers
+# rather than pickled
+_worker_reps = {}
+
+
+def _initAssignWorker(bac_rep_order, bac_rep_matrix, bac_cand_index,
+                      ar_rep_order, ar_rep_matrix, ar_cand_index,
+                      aai_threshold):
+    """Initialize worker process for assigning genomes to representatives."""
+
+    _worker_reps['bac'] = (bac_rep_order, bac_rep_matrix, bac_cand_index)
+    _worker_reps['ar'] = (ar_rep_order, ar_rep_matrix, ar_cand_index)
+    _worker_reps['aai_threshold'] = aai_threshold
+
+
+def _assignWorker(genome_aligns):
+    """Identify representative for a genome.
+
+    Parameters
+    ----------
+    genome_aligns : (int, str, str)
+        Database identifier of genome along with its
+        concatenated bacterial and archaeal alignments.
+
+    Returns
+    -------
+    int
+        Database identifier of genome.
+    int
+        Position of assigned representative, or None.
+    int
+        Mismatches to assigned representative, or None.
+    str
+        Domain of marker set used to assign representative, or None.
+    """
+
+    genome_id, genome_bac_align, genome_ar_align = genome_aligns
+    aai_threshold = _worker_reps['aai_threshold']
+
+    assigned = (None, None, None)
+    for domain, label, genome_align in [('bac', 'd__Bacteria', genome_bac_align),
+                                        ('ar', 'd__Archaea', genome_ar_align)]:
+        rep_order, rep_matrix, cand_index = _worker_reps[domain]
+        max_mismatches = (1.0 - aai_threshold) * (len(genome_align) - genome_align.count('-'))
+
+        # select the representative which would be assigned last when
+        # comparing the genome to each representative in turn, only
+        # considering representatives not excluded by the pre-filter
+        candidates = cand_index.candidates(genome_align, max_mismatches)
+        pos, mismatches = GenomeRepresentativeManager._closestRepresentative(rep_order[candidates],
+                                                                              rep_matrix.mismatches(genome_align,
+                                                                                                    candidates),
+                                                                              max_mismatches)
+        if pos is not None and (assigned[0] is None or pos > assigned[0]):
+            assigned = (int(pos), int(mismatches), label)
+
+    return (genome_id,) + assigned
 
 
 class GenomeRepresentativeManager(object):
@@ -140,6 +211,50 @@ class GenomeRepresentativeManager(object):
 
         return mismatches
 
+    @staticmethod
+    def _closestRepresentative(rep_order, mismatches, max_mismatches):
+        """Identify representative selected by sequential comparison of genome to representatives.
+
+        Representatives are considered in the order given
+        by rep_order and a representative is accepted if it
+        has fewer mismatches than max_mismatches, at which
+        point max_mismatches is lowered to its mismatch count.
+        As in _aai_mismatches, a representative with zero
+        mismatches is always accepted. The last accepted
+        representative is therefore the last one with zero
+        mismatches or, failing that, the first one with the
+        minimum number of mismatches.
+
+        Parameters
+        ----------
+        rep_order : numpy.ndarray
+            Position of each representative in the comparison order.
+        mismatches : numpy.ndarray
+            Mismatches between genome and each representative.
+        max_mismatches : float
+            Initial maximum allowed mismatches.
+
+        Returns
+        -------
+        int
+            Position of accepted representative, or None.
+        int
+            Mismatches to accepted representative, or None.
+        """
+
+        if mismatches.shape[0] == 0:
+            return None, None
+
+        zero_mismatches = (mismatches == 0)
+        if zero_mismatches.any():
+            return rep_order[zero_mismatches].max(), 0
+
+        min_mismatches = mismatches.min()
+        if min_mismatches < max_mismatches:
+            return rep_order[mismatches == min_mismatches].min(), min_mismatches
+
+        return None, None
+
     def _unprocessedGenomes(self):
         """Identify genomes that have not been compared to representatives.
 
@@ -336,19 +451,8 @@ class GenomeRepresentativeManager(object):
 
         return rep_genome_dictionary
 
-    def _domainAssignment(self, genome_id, len_arc_marker, len_bac_marker):
-        """Assign genome to domain based on present/absence of canonical marker genes."""
-
-        query_al_mark = ("SELECT count(*) " +
-                             "FROM aligned_markers am " +
-                             "LEFT JOIN marker_set_contents msc ON msc.marker_id = am.marker_id " +
-                             "WHERE genome_id = %s and msc.set_id = %s and (evalue <> '') IS TRUE;")
-
-        self.cur.execute(query_al_mark, (genome_id, 1))
-        aligned_bac_count = self.cur.fetchone()[0]
-
-        self.cur.execute(query_al_mark, (genome_id, 2))
-        aligned_arc_count = self.cur.fetchone()[0]
+    def _inferDomain(self, aligned_arc_count, aligned_bac_count, len_arc_marker, len_bac_marker):
+        """Infer domain from the number of canonical archaeal and bacterial markers identified in a genome."""
 
         arc_aa_per = (aligned_arc_count * 100 / len_arc_marker)
         bac_aa_per = (aligned_bac_count * 100 / len_bac_marker)
@@ -361,37 +465,231 @@ class GenomeRepresentativeManager(object):
 
         return domain, arc_aa_per, bac_aa_per
 
+    def _domainAssignments(self, genome_ids, len_arc_marker, len_bac_marker):
+        """Assign genomes to domains based on present/absence of canonical marker genes.
+
+        Parameters
+        ----------
+        genome_ids : list
+            Database identifiers of genomes.
+        len_arc_marker : int
+            Number of canonical archaeal markers.
+        len_bac_marker : int
+            Number of canonical bacterial markers.
+
+        Returns
+        -------
+        d[genome_id] -> (domain, arc_aa_per, bac_aa_per)
+            Inferred domain of each genome.
+        """
+
+        self.cur.execute("SELECT am.genome_id, msc.set_id, count(*) " +
+                         "FROM aligned_markers am " +
+                         "JOIN marker_set_contents msc ON msc.marker_id = am.marker_id " +
+                         "WHERE am.genome_id = ANY(%s) AND msc.set_id IN (1, 2) " +
+                         "AND (evalue <> '') IS TRUE " +
+                         "GROUP BY am.genome_id, msc.set_id", (genome_ids,))
+
+        aligned_counts = {genome_id: {1: 0, 2: 0} for genome_id in genome_ids}
+        for genome_id, set_id, count in self.cur:
+            aligned_counts[genome_id][set_id] = count
+
+        domains = {}
+        for genome_id, counts in aligned_counts.iteritems():
+            domains[genome_id] = self._inferDomain(counts[2], counts[1], len_arc_marker, len_bac_marker)
+
+        return domains
+
+    def _writeAssignments(self, genome_ids, assigned_reps, external_ids, domains):
+        """Write representative and domain assignments to the database.
+
+        Assignments are loaded into a temporary table with COPY and
+        applied with a few set-based updates. The taxonomy of a genome
+        is only set if all of its GTDB taxonomy fields are empty, in
+        which case it is copied from its representative or, for
+        genomes without a representative, the inferred domain is used.
+
+        Parameters
+        ----------
+        genome_ids : list
+            Database identifiers of all processed genomes.
+        assigned_reps : d[genome_id] -> rep_genome_id
+            Representative assigned to each genome.
+        external_ids : d[rep_genome_id] -> external_id
+            External identifiers of representatives.
+        domains : d[genome_id] -> domain
+            Inferred domain of genomes without a representative.
+        """
+
+        temp_table_name = Tools.generateTempTableName()
+        self.cur.execute("CREATE TEMP TABLE %s (genome_id integer PRIMARY KEY, " % temp_table_name +
+                         "rep_genome_id integer, rep_external_id text, domain text)")
+
+        rows = StringIO()
+        for genome_id in genome_ids:
+            rep_genome_id = assigned_reps.get(genome_id)
+            if rep_genome_id is not None:
+                rows.write('%d\t%d\t%s\t\\N\n' % (genome_id, rep_genome_id, external_ids[rep_genome_id]))
+            else:
+                rows.write('%d\t\\N\t\\N\t%s\n' % (genome_id, domains.get(genome_id) or '\\N'))
+        rows.seek(0)
+        self.cur.copy_from(rows, temp_table_name, columns=('genome_id', 'rep_genome_id', 'rep_external_id', 'domain'))
+
+        empty_taxonomy = " AND ".join("COALESCE(mt.%s, '') = ''" % rank for rank in ['gtdb_class',
+                                                                                        'gtdb_species',
+                                                                                        'gtdb_phylum',
+                                                                                        'gtdb_family',
+                                                                                        'gtdb_domain',
+                                                                                        'gtdb_order',
+                                                                                        'gtdb_genus'])
+
+        # inherit taxonomy from representative
+        self.cur.execute("UPDATE metadata_taxonomy as mt SET " +
+                         "gtdb_class = mt_repr.gtdb_class," +
+                         "gtdb_species = mt_repr.gtdb_species," +
+                         "gtdb_phylum = mt_repr.gtdb_phylum," +
+                         "gtdb_family = mt_repr.gtdb_family," +
+                         "gtdb_domain =  mt_repr.gtdb_domain," +
+                         "gtdb_order = mt_repr.gtdb_order," +
+                         "gtdb_genus =  mt_repr.gtdb_genus " +
+                         "FROM {0} a, metadata_taxonomy mt_repr ".format(temp_table_name) +
+                         "WHERE mt.id = a.genome_id " +
+                         "AND mt_repr.id = a.rep_genome_id " +
+                         "AND " + empty_taxonomy)
+
+        # set inferred domain of genomes without a representative
+        self.cur.execute("UPDATE metadata_taxonomy as mt " +
+                         "SET gtdb_domain = a.domain " +
+                         "FROM {0} a ".format(temp_table_name) +
+                         "WHERE mt.id = a.genome_id " +
+                         "AND a.domain IS NOT NULL " +
+                         "AND " + empty_taxonomy)
+
+        # currently, new genomes are never made a representative
+        self.cur.execute("UPDATE metadata_taxonomy as mt " +
+                         "SET gtdb_genome_representative = COALESCE(a.rep_external_id, mt.gtdb_genome_representative), " +
+                         "gtdb_representative = %s " +
+                         "FROM {0} a ".format(temp_table_name) +
+                         "WHERE mt.id = a.genome_id", ('False',))
+
+        self.cur.execute("DROP TABLE %s" % temp_table_name)
+
     def domainAssignmentReport(self, outfile):
-        """Reports results of automated domain assignment."""
+        """Reports results of automated domain assignment.
 
-        # identify genomes that have not been compared to representatives
-        self.cur.execute("SELECT id FROM metadata_taxonomy")
-        genome_ids = [genome_id[0] for genome_id in self.cur.fetchall()]
+        Canonical markers of all genomes are counted with a single
+        grouped query which is streamed from a server-side cursor
+        directly to the output file.
+        """
 
-        # get concatenated alignments for all representatives
+        # get number of canonical bacterial and archaeal markers
         self.cur.execute("SELECT count(*) from marker_set_contents where set_id = 1;")
         len_bac_marker = self.cur.fetchone()[0]
 
         self.cur.execute("SELECT count(*) from marker_set_contents where set_id = 2;")
         len_arc_marker = self.cur.fetchone()[0]
 
-        genome_mngr = GenomeManager(self.cur, self.currentUser)
+        query = ("SELECT external_id_prefix || '_' || id_at_source, " +
+                 "COALESCE(marker_counts.arc_count, 0), COALESCE(marker_counts.bac_count, 0), " +
+                 "mt.ncbi_taxonomy, mt.gtdb_taxonomy " +
+                 "FROM metadata_taxonomy mt " +
+                 "JOIN genomes g ON g.id = mt.id " +
+                 "JOIN genome_sources gs ON gs.id = g.genome_source_id " +
+                 "LEFT JOIN (SELECT am.genome_id, " +
+                 "count(CASE WHEN msc.set_id = 2 THEN 1 END) AS arc_count, " +
+                 "count(CASE WHEN msc.set_id = 1 THEN 1 END) AS bac_count " +
+                 "FROM aligned_markers am " +
+                 "JOIN marker_set_contents msc ON msc.marker_id = am.marker_id " +
+                 "WHERE msc.set_id IN (1, 2) " +
+                 "AND (evalue <> '') IS TRUE " +
+                 "GROUP BY am.genome_id) marker_counts ON marker_counts.genome_id = mt.id " +
+                 "ORDER BY mt.id")
+
+        # use a named (server-side) cursor so rows are streamed
+        # rather than all being held in memory
+        report_cur = self.cur.connection.cursor('domain_assignment_report')
+        report_cur.itersize = 10000
+        report_cur.execute(query)
 
-        # process each genome
         fout = open(outfile, 'w')
         fout.write('Genome Id\tPredicted domain\tArchaeal Marker Percentage\tBacterial Marker Percentage\tNCBI taxonomy\tGTDB taxonomy\n')
-        for genome_id in genome_ids:
-            query_taxonomy_req = ("SELECT gtdb_domain, ncbi_taxonomy, gtdb_taxonomy " +
-                                      "FROM metadata_taxonomy WHERE id = %s;")
-            self.cur.execute(query_taxonomy_req, (genome_id,))
-            gtdb_domain, ncbi_taxonomy, gtdb_taxonomy = self.cur.fetchone()
-
-            domain, arc_aa_per, bac_aa_per = self._domainAssignment(genome_id, len_arc_marker, len_bac_marker)
-
-            external_genome_id = genome_mngr.genomeIdsToExternalGenomeIds([genome_id])[genome_id]
+        for external_genome_id, aligned_arc_count, aligned_bac_count, ncbi_taxonomy, gtdb_taxonomy in report_cur:
+            domain, arc_aa_per, bac_aa_per = self._inferDomain(aligned_arc_count,
+                                                               aligned_bac_count,
+                                                               len_arc_marker,
+                                                               len_bac_marker)
             fout.write('%s\t%s\t%.2f\t%.2f\t%s\t%s\n' % (external_genome_id, domain, arc_aa_per, bac_aa_per, ncbi_taxonomy, gtdb_taxonomy))
 
         fout.close()
+        report_cur.close()
+
+    def _compareToRepresentatives(self, genome_ids, align_store, bac_marker_ids, ar_marker_ids, reps):
+        """Compare genomes to representatives using a pool of worker processes.
+
+        Concatenated alignments of genomes are retrieved in batches
+        and each batch is distributed across workers. Results are
+        independent of the number of workers.
+
+        Parameters
+        ----------
+        genome_ids : list
+            Database identifiers of genomes to compare.
+        align_store : AlignmentStore
+            Store used to retrieve concatenated alignments.
+        bac_marker_ids : list
+            Identifiers of canonical bacterial markers.
+        ar_marker_ids : list
+            Identifiers of canonical archaeal markers.
+        reps : tuple
+            Comparison order, alignments, and pre-filter of bacterial and archaeal representatives.
+
+        Returns
+        -------
+        d[genome_id] -> (position, mismatches, domain)
+            Assigned representative of each genome, or (None, None, None).
+        """
+
+        num_genomes = len(genome_ids)
+        batch_size = DefaultValues.REP_ASSIGNMENT_BATCH_SIZE
+
+        pool = None
+        if self.threads > 1:
+            pool = multiprocessing.Pool(self.threads, _initAssignWorker, reps + (self.aai_threshold,))
+        else:
+            _initAssignWorker(*(reps + (self.aai_threshold,)))
+
+        assignments = {}
+        try:
+            for start in xrange(0, num_genomes, batch_size):
+                batch_ids = genome_ids[start:start + batch_size]
+                bac_aligns = align_store.fetchAlignments(batch_ids, bac_marker_ids)
+                ar_aligns = align_store.fetchAlignments(batch_ids, ar_marker_ids)
+                tasks = [(genome_id, bac_aligns[genome_id], ar_aligns[genome_id]) for genome_id in batch_ids]
+
+                if pool:
+                    results = pool.imap(_assignWorker, tasks, max(1, len(tasks) // (4 * self.threads)))
+                else:
+                    results = itertools.imap(_assignWorker, tasks)
+
+                for genome_id, rep_pos, mismatches, domain in results:
+                    assignments[genome_id] = (rep_pos, mismatches, domain)
+
+                statusStr = '==> Finished processing %d of %d (%.2f%%) genomes.' % (len(assignments),
+                                                                                    num_genomes,
+                                                                                    float(len(assignments)) * 100 / num_genomes)
+                sys.stdout.write('%s\r' % statusStr)
+                sys.stdout.flush()
+
+            sys.stdout.write('\n')
+
+            if pool:
+                pool.close()
+                pool.join()
+        finally:
+            if pool:
+                pool.terminate()
+
+        return assignments
 
     def assignToRepresentative(self):
         """Assign genomes to representatives.
@@ -431,94 +729,80 @@ class GenomeRepresentativeManager(object):
         #get domains for all representatives
         rep_genome_dictionary = self._getRepresentativeDomain()
         
-        # define desired order of marker genes
-        # (order doesn't matter, but must be consistent between genomes)
-        bac_marker_index = {}
-        for i, marker_id in enumerate(bac_marker_ids):
-            bac_marker_index[marker_id] = i
-
-        ar_marker_index = {}
-        for i, marker_id in enumerate(ar_marker_ids):
-            ar_marker_index[marker_id] = i
-
-        # get concatenated alignments for all representatives
-        rep_bac_aligns = {}
-        rep_ar_aligns = {}
-        for rep_id in rep_genome_ids:
-            rep_bac_aligns[rep_id] = marker_set_mngr.concatenatedAlignedMarkers(rep_id, bac_marker_index)
-            rep_ar_aligns[rep_id] = marker_set_mngr.concatenatedAlignedMarkers(rep_id, ar_marker_index)
-
-        self.cur.execute("SELECT count(*) from marker_set_contents where set_id = 1;")
-        len_bac_marker = self.cur.fetchone()[0]
-
-        self.cur.execute("SELECT count(*) from marker_set_contents where set_id = 2;")
-        len_arc_marker = self.cur.fetchone()[0]
-
-        # process each genome
-        assigned_to_rep_count = 0
-        for genome_id in unprocessed_genome_ids:
-            # get canonical alignment
-            genome_bac_align = marker_set_mngr.concatenatedAlignedMarkers(genome_id, bac_marker_index)
-            genome_ar_align = marker_set_mngr.concatenatedAlignedMarkers(genome_id, ar_marker_index)
-
-            assigned_representative = None
-            bac_max_mismatches = (1.0 - self.aai_threshold) * (len(genome_bac_align) - genome_bac_align.count('-'))
-            ar_max_mismatches = (1.0 - self.aai_threshold) * (len(genome_ar_align) - genome_ar_align.count('-'))
-            original_threshold = bac_max_mismatches
-            for rep_id in rep_genome_ids:
-                rep_bac_align = rep_bac_aligns[rep_id]
-                rep_ar_align = rep_ar_aligns[rep_id]
-                if rep_genome_dictionary[rep_id] == 'd__Bacteria':
-                    m = self._aai_mismatches(genome_bac_align, rep_bac_align, bac_max_mismatches)
-                    if m is not None:  # necessary to distinguish None and 0
-                        assigned_representative = rep_id
-                        bac_max_mismatches = m
-                
-                elif rep_genome_dictionary[rep_id] == 'd__Archaea':
-                    m = self._aai_mismatches(genome_ar_align, rep_ar_align, ar_max_mismatches)
-                    if m is not None:  # necessary to distinguish None and 0
-                        assigned_representative = rep_id
-                        ar_max_mismatches = m
-
-            # assign genome to current representative
-            if assigned_representative:
-                assigned_to_rep_count += 1
-                query = ("UPDATE metadata_taxonomy " +
-                         "SET gtdb_genome_representative = %s " +
-                         "WHERE id = %s")
-                self.cur.execute(query, (external_ids[assigned_representative], genome_id))
-                query_taxonomy_req = ("SELECT gtdb_class, gtdb_species, " +
-                                      "gtdb_phylum, gtdb_family, gtdb_domain, gtdb_order, gtdb_genus " +
-                                      "FROM metadata_taxonomy WHERE id = %s;")
-                self.cur.execute(query_taxonomy_req, (genome_id,))
-                if all(v is None or v == '' for v in self.cur.fetchone()):
-                    query_taxonomy_update = ("UPDATE metadata_taxonomy as mt_newg SET " +
-                                             "gtdb_class = mt_repr.gtdb_class," +
-                                             "gtdb_species = mt_repr.gtdb_species," +
-                                             "gtdb_phylum = mt_repr.gtdb_phylum," +
-                                             "gtdb_family = mt_repr.gtdb_family," +
-                                             "gtdb_domain =  mt_repr.gtdb_domain," +
-                                             "gtdb_order = mt_repr.gtdb_order," +
-                                             "gtdb_genus =  mt_repr.gtdb_genus " +
-                                             "FROM metadata_taxonomy mt_repr " +
-                                             "WHERE mt_repr.id = %s " +
-                                             "AND mt_newg.id = %s")
-                    self.cur.execute(query_taxonomy_update, (assigned_representative, genome_id))
-            else:
-                query_taxonomy_req = ("SELECT gtdb_class, gtdb_species, " +
-                                      "gtdb_phylum, gtdb_family, gtdb_domain, gtdb_order, gtdb_genus " +
-                                      "FROM metadata_taxonomy WHERE id = %s;")
-                self.cur.execute(query_taxonomy_req, (genome_id,))
-                if all(v is None or v == '' for v in self.cur.fetchone()):
-                    domain, _arc_aa_per, _bac_aa_per = self._domainAssignment(genome_id, len_arc_marker, len_bac_marker)
-
-                    if domain:
-                        self.cur.execute("UPDATE metadata_taxonomy " +
-                                         "SET gtdb_domain = %s " +
-                                         "WHERE id = %s", (domain, genome_id))
-
-        self.logger.info("Assigned %d genomes to a representative." % assigned_to_rep_count)
-
-        # currently, new genomes are never made a representative
-        query = "UPDATE metadata_taxonomy SET gtdb_representative = %s WHERE id = %s"
-        self.cur.executemany(query, [('False', genome_id) for genome_id in unprocessed_genome_ids])
+        # get packed concatenated alignments for all representatives of
+        # each domain, along with the position of each representative
+        # in the comparison order
+        cache_dir = getattr(Config, 'GTDB_CACHE_DIR', None)
+        if cache_dir:
+            store_dir = os.path.join(cache_dir, self.db_release, 'representative_alignments')
+        else:
+            store_dir = tempfile.mkdtemp()
+        try:
+            align_store = AlignmentStore(self.cur, store_dir)
+
+            bac_rep_ids = [rep_id for rep_id in rep_genome_ids
+                           if rep_genome_dictionary[rep_id] == 'd__Bacteria']
+            ar_rep_ids = [rep_id for rep_id in rep_genome_ids
+                          if rep_genome_dictionary[rep_id] == 'd__Archaea']
+            bac_rep_matrix = align_store.alignments(marker_set_mngr.bacCanonicalMarkerSetId,
+                                                    bac_marker_ids,
+                                                    bac_rep_ids)
+            ar_rep_matrix = align_store.alignments(marker_set_mngr.arCanonicalMarkerSetId,
+                                                   ar_marker_ids,
+                                                   ar_rep_ids)
+
+            rep_position = {rep_id: i for i, rep_id in enumerate(rep_genome_ids)}
+            bac_rep_order = np.array([rep_position[rep_id] for rep_id in bac_rep_matrix.seq_ids], dtype=np.int64)
+            ar_rep_order = np.array([rep_position[rep_id] for rep_id in ar_rep_matrix.seq_ids], dtype=np.int64)
+
+            # pre-filter used to exclude representatives which can not be assigned
+            bac_cand_index = CandidateIndex(store_dir,
+                                            marker_set_mngr.bacCanonicalMarkerSetId,
+                                            DefaultValues.REP_PREFILTER_COLUMNS)
+            bac_cand_index.load(bac_rep_matrix, align_store.versions(marker_set_mngr.bacCanonicalMarkerSetId,
+                                                                     bac_marker_ids))
+            ar_cand_index = CandidateIndex(store_dir,
+                                           marker_set_mngr.arCanonicalMarkerSetId,
+                                           DefaultValues.REP_PREFILTER_COLUMNS)
+            ar_cand_index.load(ar_rep_matrix, align_store.versions(marker_set_mngr.arCanonicalMarkerSetId,
+                                                                   ar_marker_ids))
+
+            self.cur.execute("SELECT count(*) from marker_set_contents where set_id = 1;")
+            len_bac_marker = self.cur.fetchone()[0]
+
+            self.cur.execute("SELECT count(*) from marker_set_contents where set_id = 2;")
+            len_arc_marker = self.cur.fetchone()[0]
+
+            # compare genomes to representatives in parallel, with worker
+            # processes inheriting the memory-mapped representative alignments
+            assignments = self._compareToRepresentatives(unprocessed_genome_ids,
+                                                         align_store,
+                                                         bac_marker_ids,
+                                                         ar_marker_ids,
+                                                         (bac_rep_order, bac_rep_matrix, bac_cand_index,
+                                                          ar_rep_order, ar_rep_matrix, ar_cand_index))
+
+            # identify representative assigned to each genome
+            assigned_reps = {}
+            for genome_id in unprocessed_genome_ids:
+                rep_pos, _mismatches, _domain = assignments[genome_id]
+                if rep_pos is not None:
+                    assigned_reps[genome_id] = rep_genome_ids[rep_pos]
+
+            self.logger.info("Assigned %d genomes to a representative." % len(assigned_reps))
+
+            # infer domain of genomes without a representative
+            unassigned_genome_ids = [genome_id for genome_id in unprocessed_genome_ids
+                                     if genome_id not in assigned_reps]
+            domains = {}
+            if unassigned_genome_ids:
+                for genome_id, (domain, _arc_aa_per, _bac_aa_per) in self._domainAssignments(unassigned_genome_ids,
+                                                                                               len_arc_marker,
+                                                                                               len_bac_marker).iteritems():
+                    domains[genome_id] = domain
+
+            self._writeAssignments(unprocessed_genome_ids, assigned_reps, external_ids, domains)
+        finally:
+            # a temporary store is removed even if assignment fails
+            if not cache_dir:
+                shutil.rmtree(store_dir)
@@ -0,0 +1,255 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+"""Nucleotide and gene statistics of genomes.
+
+Statistics are calculated in the same way as by 'genometk nucleotide'
+and 'genometk gene', but in a single pass over the genomic FASTA file
+with bases counted per sequence using NumPy.
+"""
+
+import gzip
+
+import numpy as np
+
+import DefaultValues
+
+# map each byte to its upper case equivalent
+_UPPER = np.arange(256, dtype=np.uint8)
+_UPPER[ord('a'):ord('z') + 1] -= ord('a') - ord('A')
+
+_A, _C, _G, _T, _U, _N = [ord(base) for base in 'ACGTUN']
+
+
+def _readFasta(fasta_file):
+    """Read sequences from FASTA file.
+
+    Parameters
+    ----------
+    fasta_file : str
+        Name of FASTA file, which may be gzipped.
+
+    Returns
+    -------
+    generator
+        Identifier and sequence of each sequence in file.
+    """
+
+    open_file = gzip.open if fasta_file.endswith('.gz') else open
+
+    seq_id = None
+    seq = []
+    with open_file(fasta_file, 'rb') as f:
+        for line in f:
+            if line[0] == '>':
+                if seq_id is not None:
+                    yield seq_id, ''.join(seq)
+
+                seq_id = line[1:].split(None, 1)[0]
+                seq = []
+            else:
+                seq.append(''.join(line.split()))
+
+    if seq_id is not None:
+        yield seq_id, ''.join(seq)
+
+
+def _sequenceStatistics(seq, contig_break):
+    """Count bases and identify contigs of a sequence.
+
+    Contigs are the parts of the sequence separated by runs of at
+    least contig_break N's, with leading and trailing N's removed.
+
+    Parameters
+    ----------
+    seq : str
+        Nucleotide sequence.
+    contig_break : int
+        Minimum number of N's separating contigs.
+
+    Returns
+    -------
+    int
+        Length of sequence.
+    tuple
+        Number of A, C, G, and T(U) bases.
+    numpy.ndarray
+        Length of each contig.
+    """
+
+    bases = _UPPER[np.frombuffer(seq, dtype=np.uint8)]
+    counts = np.bincount(bases, minlength=256)
+    base_counts = (int(counts[_A]), int(counts[_C]), int(counts[_G]), int(counts[_T] + counts[_U]))
+
+    # identify runs of N's as [start, end) intervals
+    n_boundaries = np.diff(np.concatenate(([0], (bases == _N).view(np.int8), [0])))
+    run_starts = np.flatnonzero(n_boundaries == 1)
+    run_ends = np.flatnonzero(n_boundaries == -1)
+
+    breaks = (run_ends - run_starts) >= contig_break
+    contig_starts = np.concatenate(([0], run_ends[breaks]))
+    contig_ends = np.concatenate((run_starts[breaks], [len(bases)]))
+
+    # only the first and last contig can begin or end with N's
+    if len(run_starts) and run_starts[0] == 0 and not breaks[0]:
+        contig_starts[0] = run_ends[0]
+    if len(run_ends) and run_ends[-1] == len(bases) and not breaks[-1]:
+        contig_ends[-1] = run_starts[-1]
+
+    contig_lens = contig_ends - contig_starts
+
+    return len(bases), base_counts, contig_lens[contig_lens > 0]
+
+
+def _n50(seq_lens):
+    """Calculate N50 and L50 of sequences.
+
+    Parameters
+    ----------
+    seq_lens : numpy.ndarray
+        Length of each sequence.
+
+    Returns
+    -------
+    int
+        Length of the longest sequence for which 50% of bases are in sequences of this length or longer.
+    int
+        Number of sequences longer than, or equal to, the N50 length.
+    """
+
+    if not len(seq_lens):
+        return 0, 0
+
+    sorted_lens = np.sort(seq_lens)[::-1]
+    n50 = int(sorted_lens[np.searchsorted(np.cumsum(sorted_lens), sorted_lens.sum() / 2.0)])
+
+    return n50, int((seq_lens >= n50).sum())
+
+
+def nucleotideStatistics(genome_file, contig_break=DefaultValues.CONTIG_BREAK):
+    """Calculate statistics of nucleotide sequences of genome.
+
+    Parameters
+    ----------
+    genome_file : str
+        Name of FASTA file containing nucleotide sequences.
+    contig_break : int
+        Minimum number of ambiguous bases for defining contigs.
+
+    Returns
+    -------
+    dict
+        Value of each statistic.
+    """
+
+    seq_stats = {}
+    for seq_id, seq in _readFasta(genome_file):
+        seq_stats[seq_id] = _sequenceStatistics(seq, contig_break)
+
+    scaffold_lens = np.array([seq_len for seq_len, _base_counts, _contig_lens in seq_stats.itervalues()],
+                             dtype=np.int64)
+    base_counts = np.array([base_counts for _seq_len, base_counts, _contig_lens in seq_stats.itervalues()],
+                           dtype=np.int64).reshape(-1, 4).sum(axis=0)
+    contig_lens = np.concatenate([np.zeros(0, dtype=np.int64)]
+                                 + [contig_lens for _seq_len, _base_counts, contig_lens in seq_stats.itervalues()])
+
+    a, c, g, t = [int(count) for count in base_counts]
+    genome_size = int(scaffold_lens.sum())
+    contig_bases = int(contig_lens.sum())
+
+    # all unambiguous bases are within contigs
+    ambiguous_bases = contig_bases - (a + c + g + t)
+
+    nuc_stats = {}
+    nuc_stats['scaffold_count'] = len(scaffold_lens)
+    nuc_stats['gc_count'] = g + c
+    nuc_stats['gc_percentage'] = float(g + c) / (a + c + g + t) * 100.0 if (a + c + g + t) else 0.0
+    nuc_stats['genome_size'] = genome_size
+    nuc_stats['n50_scaffolds'], nuc_stats['l50_scaffolds'] = _n50(scaffold_lens)
+    nuc_stats['mean_scaffold_length'] = genome_size // len(scaffold_lens) if len(scaffold_lens) else 0
+    nuc_stats['longest_scaffold'] = int(scaffold_lens.max()) if len(scaffold_lens) else 0
+
+    nuc_stats['contig_count'] = len(contig_lens)
+    nuc_stats['ambiguous_bases'] = ambiguous_bases
+    nuc_stats['total_gap_length'] = (genome_size - (a + c + g + t)) - ambiguous_bases
+    nuc_stats['n50_contigs'], nuc_stats['l50_contigs'] = _n50(contig_lens)
+    nuc_stats['mean_contig_length'] = contig_bases // len(contig_lens) if len(contig_lens) else 0
+    nuc_stats['longest_contig'] = int(contig_lens.max()) if len(contig_lens) else 0
+
+    return nuc_stats
+
+
+def geneStatistics(gff_file, genome_size):
+    """Calculate statistics of genes identified in genome.
+
+    Parameters
+    ----------
+    gff_file : str
+        Name of generic feature file describing genes.
+    genome_size : int
+        Number of bases in genome.
+
+    Returns
+    -------
+    dict
+        Value of each statistic.
+    """
+
+    cds_count = 0
+    genes = {}
+    for line in open(gff_file):
+        if line[0] == '#':
+            continue
+
+        line_split = line.split('\t')
+        if line_split[2] == 'CDS':
+            cds_count += 1
+            genes.setdefault(line_split[0], []).append((int(line_split[3]), int(line_split[4])))
+
+    # count bases covered by genes, accounting for overlapping genes; as for
+    # 'genometk gene' the mask of each sequence ends at the last coding base
+    # of the sequence, which is therefore not counted
+    coding_bases = 0
+    for seq_genes in genes.itervalues():
+        coding_mask = np.zeros(max([end for _start, end in seq_genes]), dtype=bool)
+        for start, end in seq_genes:
+            coding_mask[start:end + 1] = True
+        coding_bases += int(coding_mask.sum())
+
+    gene_stats = {}
+    gene_stats['protein_count'] = cds_count
+    gene_stats['coding_bases'] = coding_bases
+    gene_stats['coding_density'] = float(coding_bases) * 100.0 / genome_size if genome_size else 0.0
+
+    return gene_stats
+
+
+def writeStatistics(stats, output_file):
+    """Write statistics to file in the format used by genometk.
+
+    Parameters
+    ----------
+    stats : dict
+        Value of each statistic.
+    output_file : str
+        Name of output file.
+    """
+
+    fout = open(output_file, 'w')
+    for field in sorted(stats.keys()):
+        fout.write('%s\t%s\n' % (field, str(stats[field])))
+    fout.close()
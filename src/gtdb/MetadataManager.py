@@ -17,13 +17,14 @@
 
 import os
 import logging
-import sys
+from collections import OrderedDict, defaultdict
 
 import psycopg2
-from psycopg2.extensions import AsIs
 
 import ConfigMetadata
 import Config
+import DefaultValues
+import GenomeStatistics
 from Exceptions import GenomeDatabaseError
 
 from biolib.taxonomy import Taxonomy
@@ -32,6 +33,13 @@ from biolib.seq_io import read_fasta
 
 class MetadataManager(object):
 
+    # tables holding metadata calculated for each genome
+    METADATA_TABLES = ('metadata_nucleotide',
+                       'metadata_genes',
+                       'metadata_taxonomy',
+                       'metadata_rna',
+                       'metadata_rrna_sequences')
+
     def __init__(self, cur, currentUser):
         """Initialize.
 
@@ -241,25 +249,92 @@ class MetadataManager(object):
             Output directory.
         """
 
-        # create rows for genome in metadata tables
-        self.cur.execute(
-            "INSERT INTO metadata_nucleotide (id) VALUES ({0})".format(db_genome_id))
-        self.cur.execute(
-            "INSERT INTO metadata_genes (id) VALUES ({0})".format(db_genome_id))
-        self.cur.execute(
-            "INSERT INTO metadata_taxonomy (id) VALUES ({0})".format(db_genome_id))
-        self.cur.execute(
-            "INSERT INTO metadata_rna (id) VALUES ({0})".format(db_genome_id))
-        self.cur.execute(
-            "INSERT INTO metadata_rrna_sequences (id) VALUES ({0})".format(db_genome_id))
-
-        self._calculateMetadata(genome_file, gff_file, output_dir)
-        self._storeMetadata(db_genome_id, output_dir)
-        self._storeCheckM(db_genome_id, checkm_results)
-        
+        genome_stats = self.calculateMetadata(genome_file, gff_file, output_dir)
+        self.storeMetadata(db_genome_id, checkm_results, self.parseMetadata(output_dir, genome_stats))
+
         return True
 
-    def _calculateMetadata(self, genome_file, gff_file, output_dir):
+    def storeMetadata(self, db_genome_id, checkm_results, metadata):
+        """Add previously calculated metadata to DB.
+
+        Parameters
+        ----------
+        db_genome_id : str
+            Unique database identifer of genome.
+        checkm_results : dict
+            CheckM metadata.
+        metadata : list
+            Table, field, and value of each metadata item as returned by parseMetadata().
+        """
+
+        return self.storeGenomesMetadata({db_genome_id: checkm_results},
+                                         {db_genome_id: metadata})
+
+    def storeGenomesMetadata(self, checkm_results, metadata):
+        """Add previously calculated metadata for a set of genomes to DB.
+
+        A row is created for each genome in each metadata table. Rows
+        of genomes with values for the same fields of a table are
+        inserted together with multi-row INSERT statements, so the
+        number of statements does not depend on the number of fields
+        or genomes.
+
+        Parameters
+        ----------
+        checkm_results : dict
+            CheckM metadata of each genome, indexed by database identifier.
+        metadata : dict
+            Table, field, and value of each metadata item as returned by
+            parseMetadata() of each genome, indexed by database identifier.
+        """
+
+        # collect values of each genome into a single row per table
+        table_rows = {table: {} for table in self.METADATA_TABLES}
+        for db_genome_id, genome_metadata in metadata.iteritems():
+            genome_rows = {table: OrderedDict() for table in self.METADATA_TABLES}
+            for table, c, v in genome_metadata:
+                genome_rows[table][c] = v
+
+            for c, v in self._checkMData(checkm_results[db_genome_id]):
+                genome_rows['metadata_genes'][c] = v
+
+            for table, row in genome_rows.iteritems():
+                table_rows[table][db_genome_id] = row
+
+        try:
+            for table in self.METADATA_TABLES:
+                column_groups = defaultdict(list)
+                for db_genome_id, row in table_rows[table].iteritems():
+                    column_groups[tuple(row.keys())].append([db_genome_id] + row.values())
+
+                for columns, rows in column_groups.iteritems():
+                    self._insertMetadataRows(table, columns, rows)
+
+            return True
+        except psycopg2.Error as e:
+            raise GenomeDatabaseError(e.pgerror)
+
+    def _insertMetadataRows(self, table, columns, rows):
+        """Insert rows into metadata table.
+
+        Parameters
+        ----------
+        table : str
+            Name of metadata table.
+        columns : tuple
+            Fields of metadata table, in addition to the genome identifier.
+        rows : list
+            Genome identifier followed by the value of each field.
+        """
+
+        row_template = '(' + ', '.join(['%s'] * (len(columns) + 1)) + ')'
+        query = "INSERT INTO {0} ({1}) VALUES ".format(table, ', '.join(('id',) + columns))
+        for start in xrange(0, len(rows), DefaultValues.METADATA_INSERT_BATCH_SIZE):
+            values = [self.cur.mogrify(row_template, row)
+                      for row in rows[start:start + DefaultValues.METADATA_INSERT_BATCH_SIZE]]
+            self.cur.execute(query + ', '.join(values))
+
+    def calculateMetadata(self, genome_file, gff_file, output_dir):
         """Calculate metadata for new genome.
 
         Parameters
@@ -270,150 +345,221 @@ class MetadataManager(object):
             Name of generic feature file describing genes.
         output_dir : str
             Output directory.
+
+        Returns
+        -------
+        dict
+            Nucleotide and gene statistics, indexed by metadata table.
         """
-        os.system('genometk nucleotide --silent %s %s' %
-                  (genome_file, output_dir))
-        os.system('genometk gene --silent %s %s %s' %
-                  (genome_file, gff_file, output_dir))
-
-        os.system('genometk rna --silent --db %s --taxonomy_file %s %s ssu %s' % (
-            ConfigMetadata.GTDB_SSU_GG_DB,
-            ConfigMetadata.GTDB_SSU_GG_TAXONOMY,
-            genome_file,
-            os.path.join(output_dir, ConfigMetadata.GTDB_SSU_GG_OUTPUT_DIR)))
 
-        os.system('genometk rna --silent --db %s --taxonomy_file %s %s ssu %s' % (
-            ConfigMetadata.GTDB_SSU_SILVA_DB,
-            ConfigMetadata.GTDB_SSU_SILVA_TAXONOMY,
+        # nucleotide and gene statistics are calculated in-process and
+        # written in the format of 'genometk nucleotide' and 'genometk gene'
+        genome_stats = {}
+        genome_stats['metadata_nucleotide'] = GenomeStatistics.nucleotideStatistics(genome_file)
+        GenomeStatistics.writeStatistics(genome_stats['metadata_nucleotide'],
+                                         os.path.join(output_dir, ConfigMetadata.GTDB_NT_FILE))
+
+        if gff_file:
+            genome_stats['metadata_genes'] = GenomeStatistics.geneStatistics(
+                gff_file, genome_stats['metadata_nucleotide']['genome_size'])
+            GenomeStatistics.writeStatistics(genome_stats['metadata_genes'],
+                                             os.path.join(output_dir, ConfigMetadata.GTDB_GENE_FILE))
+
+        # SSU and LSU rRNA genes are identified once and the extracted
+        # genes classified against each reference database
+        ssu_file = self._identifyRna(genome_file,
+                                     'ssu',
+                                     os.path.join(output_dir, ConfigMetadata.GTDB_SSU_SILVA_OUTPUT_DIR),
+                                     ConfigMetadata.GTDB_SSU_FNA_FILE)
+        if ssu_file:
+            self._classifyRna(genome_file,
+                              ssu_file,
+                              'ssu',
+                              ConfigMetadata.GTDB_SSU_SILVA_DB,
+                              ConfigMetadata.GTDB_SSU_SILVA_TAXONOMY,
+                              os.path.join(output_dir, ConfigMetadata.GTDB_SSU_SILVA_OUTPUT_DIR))
+            self._classifyRna(genome_file,
+                              ssu_file,
+                              'ssu',
+                              ConfigMetadata.GTDB_SSU_GG_DB,
+                              ConfigMetadata.GTDB_SSU_GG_TAXONOMY,
+                              os.path.join(output_dir, ConfigMetadata.GTDB_SSU_GG_OUTPUT_DIR))
+
+        lsu_file = self._identifyRna(genome_file,
+                                     'lsu_23S',
+                                     os.path.join(output_dir, ConfigMetadata.GTDB_LSU_SILVA_OUTPUT_DIR),
+                                     ConfigMetadata.GTDB_LSU_FNA_FILE)
+        if lsu_file:
+            self._classifyRna(genome_file,
+                              lsu_file,
+                              'lsu_23S',
+                              ConfigMetadata.GTDB_LSU_SILVA_DB,
+                              ConfigMetadata.GTDB_LSU_SILVA_TAXONOMY,
+                              os.path.join(output_dir, ConfigMetadata.GTDB_LSU_SILVA_OUTPUT_DIR))
+
+        return genome_stats
+
+    def _identifyRna(self, genome_file, rna_gene, output_dir, rrna_fna_file):
+        """Identify and extract rRNA genes in genome.
+
+        The location of identified genes is written to the HMM summary
+        file and the genes to a FASTA file in the output directory, so
+        the genes can be classified again without rescanning the genome.
+
+        Parameters
+        ----------
+        genome_file : str
+            Name of FASTA file containing nucleotide sequences.
+        rna_gene : str
+            Name of rRNA gene as used by genometk (e.g., 'ssu', 'lsu_23S').
+        output_dir : str
+            Output directory.
+        rrna_fna_file : str
+            Name of FASTA file with extracted genes within output directory.
+
+        Returns
+        -------
+        str
+            Path to FASTA file with extracted genes, or None if no genes were identified.
+        """
+
+        os.system('genometk rna --silent %s %s %s' % (
             genome_file,
-            os.path.join(output_dir, ConfigMetadata.GTDB_SSU_SILVA_OUTPUT_DIR)))
+            rna_gene,
+            output_dir))
+
+        rrna_file = os.path.join(output_dir, rrna_fna_file)
+        if not os.path.exists(rrna_file):
+            return None
+
+        return rrna_file
+
+    def _classifyRna(self, genome_file, rrna_file, rna_gene, db, taxonomy_file, output_dir):
+        """Classify previously identified rRNA genes against a reference database.
+
+        Parameters
+        ----------
+        genome_file : str
+            Name of FASTA file containing nucleotide sequences.
+        rrna_file : str
+            Name of FASTA file with rRNA genes identified in genome.
+        rna_gene : str
+            Name of rRNA gene as used by genometk (e.g., 'ssu', 'lsu_23S').
+        db : str
+            BLAST database of reference rRNA genes.
+        taxonomy_file : str
+            Taxonomy file for genes in the reference database.
+        output_dir : str
+            Output directory.
+        """
 
-        os.system('genometk rna --silent --db %s --taxonomy_file %s %s lsu_23S %s' % (
-            ConfigMetadata.GTDB_LSU_SILVA_DB,
-            ConfigMetadata.GTDB_LSU_SILVA_TAXONOMY,
+        os.system('genometk rna --silent --db %s --taxonomy_file %s --rrna_file %s %s %s %s' % (
+            db,
+            taxonomy_file,
+            rrna_file,
             genome_file,
-            os.path.join(output_dir, ConfigMetadata.GTDB_LSU_SILVA_OUTPUT_DIR)))
-        return True
+            rna_gene,
+            output_dir))
+
+    def _numericValue(self, value):
+        """Convert value to a float if possible."""
+
+        try:
+            return float(value)
+        except ValueError:
+            return value
 
-    def _storeMetadata(self, db_genome_id, genome_dir):
-        """Parse metadata files for genome and store in database.
+    def parseMetadata(self, genome_dir, genome_stats=None):
+        """Parse metadata files for genome.
 
         Parameters
         ----------
-        db_genome_id : str
-            Unique database identifier of genome.
         genome_dir : str
-            Directory containing metadata files to parse.
+            Directory containing metadata files produced by calculateMetadata().
+        genome_stats : dict
+            Nucleotide and gene statistics returned by calculateMetadata(). If not
+            given, the statistics are read from the files in genome_dir.
+
+        Returns
+        -------
+        list
+            Table, field, and value of each metadata item.
         """
-        try:
+
+        metadata = []
+
+        if genome_stats is not None:
+            # nucleotide and protein metadata
+            for table in ('metadata_nucleotide', 'metadata_genes'):
+                for c, v in sorted(genome_stats.get(table, {}).items()):
+                    metadata.append((table, c, v))
+        else:
             # nucleotide metadata
             metadata_nt_path = os.path.join(
                 genome_dir, ConfigMetadata.GTDB_NT_FILE)
-            genome_list_nt = [tuple(line.rstrip().split('\t'))
-                              for line in open(metadata_nt_path)]
-            query_nt = "UPDATE metadata_nucleotide SET %s = %s WHERE id = {0}".format(
-                db_genome_id)
-            for c, v in genome_list_nt:
-                try:
-                    v = float(v)
-                    self.cur.execute(query_nt, [AsIs(c), v])
-                except:
-                    self.cur.execute(query_nt, [AsIs(c), v])
+            for line in open(metadata_nt_path):
+                c, v = line.rstrip().split('\t')
+                metadata.append(('metadata_nucleotide', c, self._numericValue(v)))
 
             # protein metadata
             metadata_gene_path = os.path.join(
                 genome_dir, ConfigMetadata.GTDB_GENE_FILE)
-            genome_list_gene = [tuple(line.rstrip().split('\t'))
-                                for line in open(metadata_gene_path)]
-            query_gene = "UPDATE metadata_genes SET %s = %s WHERE id = {0}".format(
-                db_genome_id)
-            for c, v in genome_list_gene:
-                try:
-                    v = float(v)
-                    self.cur.execute(query_gene, [AsIs(c), v])
-                except:
-                    self.cur.execute(query_gene, [AsIs(c), v])
-
-            # Greengenes SSU metadata
-            query_taxonomy = "UPDATE metadata_rna SET %s = %s WHERE id = {0}".format(
-                db_genome_id)
-            query_sequence = "UPDATE metadata_rrna_sequences SET %s = %s WHERE id = {0}".format(
-                db_genome_id)
-            metadata_ssu_gg_path = os.path.join(
-                genome_dir, ConfigMetadata.GTDB_SSU_GG_OUTPUT_DIR, ConfigMetadata.GTDB_SSU_FILE)
-            genome_list_taxonomy, _ssu_count, ssu_query_id = self._parse_taxonomy_file(
-                metadata_ssu_gg_path, ConfigMetadata.GTDB_SSU_GG_PREFIX)
-            if genome_list_taxonomy:
-                for c, v in genome_list_taxonomy:
-                    try:
-                        if "blast_subject_id" not in c:
-                            v = float(v)
-                        self.cur.execute(query_taxonomy, [AsIs(c), v])
-                    except:
-                        self.cur.execute(query_taxonomy, [AsIs(c), v])
-
-            # SILVA SSU metadata saved in metadata_ssu table [HACK: eventually information will only be stored in this table]
-            query_taxonomy = "UPDATE metadata_rna SET %s = %s WHERE id = {0}".format(
-                db_genome_id)
-            query_sequence = "UPDATE metadata_rrna_sequences SET %s = %s WHERE id = {0}".format(
-                db_genome_id)
-            metadata_ssu_silva_path = os.path.join(
-                genome_dir, ConfigMetadata.GTDB_SSU_SILVA_OUTPUT_DIR, ConfigMetadata.GTDB_SSU_FILE)
-            metadata_ssu_fna_silva_path = os.path.join(
-                genome_dir, ConfigMetadata.GTDB_SSU_SILVA_OUTPUT_DIR, ConfigMetadata.GTDB_SSU_FNA_FILE)
-            metadata_ssu_silva_summary_file = os.path.join(genome_dir, ConfigMetadata.GTDB_SSU_SILVA_OUTPUT_DIR, ConfigMetadata.GTDB_SSU_SILVA_SUMMARY_FILE)
-
-            genome_list_taxonomy, ssu_count, ssu_query_id = self._parse_taxonomy_file(
-                metadata_ssu_silva_path, ConfigMetadata.GTDB_SSU_SILVA_PREFIX, metadata_ssu_silva_summary_file)
-            if genome_list_taxonomy:
-                for c, v in genome_list_taxonomy:
-                    try:
-                        if "blast_subject_id" not in c:
-                            v = float(v)
-                        self.cur.execute(query_taxonomy, [AsIs(c), v])
-                    except:
-                        self.cur.execute(query_taxonomy, [AsIs(c), v])
-                if ssu_query_id is not None:
-                    genome_list_sequence = self._parse_sequence_file(metadata_ssu_fna_silva_path, ConfigMetadata.GTDB_SSU_SILVA_PREFIX, ssu_query_id)
-                    for c, v in genome_list_sequence:
-                        self.cur.execute(query_sequence, [AsIs(c), v])
-
-            # SILVA LSU metadata saved in metadata_ssu table [HACK: eventually information will only be stored in this table]
-            query_taxonomy = "UPDATE metadata_rna SET %s = %s WHERE id = {0}".format(
-                db_genome_id)
-            metadata_lsu_silva_path = os.path.join(
-                genome_dir, ConfigMetadata.GTDB_LSU_SILVA_OUTPUT_DIR, ConfigMetadata.GTDB_LSU_FILE)
-            metadata_lsu_fna_silva_path = os.path.join(
-                genome_dir, ConfigMetadata.GTDB_LSU_SILVA_OUTPUT_DIR, ConfigMetadata.GTDB_LSU_FNA_FILE)
-            metadata_lsu_silva_summary_file = os.path.join(genome_dir, ConfigMetadata.GTDB_LSU_SILVA_OUTPUT_DIR, ConfigMetadata.GTDB_LSU_SILVA_SUMMARY_FILE)
-            genome_list_taxonomy, lsu_count, lsu_query_id = self._parse_taxonomy_file(
-                metadata_lsu_silva_path, ConfigMetadata.GTDB_LSU_SILVA_PREFIX, metadata_lsu_silva_summary_file)
-            if genome_list_taxonomy:
-                for c, v in genome_list_taxonomy:
-                    try:
-                        if "blast_subject_id" not in c:
-                            v = float(v)
-                        self.cur.execute(query_taxonomy, [AsIs(c), v])
-                    except:
-                        self.cur.execute(query_taxonomy, [AsIs(c), v])
-                if lsu_query_id is not None:
-                    genome_list_sequence = self._parse_sequence_file(metadata_lsu_fna_silva_path, ConfigMetadata.GTDB_LSU_SILVA_PREFIX, lsu_query_id)
-                    for c, v in genome_list_sequence:
-                        self.cur.execute(query_sequence, [AsIs(c), v])
-
-            query_gene_ssu = "UPDATE metadata_genes SET ssu_count = %s WHERE id = {0}".format(db_genome_id)
-            self.cur.execute(query_gene_ssu, (ssu_count,))
-
-            query_gene_lsu = "UPDATE metadata_genes SET lsu_23s_count = %s WHERE id = {0}".format(db_genome_id)
-            self.cur.execute(query_gene_lsu, (lsu_count,))
+            for line in open(metadata_gene_path):
+                c, v = line.rstrip().split('\t')
+                metadata.append(('metadata_genes', c, self._numericValue(v)))
+
+        # Greengenes SSU metadata
+        metadata_ssu_gg_path = os.path.join(
+            genome_dir, ConfigMetadata.GTDB_SSU_GG_OUTPUT_DIR, ConfigMetadata.GTDB_SSU_FILE)
+        genome_list_taxonomy, _ssu_count, ssu_query_id = self._parse_taxonomy_file(
+            metadata_ssu_gg_path, ConfigMetadata.GTDB_SSU_GG_PREFIX)
+        if genome_list_taxonomy:
+            for c, v in genome_list_taxonomy:
+                if "blast_subject_id" not in c:
+                    v = self._numericValue(v)
+                metadata.append(('metadata_rna', c, v))
+
+        # SILVA SSU metadata saved in metadata_ssu table [HACK: eventually information will only be stored in this table]
+        metadata_ssu_silva_path = os.path.join(
+            genome_dir, ConfigMetadata.GTDB_SSU_SILVA_OUTPUT_DIR, ConfigMetadata.GTDB_SSU_FILE)
+        metadata_ssu_fna_silva_path = os.path.join(
+            genome_dir, ConfigMetadata.GTDB_SSU_SILVA_OUTPUT_DIR, ConfigMetadata.GTDB_SSU_FNA_FILE)
+        metadata_ssu_silva_summary_file = os.path.join(genome_dir, ConfigMetadata.GTDB_SSU_SILVA_OUTPUT_DIR, ConfigMetadata.GTDB_SSU_SILVA_SUMMARY_FILE)
+
+        genome_list_taxonomy, ssu_count, ssu_query_id = self._parse_taxonomy_file(
+            metadata_ssu_silva_path, ConfigMetadata.GTDB_SSU_SILVA_PREFIX, metadata_ssu_silva_summary_file)
+        if genome_list_taxonomy:
+            for c, v in genome_list_taxonomy:
+                if "blast_subject_id" not in c:
+                    v = self._numericValue(v)
+                metadata.append(('metadata_rna', c, v))
+            if ssu_query_id is not None:
+                genome_list_sequence = self._parse_sequence_file(metadata_ssu_fna_silva_path, ConfigMetadata.GTDB_SSU_SILVA_PREFIX, ssu_query_id)
+                for c, v in genome_list_sequence:
+                    metadata.append(('metadata_rrna_sequences', c, v))
+
+        # SILVA LSU metadata saved in metadata_ssu table [HACK: eventually information will only be stored in this table]
+        metadata_lsu_silva_path = os.path.join(
+            genome_dir, ConfigMetadata.GTDB_LSU_SILVA_OUTPUT_DIR, ConfigMetadata.GTDB_LSU_FILE)
+        metadata_lsu_fna_silva_path = os.path.join(
+            genome_dir, ConfigMetadata.GTDB_LSU_SILVA_OUTPUT_DIR, ConfigMetadata.GTDB_LSU_FNA_FILE)
+        metadata_lsu_silva_summary_file = os.path.join(genome_dir, ConfigMetadata.GTDB_LSU_SILVA_OUTPUT_DIR, ConfigMetadata.GTDB_LSU_SILVA_SUMMARY_FILE)
+        genome_list_taxonomy, lsu_count, lsu_query_id = self._parse_taxonomy_file(
+            metadata_lsu_silva_path, ConfigMetadata.GTDB_LSU_SILVA_PREFIX, metadata_lsu_silva_summary_file)
+        if genome_list_taxonomy:
+            for c, v in genome_list_taxonomy:
+                if "blast_subject_id" not in c:
+                    v = self._numericValue(v)
+                metadata.append(('metadata_rna', c, v))
+            if lsu_query_id is not None:
+                genome_list_sequence = self._parse_sequence_file(metadata_lsu_fna_silva_path, ConfigMetadata.GTDB_LSU_SILVA_PREFIX, lsu_query_id)
+                for c, v in genome_list_sequence:
+                    metadata.append(('metadata_rrna_sequences', c, v))
+
+        metadata.append(('metadata_genes', 'ssu_count', ssu_count))
+        metadata.append(('metadata_genes', 'lsu_23s_count', lsu_count))
 
-            return True
-        except psycopg2.Error as e:
-            print "error"
-            raise GenomeDatabaseError(e.pgerror)
-        except:
-            print("Unexpected error:", sys.exc_info()[0])
-            raise
+        return metadata
 
     def _parse_taxonomy_file(self, metadata_taxonomy_file, prefix, summary_file=None):
         """Parse metadata file with taxonomic information for rRNA genes.
@@ -521,31 +667,26 @@ class MetadataManager(object):
             metadata.append(('{0}_sequence'.format(prefix), sequence))
         return metadata
 
-    def _storeCheckM(self, db_genome_id, checkm_results):
-        """Store CheckM results for genome.
+    def _checkMData(self, checkm_results):
+        """Get CheckM metadata fields for genome.
 
         Parameters
         ----------
-        db_genome_id : str
-            Unique database identifer of genome.
         checkm_results : dict
             CheckM metadata.
+
+        Returns
+        -------
+        list
+            Field and value of each CheckM metadata item.
         """
-        try:
-            checkm_data = [('checkm_completeness', checkm_results['completeness']),
-                           ('checkm_contamination',
-                            checkm_results['contamination']),
-                           ('checkm_marker_count', checkm_results['marker_count']),
-                           ('checkm_marker_lineage', checkm_results['lineage']),
-                           ('checkm_genome_count', checkm_results['genome_count']),
-                           ('checkm_marker_set_count',
-                            checkm_results['set_count']),
-                           ('checkm_strain_heterogeneity', checkm_results['heterogeneity'])]
-
-            query = "UPDATE metadata_genes SET %s = %s WHERE id = {0}".format(
-                db_genome_id)
-            self.cur.executemany(query, [(AsIs(c), v) for (c, v) in checkm_data])
-            return True
-        except:
-            print("Unexpected error:", sys.exc_info()[0])
-            raise
+
+        return [('checkm_completeness', checkm_results['completeness']),
+                ('checkm_contamination',
+                 checkm_results['contamination']),
+                ('checkm_marker_count', checkm_results['marker_count']),
+                ('checkm_marker_lineage', checkm_results['lineage']),
+                ('checkm_genome_count', checkm_results['genome_count']),
+                ('checkm_marker_set_count',
+                 checkm_results['set_count']),
+                ('checkm_strain_heterogeneity', checkm_results['heterogeneity'])]
@@ -35,6 +35,7 @@ class PfamSearch(object):
         self.currentUser = currentUser
 
         self.threads = threads
+        self.cpus_per_genome = 1
 
         self.pfam_hmm_dir = ConfigMetadata.PFAM_HMM_DIR
         self.protein_file_suffix = ConfigMetadata.PROTEIN_FILE_SUFFIX
@@ -95,6 +96,34 @@ class PfamSearch(object):
         fout.write(checksum)
         fout.close()
 
+    def searchGeneFile(self, gene_file):
+        """Annotate genes of a single genome with Pfam HMMs.
+
+        Parameters
+        ----------
+        gene_file : str
+            Gene file in FASTA format to process.
+        """
+
+        genome_dir, filename = os.path.split(gene_file)
+        output_hit_file = os.path.join(genome_dir, filename.replace(self.protein_file_suffix,
+                                                                    self.pfam_suffix))
+
+        cmd = 'pfam_search.pl -outfile %s -cpu %d -fasta %s -dir %s' % (output_hit_file,
+                                                                        self.cpus_per_genome,
+                                                                        gene_file,
+                                                                        self.pfam_hmm_dir)
+        os.system(cmd)
+
+        # calculate checksum
+        checksum = sha256(output_hit_file)
+        fout = open(output_hit_file + self.checksum_suffix, 'w')
+        fout.write(checksum)
+        fout.close()
+
+        # identify top hit for each gene
+        self._topHit(output_hit_file)
+
     def _workerThread(self, queueIn, queueOut):
         """Process each data item in parallel."""
         while True:
@@ -102,24 +131,7 @@ class PfamSearch(object):
             if gene_file is None:
                 break
 
-            genome_dir, filename = os.path.split(gene_file)
-            output_hit_file = os.path.join(genome_dir, filename.replace(self.protein_file_suffix,
-                                                                        self.pfam_suffix))
-
-            cmd = 'pfam_search.pl -outfile %s -cpu %d -fasta %s -dir %s' % (output_hit_file,
-                                                                            self.cpus_per_genome,
-                                                                            gene_file,
-                                                                            self.pfam_hmm_dir)
-            os.system(cmd)
-
-            # calculate checksum
-            checksum = sha256(output_hit_file)
-            fout = open(output_hit_file + self.checksum_suffix, 'w')
-            fout.write(checksum)
-            fout.close()
-
-            # identify top hit for each gene
-            self._topHit(output_hit_file)
+            self.searchGeneFile(gene_file)
 
             queueOut.put(gene_file)
 
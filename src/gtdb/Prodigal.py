@@ -82,6 +82,34 @@ class Prodigal(object):
 
         return (aa_gene_file, nt_gene_file, gff_file, translation_table_file)
 
+    def callGenes(self, file_paths):
+        """Identify genes in a genome, unless genes were provided.
+
+        Parameters
+        ----------
+        file_paths : dict
+            Paths to genomic file (fasta_path) and gene file (aa_gene_path) of genome.
+
+        Returns
+        -------
+        dict
+            File paths updated with paths to files produced by Prodigal.
+        """
+
+        file_paths["nt_gene_path"] = None
+        file_paths["gff_path"] = None
+        file_paths["translation_table_path"] = None
+
+        if file_paths.get("aa_gene_path") is None:
+            rtn_files = self._runProdigal(file_paths.get("fasta_path"))
+            aa_gene_file, nt_gene_file, gff_file, translation_table_file = rtn_files
+            file_paths["aa_gene_path"] = aa_gene_file
+            file_paths["nt_gene_path"] = nt_gene_file
+            file_paths["gff_path"] = gff_file
+            file_paths["translation_table_path"] = translation_table_file
+
+        return file_paths
+
     def _worker(self, out_dict, worker_queue, writer_queue):
         """This worker function is invoked in a process."""
 
@@ -91,20 +119,7 @@ class Prodigal(object):
                 break
 
             (db_genome_id, file_paths) = data
-
-            file_paths["nt_gene_path"] = None
-            file_paths["gff_path"] = None
-            file_paths["translation_table_path"] = None
-
-            if file_paths.get("aa_gene_path") is None:
-                rtn_files = self._runProdigal(file_paths.get("fasta_path"))
-                aa_gene_file, nt_gene_file, gff_file, translation_table_file = rtn_files
-                file_paths["aa_gene_path"] = aa_gene_file
-                file_paths["nt_gene_path"] = nt_gene_file
-                file_paths["gff_path"] = gff_file
-                file_paths["translation_table_path"] = translation_table_file
-
-            out_dict[db_genome_id] = file_paths
+            out_dict[db_genome_id] = self.callGenes(file_paths)
             writer_queue.put(db_genome_id)
 
     def _writer(self, num_items, writer_queue):
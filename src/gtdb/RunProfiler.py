@@ -0,0 +1,304 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import os
+import sys
+import json
+import time
+import logging
+import resource
+import datetime
+import threading
+from contextlib import contextmanager
+
+import psycopg2.extensions
+
+import DefaultValues
+from GenomeDatabaseConnection import GenomeDatabaseConnection
+
+
+class SqlStats(object):
+    """Number of SQL statements executed and rows transferred."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.statements = 0
+        self.rows = 0
+
+    def add(self, statements, rows):
+        with self.lock:
+            self.statements += statements
+            self.rows += rows
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """Cursor recording executed statements and transferred rows.
+
+    Rows are counted for statements returning a result and for rows
+    copied with COPY. Rows of named (server-side) cursors are fetched in
+    batches while the cursor is iterated, so they are counted once the
+    cursor is closed.
+    """
+
+    sql_stats = None
+
+    def execute(self, query, vars=None):
+        self._countFetchedRows()
+        result = super(CountingCursor, self).execute(query, vars)
+        self.sql_stats.add(1, self._transferredRows())
+        return result
+
+    def executemany(self, query, vars_list):
+        self._countFetchedRows()
+        result = super(CountingCursor, self).executemany(query, vars_list)
+        self.sql_stats.add(1, 0)
+        return result
+
+    def copy_from(self, file, table, sep='\t', null='\\N', size=8192, columns=None):
+        result = super(CountingCursor, self).copy_from(file, table, sep, null, size, columns)
+        self.sql_stats.add(1, max(self.rowcount, 0))
+        return result
+
+    def copy_to(self, file, table, sep='\t', null='\\N', columns=None):
+        result = super(CountingCursor, self).copy_to(file, table, sep, null, columns)
+        self.sql_stats.add(1, max(self.rowcount, 0))
+        return result
+
+    def copy_expert(self, sql, file, size=8192):
+        result = super(CountingCursor, self).copy_expert(sql, file, size)
+        self.sql_stats.add(1, max(self.rowcount, 0))
+        return result
+
+    def close(self):
+        self._countFetchedRows()
+        return super(CountingCursor, self).close()
+
+    def __del__(self):
+        try:
+            self._countFetchedRows()
+        except Exception:
+            pass
+
+    def _transferredRows(self):
+        if self.name or self.description is None or self.rowcount < 0:
+            return 0
+
+        return self.rowcount
+
+    def _countFetchedRows(self):
+        if self.name and not self.closed and self.rowcount > 0 and not getattr(self, '_rows_counted', False):
+            self._rows_counted = True
+            self.sql_stats.add(0, self.rowcount)
+
+
+class RunProfiler(object):
+    """Record resource usage of each stage of a run.
+
+    For each stage the wall time, CPU time of this process and of
+    finished child processes, and number of SQL statements and rows
+    transferred on instrumented connections are recorded. The peak
+    resident set size is only tracked per process, so for each stage
+    the peak so far and its increase during the stage are recorded.
+    A JSON report of all stages is written once the run is finished.
+
+    While a connection is instrumented, connections opened by
+    GenomeDatabaseConnection are also instrumented.
+
+    Example
+    -------
+    profiler = RunProfiler('make_tree_data', progress=True)
+    profiler.instrumentConnection(conn)
+    with profiler.stage('filter_genomes'):
+        ...
+    profiler.writeReport(os.path.join(directory, prefix + '_run_report.json'))
+    """
+
+    def __init__(self, run_name, progress=False):
+        """Initialize.
+
+        Parameters
+        ----------
+        run_name : str
+            Name of run.
+        progress : boolean
+            Flag indicating if a progress line should be written to stderr while a stage is running.
+        """
+
+        self.logger = logging.getLogger()
+
+        self.run_name = run_name
+        self.progress = progress
+        self.sql_stats = SqlStats()
+
+        self.start_time = time.time()
+        self.start_date = datetime.datetime.now()
+        self.stages = []
+        self.parameters = {}
+
+        self.pg_conn = None
+        self.pg_cursor_factory = None
+        self.new_conn_cursor_factory = None
+
+    def instrumentConnection(self, pg_conn):
+        """Count SQL statements and rows of cursors created on connection.
+
+        Parameters
+        ----------
+        pg_conn : psycopg2.extensions.connection
+            Connection to instrument.
+        """
+
+        counting_cursor = type('CountingCursor', (CountingCursor,), {'sql_stats': self.sql_stats})
+
+        self.pg_conn = pg_conn
+        self.pg_cursor_factory = pg_conn.cursor_factory
+        pg_conn.cursor_factory = counting_cursor
+
+        # connections opened by the stages of the run
+        self.new_conn_cursor_factory = GenomeDatabaseConnection.cursor_factory
+        GenomeDatabaseConnection.cursor_factory = counting_cursor
+
+    def releaseConnection(self):
+        """Restore cursor factory of instrumented connection."""
+
+        if self.pg_conn is not None:
+            self.pg_conn.cursor_factory = self.pg_cursor_factory
+            self.pg_conn = None
+            GenomeDatabaseConnection.cursor_factory = self.new_conn_cursor_factory
+
+    @staticmethod
+    def _peakRss():
+        """Peak resident set size in MB of this process and of its finished child processes."""
+
+        # ru_maxrss is given in bytes on OS X and kilobytes on Linux
+        scale = 1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0
+        return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
+
+    def _snapshot(self):
+        self_usage = resource.getrusage(resource.RUSAGE_SELF)
+        children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+        peak_rss, children_peak_rss = self._peakRss()
+
+        return {'wall': time.time(),
+                'cpu': self_usage.ru_utime + self_usage.ru_stime,
+                'children_cpu': children_usage.ru_utime + children_usage.ru_stime,
+                'peak_rss': peak_rss,
+                'children_peak_rss': children_peak_rss,
+                'statements': self.sql_stats.statements,
+                'rows': self.sql_stats.rows}
+
+    def _reportProgress(self, stage_name, start, stop_event):
+        """Write progress line for running stage until stop_event is set."""
+
+        while not stop_event.wait(DefaultValues.PROGRESS_INTERVAL):
+            peak_rss, _children_peak_rss = self._peakRss()
+            sys.stderr.write('\r[%s] %s: %.0f s elapsed, %d SQL statements, %d rows, %.0f MB process peak RSS    '
+                             % (self.run_name,
+                                stage_name,
+                                time.time() - start['wall'],
+                                self.sql_stats.statements - start['statements'],
+                                self.sql_stats.rows - start['rows'],
+                                peak_rss))
+            sys.stderr.flush()
+
+        sys.stderr.write('\n')
+        sys.stderr.flush()
+
+    @contextmanager
+    def stage(self, stage_name):
+        """Record resource usage of a stage.
+
+        Parameters
+        ----------
+        stage_name : str
+            Name of stage.
+        """
+
+        start = self._snapshot()
+
+        stop_event = None
+        progress_thread = None
+        if self.progress:
+            stop_event = threading.Event()
+            progress_thread = threading.Thread(target=self._reportProgress,
+                                               args=(stage_name, start, stop_event))
+            progress_thread.daemon = True
+            progress_thread.start()
+
+        status = 'failed'
+        try:
+            yield
+            status = 'completed'
+        finally:
+            if progress_thread:
+                stop_event.set()
+                progress_thread.join()
+
+            end = self._snapshot()
+            stage_stats = {'stage': stage_name,
+                           'status': status,
+                           'wall_time': round(end['wall'] - start['wall'], 3),
+                           'cpu_time': round(end['cpu'] - start['cpu'], 3),
+                           'children_cpu_time': round(end['children_cpu'] - start['children_cpu'], 3),
+                           'process_peak_rss_mb': round(end['peak_rss'], 1),
+                           'peak_rss_increase_mb': round(end['peak_rss'] - start['peak_rss'], 1),
+                           'children_process_peak_rss_mb': round(end['children_peak_rss'], 1),
+                           'children_peak_rss_increase_mb': round(end['children_peak_rss'] - start['children_peak_rss'], 1),
+                           'sql_statements': end['statements'] - start['statements'],
+                           'sql_rows': end['rows'] - start['rows']}
+            self.stages.append(stage_stats)
+
+            self.logger.info('Stage %s %s in %.1f s (CPU %.1f s, process peak RSS %.0f MB (+%.0f MB), %d SQL statements, %d rows).'
+                             % (stage_name,
+                                status,
+                                stage_stats['wall_time'],
+                                stage_stats['cpu_time'] + stage_stats['children_cpu_time'],
+                                stage_stats['process_peak_rss_mb'],
+                                stage_stats['peak_rss_increase_mb'],
+                                stage_stats['sql_statements'],
+                                stage_stats['sql_rows']))
+
+    def writeReport(self, output_file):
+        """Write JSON report of run.
+
+        Parameters
+        ----------
+        output_file : str
+            Name of output file.
+        """
+
+        peak_rss, children_peak_rss = self._peakRss()
+        report = {'run': self.run_name,
+                  'start': self.start_date.isoformat(),
+                  'wall_time': round(time.time() - self.start_time, 3),
+                  'peak_rss_mb': round(peak_rss, 1),
+                  'children_peak_rss_mb': round(children_peak_rss, 1),
+                  'sql_statements': self.sql_stats.statements,
+                  'sql_rows': self.sql_stats.rows,
+                  'parameters': self.parameters,
+                  'stages': self.stages}
+
+        output_dir = os.path.dirname(output_file)
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        fout = open(output_file, 'w')
+        json.dump(report, fout, indent=2, sort_keys=True)
+        fout.write('\n')
+        fout.close()
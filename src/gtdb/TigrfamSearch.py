@@ -34,6 +34,7 @@ class TigrfamSearch(object):
         self.currentUser = currentUser
 
         self.threads = threads
+        self.cpus_per_genome = 1
         self.tigrfam_hmms = ConfigMetadata.TIGRFAM_HMMS
         self.protein_file_suffix = ConfigMetadata.PROTEIN_FILE_SUFFIX
         self.tigrfam_suffix = ConfigMetadata.TIGRFAM_SUFFIX
@@ -86,6 +87,36 @@ class TigrfamSearch(object):
         fout.write(checksum)
         fout.close()
 
+    def searchGeneFile(self, gene_file):
+        """Annotate genes of a single genome with TIGRFAM HMMs.
+
+        Parameters
+        ----------
+        gene_file : str
+            Gene file in FASTA format to process.
+        """
+
+        assembly_dir, filename = os.path.split(gene_file)
+        output_hit_file = os.path.join(assembly_dir, filename.replace(self.protein_file_suffix,
+                                                                      self.tigrfam_suffix))
+
+        hmmsearch_out = os.path.join(assembly_dir, filename.replace(self.protein_file_suffix, '_tigrfam.out'))
+        cmd = 'hmmsearch -o %s --tblout %s --noali --notextw --cut_nc --cpu %d %s %s' % (hmmsearch_out,
+                                                                                         output_hit_file,
+                                                                                         self.cpus_per_genome,
+                                                                                         self.tigrfam_hmms,
+                                                                                         gene_file)
+        os.system(cmd)
+
+        # calculate checksum
+        checksum = sha256(output_hit_file)
+        fout = open(output_hit_file + self.checksum_suffix, 'w')
+        fout.write(checksum)
+        fout.close()
+
+        # identify top hit for each gene
+        self._topHit(output_hit_file)
+
     def _workerThread(self, queueIn, queueOut):
         """Process each data item in parallel."""
         while True:
@@ -93,26 +124,7 @@ class TigrfamSearch(object):
             if gene_file is None:
                 break
 
-            assembly_dir, filename = os.path.split(gene_file)
-            output_hit_file = os.path.join(assembly_dir, filename.replace(self.protein_file_suffix,
-                                                                          self.tigrfam_suffix))
-
-            hmmsearch_out = os.path.join(assembly_dir, filename.replace(self.protein_file_suffix, '_tigrfam.out'))
-            cmd = 'hmmsearch -o %s --tblout %s --noali --notextw --cut_nc --cpu %d %s %s' % (hmmsearch_out,
-                                                                                             output_hit_file,
-                                                                                             self.cpus_per_genome,
-                                                                                             self.tigrfam_hmms,
-                                                                                             gene_file)
-            os.system(cmd)
-
-            # calculate checksum
-            checksum = sha256(output_hit_file)
-            fout = open(output_hit_file + self.checksum_suffix, 'w')
-            fout.write(checksum)
-            fout.close()
-
-            # identify top hit for each gene
-            self._topHit(output_hit_file)
+            self.searchGeneFile(gene_file)
 
             # allow results to be processed or written to file
             queueOut.put(gene_file)
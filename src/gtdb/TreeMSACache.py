@@ -0,0 +1,493 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import os
+import shutil
+import logging
+import hashlib
+import tempfile
+
+import numpy as np
+
+from biolib.common import make_sure_path_exists
+
+from AlignmentStore import AlignmentStore
+
+
+class TreeMSACache(object):
+    """Cache of untrimmed concatenated alignments and trimming results used to create trees.
+
+    Alignments are cached for an ordered set of markers as a
+    uint8 matrix with one row per genome. An index file records
+    the genome in each row, the version of its aligned markers
+    (see AlignmentStore.genomeVersions), and whether each marker
+    was found once, multiple times, or is missing. Rows of genomes
+    whose aligned markers are unchanged are reused, so only new or
+    updated genomes need to be read from the database.
+
+    The mask produced by trimming the alignment is cached under
+    a key derived from the genomes, their versions, the markers and
+    the trimming parameters, so repeated requests skip trimming.
+
+    The same format is used to store the untrimmed alignment and
+    the number of times each amino acid occurs in each column
+    alongside tree data, allowing the tree data to be updated.
+    """
+
+    FORMAT_VERSION = 1
+
+    # codes used to record the hit type of each marker
+    HIT_CODES = {'Single': 'S', 'Multiple': 'M', 'Missing': '-'}
+    HIT_TYPES = {code: hit_type for hit_type, code in HIT_CODES.iteritems()}
+
+    def __init__(self, cur, store_dir, chosen_markers_order, chosen_markers, name=None):
+        """Initialize.
+
+        Parameters
+        ----------
+        cur : psycopg2.cursor
+            Database cursor.
+        store_dir : str
+            Directory containing cached alignments.
+        chosen_markers_order : list
+            Identifiers of markers in order of concatenation.
+        chosen_markers : d[marker_id] -> d[attribute] -> value
+            Information about each marker, including its size.
+        name : str
+            Prefix of files in store, or None to name files by markers.
+        """
+
+        self.logger = logging.getLogger()
+
+        self.cur = cur
+        self.store_dir = store_dir
+        self.marker_ids = list(chosen_markers_order)
+        self.marker_sizes = {marker_id: chosen_markers[marker_id]['size'] for marker_id in chosen_markers_order}
+
+        self.align_len = sum([chosen_markers[marker_id]['size'] for marker_id in chosen_markers_order])
+        self.marker_key = hashlib.md5(','.join(['%d:%d' % (marker_id, chosen_markers[marker_id]['size'])
+                                                for marker_id in chosen_markers_order])).hexdigest()
+        self.name = name if name else 'msa_%s' % self.marker_key
+
+    @classmethod
+    def fromIndex(cls, cur, store_dir, name):
+        """Open store using the markers recorded in its index.
+
+        Parameters
+        ----------
+        cur : psycopg2.cursor
+            Database cursor.
+        store_dir : str
+            Directory containing stored alignments.
+        name : str
+            Prefix of files in store.
+
+        Returns
+        -------
+        TreeMSACache
+            Store, or None if the index is missing or does not record its markers.
+        """
+
+        index_file = os.path.join(store_dir, name + '.idx')
+        if not os.path.exists(index_file):
+            return None
+
+        with open(index_file) as f:
+            header, _lines = cls._readHeader(f)
+
+        if not header.get('markers'):
+            return None
+
+        chosen_markers_order = []
+        chosen_markers = {}
+        for marker in header['markers'].split(','):
+            marker_id, size = map(int, marker.split(':'))
+            chosen_markers_order.append(marker_id)
+            chosen_markers[marker_id] = {'size': size}
+
+        return cls(cur, store_dir, chosen_markers_order, chosen_markers, name)
+
+    def _indexFile(self):
+        """Get path to index file."""
+
+        return os.path.join(self.store_dir, self.name + '.idx')
+
+    def _trimFile(self):
+        """Get path to file with trimming results."""
+
+        return os.path.join(self.store_dir, self.name + '.trim')
+
+    def _countsFile(self):
+        """Get path to file with amino acid counts of each column."""
+
+        return os.path.join(self.store_dir, self.name + '.counts')
+
+    def exists(self):
+        """Check if store contains alignments for the markers."""
+
+        return self._readIndex()[0] is not None
+
+    @staticmethod
+    def _readHeader(f):
+        """Read header lines of a cache file.
+
+        Returns
+        -------
+        d[key] -> value
+            Values in header.
+        list
+            Remaining lines of file.
+        """
+
+        header = {}
+        lines = []
+        for line in f:
+            if line.startswith('#'):
+                key, value = line[1:].rstrip('\n').split('=', 1)
+                header[key] = value
+            else:
+                lines.append(line.rstrip('\n'))
+
+        return header, lines
+
+    def genomeVersions(self, genome_ids):
+        """Get version of aligned markers for each genome.
+
+        Parameters
+        ----------
+        genome_ids : iterable
+            Database identifiers of genomes.
+
+        Returns
+        -------
+        d[genome_id] -> version
+            Version of each genome with aligned markers.
+        """
+
+        return AlignmentStore(self.cur, self.store_dir).genomeVersions(genome_ids, self.marker_ids)
+
+    def _readIndex(self):
+        """Read index of stored alignments.
+
+        Returns
+        -------
+        numpy.ndarray
+            Matrix of stored alignments.
+        list
+            Genome, version, and hit type of each marker for each row of the matrix.
+
+        None and an empty list are returned if the index is missing,
+        of a different format version, or for different markers.
+        """
+
+        index_file = self._indexFile()
+        if not os.path.exists(index_file):
+            return None, []
+
+        with open(index_file) as f:
+            header, lines = self._readHeader(f)
+
+        data_file = os.path.join(self.store_dir, header.get('data_file', ''))
+        if (header.get('format_version') != str(self.FORMAT_VERSION)
+                or header.get('marker_key') != self.marker_key
+                or not self.align_len
+                or not lines
+                or not os.path.exists(data_file)):
+            return None, []
+
+        entries = []
+        for line in lines:
+            genome_id, version, hit_codes = line.split('\t')
+            entries.append((int(genome_id), version, [self.HIT_TYPES[code] for code in hit_codes]))
+
+        matrix = np.memmap(data_file, dtype=np.uint8, mode='r', shape=(len(lines), self.align_len))
+        return matrix, entries
+
+    def storedRows(self):
+        """Get all stored alignments.
+
+        Returns
+        -------
+        numpy.ndarray
+            Matrix of stored alignments, or None if nothing is stored.
+        d[genome_id] -> (row, version, hit types)
+            Row of each genome in the matrix, the version of its aligned
+            markers, and the hit type of each marker.
+        """
+
+        matrix, entries = self._readIndex()
+
+        stored_rows = {}
+        for row, (genome_id, version, hit_types) in enumerate(entries):
+            stored_rows[genome_id] = (row, version, hit_types)
+
+        return matrix, stored_rows
+
+    def cachedRows(self, versions):
+        """Get cached alignments of genomes which are up-to-date.
+
+        Parameters
+        ----------
+        versions : d[genome_id] -> version
+            Current version of aligned markers for each requested genome.
+
+        Returns
+        -------
+        numpy.ndarray
+            Matrix of cached alignments, or None if nothing is cached.
+        d[genome_id] -> (row, hit types)
+            Row of each up-to-date genome in the matrix and the hit type of each marker.
+        """
+
+        matrix, entries = self._readIndex()
+
+        cached_rows = {}
+        for row, (genome_id, version, hit_types) in enumerate(entries):
+            if versions.get(genome_id) == version:
+                cached_rows[genome_id] = (row, hit_types)
+
+        if not cached_rows:
+            return None, {}
+
+        return matrix, cached_rows
+
+    def newDataFile(self):
+        """Create file to hold a new matrix of alignments.
+
+        Returns
+        -------
+        str
+            Path to new file.
+        """
+
+        make_sure_path_exists(self.store_dir)
+        fd, data_file = tempfile.mkstemp(prefix=self.name + '.',
+                                         suffix='.aln',
+                                         dir=self.store_dir)
+        os.close(fd)
+
+        return data_file
+
+    def writeIndex(self, data_file, genome_ids, versions, hit_types):
+        """Write index for a new matrix of alignments.
+
+        The index is atomically replaced so concurrent readers
+        always see a consistent matrix and index. The matrix
+        referenced by the previous index is removed. A matrix
+        created by another store is linked, or if necessary
+        copied, into this store.
+
+        Parameters
+        ----------
+        data_file : str
+            Path to matrix created with newDataFile().
+        genome_ids : list
+            Genome in each row of the matrix.
+        versions : d[genome_id] -> version
+            Version of aligned markers for each genome.
+        hit_types : d[genome_id] -> list
+            Hit type of each marker in each genome.
+        """
+
+        if os.path.dirname(os.path.abspath(data_file)) != os.path.abspath(self.store_dir):
+            store_data_file = self.newDataFile()
+            os.remove(store_data_file)
+            try:
+                os.link(data_file, store_data_file)
+            except OSError:
+                shutil.copyfile(data_file, store_data_file)
+            data_file = store_data_file
+
+        fd, tmp_index_file = tempfile.mkstemp(suffix='.idx.tmp', dir=self.store_dir)
+        with os.fdopen(fd, 'w') as fout:
+            fout.write('#format_version=%d\n' % self.FORMAT_VERSION)
+            fout.write('#marker_key=%s\n' % self.marker_key)
+            fout.write('#markers=%s\n' % ','.join(['%d:%d' % (marker_id, self.marker_sizes[marker_id])
+                                                    for marker_id in self.marker_ids]))
+            fout.write('#align_len=%d\n' % self.align_len)
+            fout.write('#data_file=%s\n' % os.path.basename(data_file))
+            for genome_id in genome_ids:
+                fout.write('%d\t%s\t%s\n' % (genome_id,
+                                             versions.get(genome_id, ''),
+                                             ''.join([self.HIT_CODES[h] for h in hit_types[genome_id]])))
+
+        old_data_file = None
+        if os.path.exists(self._indexFile()):
+            with open(self._indexFile()) as f:
+                header, _lines = self._readHeader(f)
+            if 'data_file' in header:
+                old_data_file = os.path.join(self.store_dir, header['data_file'])
+
+        os.rename(tmp_index_file, self._indexFile())
+
+        if old_data_file and old_data_file != data_file and os.path.exists(old_data_file):
+            os.remove(old_data_file)
+
+    def trimKey(self, versions, genome_ids, min_perc_taxa, consensus, min_perc_aa):
+        """Get key identifying the result of trimming an alignment.
+
+        Parameters
+        ----------
+        versions : d[genome_id] -> version
+            Version of aligned markers for each genome.
+        genome_ids : iterable
+            Database identifiers of genomes in alignment.
+        min_perc_taxa : float
+            Minimum percentage of taxa required to retain a column.
+        consensus : float
+            Minimum percentage of the most common amino acid required to retain a column.
+        min_perc_aa : float
+            Minimum percentage of amino acids required to retain a genome.
+
+        Returns
+        -------
+        str
+            Key of trimming result.
+        """
+
+        h = hashlib.md5()
+        h.update('%s\n%r\t%r\t%r\n' % (self.marker_key, min_perc_taxa, consensus, min_perc_aa))
+        for genome_id in sorted(genome_ids):
+            h.update('%d:%s\n' % (genome_id, versions.get(genome_id, '')))
+
+        return h.hexdigest()
+
+    def readTrim(self, trim_key):
+        """Read cached result of trimming an alignment.
+
+        Parameters
+        ----------
+        trim_key : str
+            Key of trimming result.
+
+        Returns
+        -------
+        numpy.ndarray
+            Boolean mask indicating retained columns.
+        int
+            Number of sequences pruned.
+        int
+            Number of columns removed due to insufficient taxa.
+        int
+            Number of columns removed due to poor consensus.
+
+        None is returned if no result is cached for the key.
+        """
+
+        trim_file = self._trimFile()
+        if not os.path.exists(trim_file):
+            return None
+
+        with open(trim_file) as f:
+            header, _lines = self._readHeader(f)
+
+        if (header.get('format_version') != str(self.FORMAT_VERSION)
+                or header.get('trim_key') != trim_key
+                or len(header.get('mask', '')) != self.align_len):
+            return None
+
+        mask = np.frombuffer(header['mask'], dtype=np.uint8) == ord('1')
+        return (mask,
+                int(header['num_pruned']),
+                int(header['count_wrong_pa']),
+                int(header['count_wrong_cons']))
+
+    def writeTrim(self, trim_key, mask, num_pruned, count_wrong_pa, count_wrong_cons):
+        """Write result of trimming an alignment, replacing any previous result.
+
+        Parameters
+        ----------
+        trim_key : str
+            Key of trimming result.
+        mask : numpy.ndarray
+            Boolean mask indicating retained columns.
+        num_pruned : int
+            Number of sequences pruned.
+        count_wrong_pa : int
+            Number of columns removed due to insufficient taxa.
+        count_wrong_cons : int
+            Number of columns removed due to poor consensus.
+        """
+
+        make_sure_path_exists(self.store_dir)
+        fd, tmp_trim_file = tempfile.mkstemp(suffix='.trim.tmp', dir=self.store_dir)
+        with os.fdopen(fd, 'w') as fout:
+            fout.write('#format_version=%d\n' % self.FORMAT_VERSION)
+            fout.write('#trim_key=%s\n' % trim_key)
+            fout.write('#num_pruned=%d\n' % num_pruned)
+            fout.write('#count_wrong_pa=%d\n' % count_wrong_pa)
+            fout.write('#count_wrong_cons=%d\n' % count_wrong_cons)
+            fout.write('#mask=%s\n' % ''.join(['1' if m else '0' for m in mask]))
+
+        os.rename(tmp_trim_file, self._trimFile())
+
+    def readCounts(self):
+        """Read number of times each amino acid occurs in each column of stored alignments.
+
+        Returns
+        -------
+        d[code] -> numpy.ndarray
+            Occurrences of each amino acid code in each column.
+
+        None is returned if no counts are stored for the stored alignments.
+        """
+
+        counts_file = self._countsFile()
+        if not os.path.exists(counts_file) or not os.path.exists(self._indexFile()):
+            return None
+
+        with open(counts_file) as f:
+            header, lines = self._readHeader(f)
+        with open(self._indexFile()) as f:
+            index_header, _lines = self._readHeader(f)
+
+        if (header.get('format_version') != str(self.FORMAT_VERSION)
+                or header.get('marker_key') != self.marker_key
+                or header.get('data_file') != index_header.get('data_file')):
+            return None
+
+        char_counts = {}
+        for line in lines:
+            code, counts = line.split('\t')
+            char_counts[int(code)] = np.array(counts.split(','), dtype=np.int64)
+
+        return char_counts
+
+    def writeCounts(self, char_counts):
+        """Write number of times each amino acid occurs in each column of stored alignments.
+
+        Must be called after writeIndex() as the counts are tied
+        to the matrix of the current index.
+
+        Parameters
+        ----------
+        char_counts : d[code] -> numpy.ndarray
+            Occurrences of each amino acid code in each column.
+        """
+
+        with open(self._indexFile()) as f:
+            index_header, _lines = self._readHeader(f)
+
+        fd, tmp_counts_file = tempfile.mkstemp(suffix='.counts.tmp', dir=self.store_dir)
+        with os.fdopen(fd, 'w') as fout:
+            fout.write('#format_version=%d\n' % self.FORMAT_VERSION)
+            fout.write('#marker_key=%s\n' % self.marker_key)
+            fout.write('#data_file=%s\n' % index_header['data_file'])
+            for code in sorted(char_counts):
+                fout.write('%d\t%s\n' % (code, ','.join(map(str, char_counts[code]))))
+
+        os.rename(tmp_counts_file, self._countsFile())
@@ -18,22 +18,38 @@
 import os
 import sys
 import logging
+import gzip
+import heapq
+import itertools
+from multiprocessing.pool import ThreadPool
 import psycopg2 as pg
 
+import numpy as np
+
 from biolib.taxonomy import Taxonomy
 
 from GenomeManager import GenomeManager
 from GenomeListManager import GenomeListManager
+from TreeMSACache import TreeMSACache
+from AlignmentContainer import AlignmentContainer
+from ArbMetadataWriter import ArbMetadataWriter
 from Exceptions import GenomeDatabaseError
+import Config
 
-from collections import Counter
 from collections import defaultdict
 
 
 class TreeManager(object):
     """Manages genomes, concatenated alignment, and metadata for tree inference and visualization."""
 
-    def __init__(self, cur, currentUser):
+    # number of sequences processed at once when trimming
+    # the MSA, used to bound the size of temporary arrays
+    TRIM_BLOCK_ROWS = 4096
+
+    # compression level of gzip compressed marker alignments
+    INDIVIDUAL_GZIP_LEVEL = 6
+
+    def __init__(self, cur, currentUser, threads=1, db_release=None):
         """Initialize.
 
         Parameters
@@ -42,13 +58,52 @@ class TreeManager(object):
             Database cursor.
         currentUser : User
             Current user of database.
+        threads : int
+            Number of threads used to write output files.
+        db_release : str
+            Release of database, used to locate cached alignments.
         """
 
         self.logger = logging.getLogger()
 
         self.cur = cur
         self.currentUser = currentUser
+        self.threads = threads
+        self.db_release = db_release
         
+    def _alignedAminoAcids(self, genome_ids, marker_ids):
+        """Get number of aligned amino acids in each genome.
+
+        Amino acids are counted by the database in a single
+        grouped query. Markers with multiple hits are ignored.
+
+        Parameters
+        ----------
+        genome_ids : iterable
+            Database identifiers of genomes.
+        marker_ids : iterable
+            Identifiers of markers.
+
+        Returns
+        -------
+        d[genome_id] -> number of amino acids
+            Aligned amino acids for genomes with aligned markers.
+        """
+
+        if not genome_ids:
+            return {}
+
+        self.cur.execute("SELECT genome_id, " +
+                         "SUM(CASE WHEN multiple_hits THEN 0 " +
+                         "ELSE length(replace(sequence, '-', '')) END) " +
+                         "FROM aligned_markers " +
+                         "WHERE genome_id = ANY(%s) " +
+                         "AND sequence is NOT NULL " +
+                         "AND marker_id = ANY(%s) " +
+                         "GROUP BY genome_id", (list(genome_ids), list(marker_ids)))
+
+        return {genome_id: int(total_aa) for genome_id, total_aa in self.cur}
+
     def _taxa_filter(self, taxa_filter, genome_ids, guaranteed_ids, retain_guaranteed):
         """Filter genomes to specified taxa."""
         
@@ -116,21 +171,8 @@ class TreeManager(object):
         self.logger.info('Identified %d genomes to be excluded from filtering.' % len(guaranteed_ids))
 
         # for all markers, get the expected marker size
-        self.cur.execute("SELECT markers.id, markers.name, description, id_in_database, size, external_id_prefix " +
-                         "FROM markers, marker_databases " +
-                         "WHERE markers.id in %s "
-                         "AND markers.marker_database_id = marker_databases.id "
-                         "ORDER by external_id_prefix ASC, id_in_database ASC", (tuple(marker_ids),))
-
-        chosen_markers = dict()
-        chosen_markers_order = []
-
-        total_alignment_len = 0
-        for marker_id, marker_name, marker_description, id_in_database, size, external_id_prefix in self.cur:
-            chosen_markers[marker_id] = {'external_id_prefix': external_id_prefix, 'name': marker_name,
-                                         'description': marker_description, 'id_in_database': id_in_database, 'size': size}
-            chosen_markers_order.append(marker_id)
-            total_alignment_len += size
+        chosen_markers_order, chosen_markers = self._chosenMarkers(marker_ids)
+        total_alignment_len = sum([chosen_markers[marker_id]['size'] for marker_id in chosen_markers_order])
 
         # filter genomes based on taxonomy
         genomes_to_retain = genome_ids
@@ -205,20 +247,9 @@ class TreeManager(object):
         # filter genomes with insufficient number of amino acids in MSA
         self.logger.info('Filtering genomes with insufficient amino acids in the MSA.')
         filter_on_aa = set()
+        aligned_aa = self._alignedAminoAcids(genomes_to_retain, marker_ids)
         for genome_id in genomes_to_retain:
-            aligned_marker_query = ("SELECT sequence, multiple_hits " +
-                                    "FROM aligned_markers " +
-                                    "WHERE genome_id = %s " +
-                                    "AND sequence is NOT NULL " +
-                                    "AND marker_id IN %s")
-
-            self.cur.execute(aligned_marker_query,
-                             (genome_id, tuple(marker_ids)))
-
-            total_aa = 0
-            for sequence, multiple_hits in self.cur:
-                if not multiple_hits:
-                    total_aa += len(sequence) - sequence.count('-')
+            total_aa = aligned_aa.get(genome_id, 0)
 
             # should retain guaranteed genomes unless they have zero amino acids in MSA
             if genome_id in guaranteed_ids:
@@ -262,6 +293,110 @@ class TreeManager(object):
 
         return (genomes_to_retain, chosen_markers_order, chosen_markers)
 
+    def previousGenomes(self, previous_dir, previous_prefix):
+        """Get genomes retained in previous tree data.
+
+        This must be called before filterGenomes when the tree data
+        is updated in place, as filtering overwrites the list of
+        retained genomes.
+
+        Parameters
+        ----------
+        previous_dir : str
+            Directory containing previous tree data.
+        previous_prefix : str
+            Prefix of files in previous tree data.
+
+        Returns
+        -------
+        set
+            Database identifiers of retained genomes.
+        """
+
+        previous_genomes_file = os.path.join(previous_dir, previous_prefix + '_good_genomes.tsv')
+        if not os.path.exists(previous_genomes_file):
+            raise GenomeDatabaseError('Previous tree data in %s does not contain file %s.'
+                                      % (previous_dir, os.path.basename(previous_genomes_file)))
+
+        previous_genomes = set()
+        for line in open(previous_genomes_file):
+            if line.strip():
+                previous_genomes.add(int(line.strip()))
+
+        return previous_genomes
+
+    def _chosenMarkers(self, marker_ids):
+        """Get information about markers.
+
+        Parameters
+        ----------
+        marker_ids : iterable
+            Database identifiers of markers.
+
+        Returns
+        -------
+        list
+            Identifiers of markers ordered by marker database and identifier in database.
+        d[marker_id] -> d[attribute] -> value
+            Name, description, size, and external identifier of each marker.
+        """
+
+        self.cur.execute("SELECT markers.id, markers.name, description, id_in_database, size, external_id_prefix " +
+                         "FROM markers, marker_databases " +
+                         "WHERE markers.id in %s "
+                         "AND markers.marker_database_id = marker_databases.id "
+                         "ORDER by external_id_prefix ASC, id_in_database ASC", (tuple(marker_ids),))
+
+        chosen_markers = dict()
+        chosen_markers_order = []
+        for marker_id, marker_name, marker_description, id_in_database, size, external_id_prefix in self.cur:
+            chosen_markers[marker_id] = {'external_id_prefix': external_id_prefix, 'name': marker_name,
+                                         'description': marker_description, 'id_in_database': id_in_database, 'size': size}
+            chosen_markers_order.append(marker_id)
+
+        return chosen_markers_order, chosen_markers
+
+    def _writeMarkersInfo(self, output_file, chosen_markers_order, chosen_markers, single_copy, ubiquitous, num_genomes):
+        """Write summary of marker genes.
+
+        Parameters
+        ----------
+        output_file : str
+            Name of output file.
+        chosen_markers_order : list
+            Identifiers of markers in order of concatenation.
+        chosen_markers : d[marker_id] -> d[attribute] -> value
+            Information about each marker.
+        single_copy : d[marker_id] -> int
+            Number of genomes with a single copy of each marker.
+        ubiquitous : d[marker_id] -> int
+            Number of genomes with each marker.
+        num_genomes : int
+            Number of genomes.
+        """
+
+        marker_info_fh = open(output_file, 'wb')
+        marker_info_fh.write(
+            'Marker Id\tName\tDescription\tLength (bp)\tSingle copy (%)\tUbiquity (%)\n')
+
+        for marker_id in chosen_markers_order:
+            external_id = chosen_markers[marker_id][
+                'external_id_prefix'] + "_" + chosen_markers[marker_id]['id_in_database']
+
+            sc = single_copy.get(marker_id, 0) * 100.0 / num_genomes
+            u = ubiquitous.get(marker_id, 0) * 100.0 / num_genomes
+
+            out_str = "\t".join([
+                external_id,
+                chosen_markers[marker_id]['name'],
+                chosen_markers[marker_id]['description'],
+                str(chosen_markers[marker_id]['size']),
+                '%.2f' % sc,
+                '%.2f' % u
+            ]) + "\n"
+            marker_info_fh.write(out_str)
+        marker_info_fh.close()
+
     def _mimagQualityInfo(self, metadata, col_headers):
         """Add MIMAG quality information to metadata."""
         
@@ -335,10 +470,21 @@ class TreeManager(object):
                    alignment,
                    individual,
                    directory,
-                   prefix):
+                   prefix,
+                   previous_dir=None,
+                   previous_prefix=None,
+                   binary=False,
+                   compression=None,
+                   previous_genomes=None):
         '''
         Write summary files and arb files
 
+        The untrimmed alignment and the number of times each amino acid
+        occurs in each column are stored with the tree data. If previous
+        tree data is given, its alignments are reused for genomes with
+        unchanged aligned markers and the column counts are updated
+        for the genomes added and removed.
+
         :param marker_ids:
         :param genomes_to_retain:
         :param chosen_markers_order:
@@ -347,11 +493,19 @@ class TreeManager(object):
         :param individual:
         :param directory:
         :param prefix:
+        :param previous_dir: directory with previous tree data to update
+        :param previous_prefix: prefix of previous tree data
+        :param binary: write alignment to a binary container (see AlignmentContainer)
+        :param compression: compression of individual marker alignments (None, 'gzip' or 'zstd')
+        :param previous_genomes: genomes retained in previous tree data, read from previous_dir if None
         '''
 
         if not os.path.exists(directory):
             os.makedirs(directory)
 
+        if individual and compression == 'zstd':
+            self._zstandard()
+
         # output the marker info and multiple hit info
         multi_hits_fh = open(
             os.path.join(directory, prefix + "_multi_hits.tsv"), 'wb')
@@ -367,6 +521,7 @@ class TreeManager(object):
                          "FROM metadata_view "
                          "WHERE id IN %s", (tuple(genomes_to_retain),))
         col_headers = [desc[0] for desc in self.cur.description]
+        arb_writer = ArbMetadataWriter(self.cur.description, len(chosen_markers_order))
         metadata = self.cur.fetchall()
         
         # add MIMAG quality information
@@ -375,99 +530,186 @@ class TreeManager(object):
         # identify columns of interest
         genome_id_index = col_headers.index('id')
         genome_name_index = col_headers.index('accession')
-        col_headers.remove('id')
-        col_headers.remove('accession')
 
         # create ARB import filter
         arb_import_filter = os.path.join(directory, prefix + "_arb_filter.ift")
-        self._arbImportFilter(col_headers, arb_import_filter)
+        arb_writer.writeImportFilter(arb_import_filter)
 
         # run through each of the genomes and concatenate markers
         self.logger.info(
             'Concatenated marker genes for %d genomes.' % len(genomes_to_retain))
 
-        individual_marker_fasta = dict()
+        external_ids = {}
+        for genome_metadata in metadata:
+            external_ids[genome_metadata[genome_id_index]] = genome_metadata[genome_name_index]
+
+        # position of each marker in the concatenated alignment
+        marker_offsets = {}
+        alignment_length = 0
+        for marker_id in chosen_markers_order:
+            marker_offsets[marker_id] = alignment_length
+            alignment_length += chosen_markers[marker_id]['size']
+        gap_seq = bytearray('-' * alignment_length)
+
+        # untrimmed alignments are stored with the tree data
+        tree_store = TreeMSACache(self.cur, directory, chosen_markers_order, chosen_markers, name=prefix + '_msa')
+        versions = tree_store.genomeVersions(external_ids.keys())
+
+        msa_cache = None
+        cache_dir = getattr(Config, 'GTDB_CACHE_DIR', None)
+        if cache_dir and self.db_release and alignment_length:
+            msa_cache = TreeMSACache(self.cur,
+                                     os.path.join(cache_dir, self.db_release, 'tree_msa'),
+                                     chosen_markers_order,
+                                     chosen_markers)
+
+        previous_store = None
+        if previous_dir:
+            previous_store = TreeMSACache(self.cur,
+                                          previous_dir,
+                                          chosen_markers_order,
+                                          chosen_markers,
+                                          name=previous_prefix + '_msa')
+            if not previous_store.exists():
+                raise GenomeDatabaseError('Previous tree data in %s does not contain an alignment of the selected markers.'
+                                          % previous_dir)
+
+            if previous_genomes is None:
+                previous_genomes = self.previousGenomes(previous_dir, previous_prefix)
+            self.logger.info('Updating tree data with %d new genomes and %d genomes no longer retained.' % (
+                len(set(genomes_to_retain) - previous_genomes),
+                len(previous_genomes - set(genomes_to_retain))))
+
+        # alignments of genomes with unchanged aligned markers are reused from
+        # the previous tree data or cache so only new or updated genomes are
+        # read from the database
+        cached_matrix, cached_rows = None, {}
+        row_source = previous_store if previous_store else msa_cache
+        if row_source:
+            cached_matrix, cached_rows = row_source.cachedRows(versions)
+            self.logger.info('Reusing alignments for %d of %d genomes.' % (len(cached_rows), len(external_ids)))
+
+        # concatenated alignments are stored in a memory-mapped matrix
+        # so memory use does not grow with the number of genomes
+        msa_matrix_file = tree_store.newDataFile()
+        msa_matrix = np.memmap(msa_matrix_file,
+                               dtype=np.uint8,
+                               mode='w+',
+                               shape=(max(1, len(metadata)), max(1, alignment_length)))
+        msa_ids = []
+        msa_db_ids = []
+
         single_copy = defaultdict(int)
         ubiquitous = defaultdict(int)
         multi_hits_details = defaultdict(list)
-        msa = {}
-        for genome_metadata in metadata:
-            # genome_metadata = list(genome_metadata)
-            db_genome_id = genome_metadata[genome_id_index]
-            external_genome_id = genome_metadata[genome_name_index]
 
-            # get aligned markers
-            aligned_marker_query = ("SELECT am.marker_id, sequence, multiple_hits, evalue " +
-                                    "FROM aligned_markers am " +
-                                    "LEFT JOIN markers m on m.id=am.marker_id " +
-                                    "WHERE genome_id = %s " +
-                                    "AND sequence is NOT NULL " +
-                                    "AND marker_id in %s " +
-                                    "ORDER BY m.id_in_database")
+        def cached_genomes():
+            for db_genome_id in sorted(cached_rows):
+                row, hit_types = cached_rows[db_genome_id]
+                yield db_genome_id, bytearray(cached_matrix[row].tostring()), hit_types
+
+        stale_ids = [db_genome_id for db_genome_id in external_ids if db_genome_id not in cached_rows]
+        db_genomes = self._concatenatedMarkers(stale_ids,
+                                               marker_ids,
+                                               chosen_markers_order,
+                                               chosen_markers,
+                                               marker_offsets,
+                                               gap_seq,
+                                               external_ids)
+
+        # genomes are processed in order of their database identifiers
+        for db_genome_id, aligned_seq, hit_types in heapq.merge(cached_genomes(), db_genomes):
+            external_genome_id = external_ids[db_genome_id]
+
+            for marker_id, hit_type in itertools.izip(chosen_markers_order, hit_types):
+                if hit_type != 'Missing':
+                    ubiquitous[marker_id] += 1
+                if hit_type == 'Single':
+                    single_copy[marker_id] += 1
+            multi_hits_details[db_genome_id] = hit_types
 
-            self.cur.execute(aligned_marker_query,
-                             (db_genome_id, tuple(marker_ids)))
+            msa_matrix[len(msa_ids)] = np.frombuffer(aligned_seq, dtype=np.uint8)
+            msa_ids.append(external_genome_id)
+            msa_db_ids.append(db_genome_id)
 
-            if (self.cur.rowcount == 0):
-                self.logger.warning(
-                    "Genome %s has no markers for this marker set and will be missing from the output files." % external_genome_id)
-                continue
-
-            genome_info = dict()
-            genome_info['markers'] = dict()
-            genome_info['multiple_hits'] = dict()
-            for marker_id, sequence, multiple_hits, evalue in self.cur:
-                if evalue:  # markers without an e-value are missing
-                    genome_info['markers'][marker_id] = sequence
-                genome_info['multiple_hits'][marker_id] = multiple_hits
+            multi_hits_outstr = '%s\t%s\n' % (
+                external_genome_id, '\t'.join(hit_types))
+            multi_hits_fh.write(multi_hits_outstr)
 
-            aligned_seq = ''
-            for marker_id in chosen_markers_order:
-                multiple_hits = genome_info['multiple_hits'][marker_id]
+        multi_hits_fh.close()
+        cached_matrix = None
 
-                if (marker_id in genome_info['markers']):
-                    ubiquitous[marker_id] += 1
-                    if not multiple_hits:
-                        single_copy[marker_id] += 1
-                        multi_hits_details[db_genome_id].append('Single')
-                    else:
-                        multi_hits_details[db_genome_id].append('Multiple')
-                else:
-                    multi_hits_details[db_genome_id].append('Missing')
+        for db_genome_id, external_genome_id in external_ids.iteritems():
+            if db_genome_id not in multi_hits_details:
+                self.logger.warning(
+                    "Genome %s has no markers for this marker set and will be missing from the output files." % external_genome_id)
 
-                if (marker_id in genome_info['markers']) and not multiple_hits:
-                    sequence = genome_info['markers'][marker_id]
-                    fasta_outstr = ">%s\n%s\n" % (external_genome_id, sequence)
+        msa = msa_matrix[0:len(msa_ids), 0:alignment_length]
+        msa_rows = {external_genome_id: row for row, external_genome_id in enumerate(msa_ids)}
 
-                    try:
-                        individual_marker_fasta[marker_id].append(fasta_outstr)
-                    except KeyError:
-                        individual_marker_fasta[marker_id] = [fasta_outstr]
+        if individual:
+            self._writeIndividualMarkers(msa,
+                                         msa_ids,
+                                         chosen_markers_order,
+                                         chosen_markers,
+                                         marker_offsets,
+                                         directory,
+                                         prefix,
+                                         compression)
+
+        # number of times each amino acid occurs in each column, updated from
+        # the previous tree data by only counting genomes added or removed
+        char_counts = None
+        if previous_store:
+            char_counts = previous_store.readCounts()
+        if char_counts is not None:
+            previous_matrix, previous_rows = previous_store.storedRows()
+            removed_rows = sorted([row for db_genome_id, (row, _version, _hit_types) in previous_rows.iteritems()
+                                   if db_genome_id not in cached_rows])
+            added_rows = [row for row, db_genome_id in enumerate(msa_db_ids)
+                          if db_genome_id not in cached_rows]
+            self.logger.info('Updating column statistics for %d added and %d removed genomes.' % (len(added_rows),
+                                                                                                  len(removed_rows)))
+
+            for code, count in self._columnCounts(previous_matrix, removed_rows).iteritems():
+                char_counts[code] -= count
+            for code, count in self._columnCounts(msa, added_rows).iteritems():
+                if code in char_counts:
+                    char_counts[code] += count
                 else:
-                    sequence = chosen_markers[marker_id]['size'] * '-'
-                    fasta_outstr = ">%s\n%s\n" % (external_genome_id, sequence)
+                    char_counts[code] = count
+            previous_matrix = None
+        else:
+            char_counts = self._columnCounts(msa)
 
-                    try:
-                        individual_marker_fasta[marker_id].append(fasta_outstr)
-                    except KeyError:
-                        individual_marker_fasta[marker_id] = [fasta_outstr]
-                aligned_seq += sequence
+        msa_matrix.flush()
+        tree_store.writeIndex(msa_matrix_file, msa_db_ids, versions, multi_hits_details)
+        tree_store.writeCounts(char_counts)
 
-            msa[external_genome_id] = aligned_seq
-            multi_hits_outstr = '%s\t%s\n' % (
-                external_genome_id, '\t'.join(multi_hits_details[db_genome_id]))
-            multi_hits_fh.write(multi_hits_outstr)
+        # filter columns without sufficient representation across taxa
+        trim_result = None
+        if msa_cache:
+            msa_cache.writeIndex(msa_matrix_file, msa_db_ids, versions, multi_hits_details)
 
-        multi_hits_fh.close()
+            trim_key = msa_cache.trimKey(versions, external_ids.keys(), min_perc_taxa, consensus, min_perc_aa)
+            trim_result = msa_cache.readTrim(trim_key)
 
-        # filter columns without sufficient representation across taxa
-        self.logger.info('Trimming columns with insufficient taxa or poor consensus.')
-        trimmed_seqs, pruned_seqs, count_wrong_pa, count_wrong_cons, mask = self._trim_seqs(
-            msa, min_perc_taxa / 100.0, consensus / 100.0, min_perc_aa / 100.0)
-        self.logger.info('Trimmed alignment from %d to %d AA (%d by minimum taxa percent, %d by consensus).' % (len(msa[msa.keys()[0]]),
-                                                                                                                len(trimmed_seqs[trimmed_seqs.keys()[0]]), count_wrong_pa, count_wrong_cons))
+        if trim_result:
+            self.logger.info('Using cached trimming of columns with insufficient taxa or poor consensus.')
+            mask, num_pruned, count_wrong_pa, count_wrong_cons = trim_result
+        else:
+            self.logger.info('Trimming columns with insufficient taxa or poor consensus.')
+            mask, pruned, count_wrong_pa, count_wrong_cons = self._trim_seqs(
+                msa, min_perc_taxa / 100.0, consensus / 100.0, min_perc_aa / 100.0, char_counts)
+            num_pruned = pruned.sum()
+            if msa_cache:
+                msa_cache.writeTrim(trim_key, mask, num_pruned, count_wrong_pa, count_wrong_cons)
+
+        mask_cols = np.flatnonzero(mask)
+        self.logger.info('Trimmed alignment from %d to %d AA (%d by minimum taxa percent, %d by consensus).' % (alignment_length,
+                                                                                                                len(mask_cols), count_wrong_pa, count_wrong_cons))
         self.logger.info('After trimming %d taxa have amino acids in <%.1f%% of columns.' % (
-            len(pruned_seqs), min_perc_aa))
+            num_pruned, min_perc_aa))
 
         # write out mask for MSA
         msa_mask_out = open(os.path.join(directory, prefix + "_mask.txt"), 'w')
@@ -478,148 +720,699 @@ class TreeManager(object):
         fasta_concat_filename = os.path.join(
             directory, prefix + "_concatenated.faa")
         fasta_concat_fh = open(fasta_concat_filename, 'wb')
-        trimmed_seqs.update(pruned_seqs)
-        for genome_id, aligned_seq in trimmed_seqs.iteritems():
-            fasta_outstr = ">%s\n%s\n" % (genome_id, aligned_seq)
+        for row, genome_id in enumerate(msa_ids):
+            fasta_outstr = ">%s\n%s\n" % (genome_id, msa[row, mask_cols].tostring())
             fasta_concat_fh.write(fasta_outstr)
         fasta_concat_fh.close()
 
+        if binary:
+            AlignmentContainer.write(os.path.join(directory, prefix + "_concatenated.bin"),
+                                     msa_ids,
+                                     msa,
+                                     mask)
+
         # write out ARB metadata
         self.logger.info(
             'Writing ARB metadata for %d genomes.' % len(genomes_to_retain))
         arb_metadata_file = os.path.join(
             directory, prefix + "_arb_metadata.txt")
-        arb_metadata_fh = open(arb_metadata_file, 'wb')
+        arb_writer.write(arb_metadata_file, self._arbRecords(metadata,
+                                                             genome_id_index,
+                                                             genome_name_index,
+                                                             msa,
+                                                             msa_rows,
+                                                             mask_cols,
+                                                             multi_hits_details,
+                                                             alignment))
+
+        # write out marker gene summary info
+        self._writeMarkersInfo(os.path.join(directory, prefix + "_markers_info.tsv"),
+                               chosen_markers_order,
+                               chosen_markers,
+                               single_copy,
+                               ubiquitous,
+                               len(genomes_to_retain))
+
+        del msa, msa_matrix
+
+        return fasta_concat_filename
+
+    def _concatenatedMarkers(self,
+                             db_genome_ids,
+                             marker_ids,
+                             chosen_markers_order,
+                             chosen_markers,
+                             marker_offsets,
+                             gap_seq,
+                             external_ids):
+        """Get concatenated alignment of genomes from the database.
+
+        Aligned markers for all genomes are obtained with a single
+        query streamed from a named (server-side) cursor. Genomes
+        without aligned markers are not reported.
+
+        Parameters
+        ----------
+        db_genome_ids : list
+            Database identifiers of genomes.
+        marker_ids : iterable
+            Identifiers of markers in marker set.
+        chosen_markers_order : list
+            Identifiers of markers in order of concatenation.
+        chosen_markers : d[marker_id] -> d[attribute] -> value
+            Information about each marker.
+        marker_offsets : d[marker_id] -> int
+            Position of each marker in the concatenated alignment.
+        gap_seq : bytearray
+            Concatenated alignment consisting only of gaps.
+        external_ids : d[db_genome_id] -> external genome id
+            External identifier of each genome.
+
+        Returns
+        -------
+        generator
+            Database identifier, concatenated alignment, and the hit type
+            (Single, Multiple, Missing) of each marker for each genome in
+            order of database identifier.
+        """
+
+        if not db_genome_ids:
+            return
+
+        aligned_marker_query = ("SELECT genome_id, marker_id, sequence, multiple_hits, evalue " +
+                                "FROM aligned_markers " +
+                                "WHERE genome_id = ANY(%s) " +
+                                "AND sequence is NOT NULL " +
+                                "AND marker_id = ANY(%s) " +
+                                "ORDER BY genome_id")
+        msa_cur = self.cur.connection.cursor('tree_aligned_markers')
+        msa_cur.itersize = 10000
+        msa_cur.execute(aligned_marker_query, (list(db_genome_ids), list(marker_ids)))
+
+        for db_genome_id, marker_rows in itertools.groupby(msa_cur, lambda row: row[0]):
+            external_genome_id = external_ids[db_genome_id]
+
+            genome_markers = dict()
+            genome_multiple_hits = dict()
+            for _genome_id, marker_id, sequence, multiple_hits, evalue in marker_rows:
+                if evalue:  # markers without an e-value are missing
+                    genome_markers[marker_id] = sequence
+                genome_multiple_hits[marker_id] = multiple_hits
+
+            aligned_seq = bytearray(gap_seq)
+            hit_types = []
+            for marker_id in chosen_markers_order:
+                multiple_hits = genome_multiple_hits.get(marker_id, False)
+
+                if (marker_id in genome_markers):
+                    if not multiple_hits:
+                        hit_types.append('Single')
+                    else:
+                        hit_types.append('Multiple')
+                else:
+                    hit_types.append('Missing')
+
+                if (marker_id in genome_markers) and not multiple_hits:
+                    start = marker_offsets[marker_id]
+                    end = start + chosen_markers[marker_id]['size']
+                    sequence = genome_markers[marker_id]
+                    if len(sequence) != end - start:
+                        raise GenomeDatabaseError('Aligned marker %d of genome %s has length %d, expected %d.'
+                                                  % (marker_id, external_genome_id, len(sequence), end - start))
+                    aligned_seq[start:end] = sequence
+
+            yield db_genome_id, aligned_seq, hit_types
+
+        msa_cur.close()
+
+    def _arbRecords(self,
+                    metadata,
+                    genome_id_index,
+                    genome_name_index,
+                    msa,
+                    msa_rows,
+                    mask_cols,
+                    hit_types,
+                    alignment):
+        """Get information required to write ARB record of each genome.
+
+        Parameters
+        ----------
+        metadata : list
+            Rows of metadata query for genomes.
+        genome_id_index : int
+            Index of database identifier in metadata rows.
+        genome_name_index : int
+            Index of external identifier in metadata rows.
+        msa : numpy.ndarray
+            Untrimmed alignment of genomes as a matrix of uint8 character codes.
+        msa_rows : d[external genome id] -> row
+            Row of each genome in the alignment.
+        mask_cols : numpy.ndarray
+            Columns retained after trimming.
+        hit_types : d[db genome id] -> list
+            Hit type of each marker in each genome.
+        alignment : boolean
+            Flag indicating if alignments should be included in records.
+
+        Returns
+        -------
+        generator
+            Arguments of ArbMetadataWriter.record() for each genome with markers.
+        """
+
+        aa_counts = None
+        if alignment:
+            aa_counts = self._aaCounts(msa, mask_cols)
 
         for genome_metadata in metadata:
-            # take special care of the genome identifier and name as these
-            # are handle as a special case in the ARB metadata file
-            genome_metadata = list(genome_metadata)
             db_genome_id = genome_metadata[genome_id_index]
             external_genome_id = genome_metadata[genome_name_index]
-            del genome_metadata[max(genome_id_index, genome_name_index)]
-            del genome_metadata[min(genome_id_index, genome_name_index)]
-
-            # write out ARB record
-            multiple_hit_count = sum(
-                [1 if x == "Multiple" else 0 for x in multi_hits_details[db_genome_id]])
-            msa_gene_count = sum(
-                [1 if x == "Single" else 0 for x in multi_hits_details[db_genome_id]])
-
-            aligned_seq = trimmed_seqs[external_genome_id]
-            if not alignment:
-                aligned_seq = ''
-            self._arbRecord(arb_metadata_fh,
-                            external_genome_id,
-                            col_headers,
-                            genome_metadata,
-                            multiple_hit_count,
-                            msa_gene_count,
-                            len(chosen_markers_order),
-                            aligned_seq)
-
-        arb_metadata_fh.close()
+            if external_genome_id not in msa_rows:
+                # genome has no markers for this marker set
+                continue
 
-        # write out marker gene summary info
-        marker_info_fh = open(
-            os.path.join(directory, prefix + "_markers_info.tsv"), 'wb')
-        marker_info_fh.write(
-            'Marker Id\tName\tDescription\tLength (bp)\tSingle copy (%)\tUbiquity (%)\n')
+            multiple_hit_count = hit_types[db_genome_id].count('Multiple')
+            msa_gene_count = hit_types[db_genome_id].count('Single')
 
-        for marker_id in chosen_markers_order:
+            row = msa_rows[external_genome_id]
+            if alignment:
+                yield (genome_metadata,
+                       multiple_hit_count,
+                       msa_gene_count,
+                       msa[row, mask_cols].tostring(),
+                       aa_counts[row])
+            else:
+                yield genome_metadata, multiple_hit_count, msa_gene_count, '', 0
+
+    def writeArbMetadata(self, directory, prefix, alignment):
+        """Write ARB import filter and metadata for existing tree data.
+
+        The ARB metadata is produced from the untrimmed alignment and
+        mask stored with the tree data, and current genome metadata,
+        without filtering genomes or reading aligned markers.
+
+        Parameters
+        ----------
+        directory : str
+            Directory containing tree data.
+        prefix : str
+            Prefix of tree data files.
+        alignment : boolean
+            Flag indicating if alignments should be included in records.
+        """
+
+        tree_store = TreeMSACache.fromIndex(self.cur, directory, prefix + '_msa')
+        if not tree_store or not tree_store.exists():
+            raise GenomeDatabaseError('Tree data in %s does not contain a stored alignment with prefix %s.'
+                                      % (directory, prefix))
+
+        mask_file = os.path.join(directory, prefix + '_mask.txt')
+        if not os.path.exists(mask_file):
+            raise GenomeDatabaseError('Tree data in %s does not contain file %s.'
+                                      % (directory, os.path.basename(mask_file)))
+        mask = open(mask_file).read().strip()
+        if len(mask) != tree_store.align_len:
+            raise GenomeDatabaseError('Mask has length %d, expected %d.' % (len(mask), tree_store.align_len))
+        mask_cols = np.flatnonzero(np.frombuffer(mask, dtype=np.uint8) == ord('1'))
+
+        msa, stored_rows = tree_store.storedRows()
+        hit_types = {}
+        db_msa_rows = {}
+        for db_genome_id, (row, _version, genome_hit_types) in stored_rows.iteritems():
+            hit_types[db_genome_id] = genome_hit_types
+            db_msa_rows[db_genome_id] = row
+
+        self.cur.execute("SELECT * " +
+                         "FROM metadata_view "
+                         "WHERE id IN %s", (tuple(db_msa_rows.keys()),))
+        arb_writer = ArbMetadataWriter(self.cur.description, len(tree_store.marker_ids))
+        metadata = self.cur.fetchall()
+
+        msa_rows = {}
+        for genome_metadata in metadata:
+            msa_rows[genome_metadata[arb_writer.genome_name_index]] = db_msa_rows[genome_metadata[arb_writer.genome_id_index]]
+
+        self.logger.info('Writing ARB metadata for %d genomes.' % len(metadata))
+        arb_writer.writeImportFilter(os.path.join(directory, prefix + "_arb_filter.ift"))
+        arb_writer.write(os.path.join(directory, prefix + "_arb_metadata.txt"),
+                         self._arbRecords(metadata,
+                                          arb_writer.genome_id_index,
+                                          arb_writer.genome_name_index,
+                                          msa,
+                                          msa_rows,
+                                          mask_cols,
+                                          hit_types,
+                                          alignment))
+
+    def subsetTreeData(self,
+                       source_dir,
+                       source_prefix,
+                       genome_ids,
+                       taxa_filter,
+                       quality_threshold,
+                       quality_weight,
+                       comp_threshold,
+                       cont_threshold,
+                       min_perc_taxa,
+                       consensus,
+                       min_perc_aa,
+                       alignment,
+                       binary,
+                       directory,
+                       prefix):
+        """Create tree data for a subset of the genomes in existing tree data.
+
+        Genomes are selected from the untrimmed alignment stored with the
+        tree data, without reading aligned markers from the database, and
+        the alignment is trimmed using only the selected genomes.
+
+        Parameters
+        ----------
+        source_dir : str
+            Directory containing tree data.
+        source_prefix : str
+            Prefix of tree data files.
+        genome_ids : set
+            Database identifiers of genomes to retain, or None to consider all genomes.
+        taxa_filter : str
+            Taxa (comma separated) to retain, or None to retain all taxa.
+        quality_threshold : float
+            Minimum required quality, or None.
+        quality_weight : float
+            Weighting factor for assessing genome quality.
+        comp_threshold : float
+            Minimum required completeness, or None.
+        cont_threshold : float
+            Maximum permitted contamination, or None.
+        min_perc_taxa : float
+            Minimum percentage of taxa required to retain a column.
+        consensus : float
+            Minimum percentage of the most common amino acid required to retain a column.
+        min_perc_aa : float
+            Minimum percentage of amino acids required to retain a genome.
+        alignment : boolean
+            Flag indicating if alignments should be included in ARB records.
+        binary : boolean
+            Flag indicating if alignment should be written to a binary container.
+        directory : str
+            Output directory.
+        prefix : str
+            Prefix of output files.
+
+        Returns
+        -------
+        str
+            Path to trimmed concatenated alignment, or None if no genomes were selected.
+        """
+
+        source_store = TreeMSACache.fromIndex(self.cur, source_dir, source_prefix + '_msa')
+        if not source_store or not source_store.exists():
+            raise GenomeDatabaseError('Tree data in %s does not contain a stored alignment with prefix %s.'
+                                      % (source_dir, source_prefix))
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        source_matrix, stored_rows = source_store.storedRows()
+        selected_ids = set(stored_rows)
+        self.logger.info('Selecting genomes from %d genomes in %s.' % (len(selected_ids), source_dir))
+
+        if genome_ids is not None:
+            selected_ids.intersection_update(genome_ids)
+            self.logger.info('Retained %d genomes in specified genome lists.' % len(selected_ids))
+
+        if taxa_filter and selected_ids:
+            selected_ids = self._taxa_filter(taxa_filter, selected_ids, set(), retain_guaranteed=True)
+
+        if selected_ids and (quality_threshold is not None
+                             or comp_threshold is not None
+                             or cont_threshold is not None):
+            filtered_genomes = self._filterOnGenomeQuality(selected_ids,
+                                                           quality_threshold,
+                                                           quality_weight,
+                                                           comp_threshold,
+                                                           cont_threshold)
+            selected_ids.difference_update(filtered_genomes)
+            self.logger.info('Filtered %d genomes based on completeness, contamination, and quality.' % len(filtered_genomes))
+
+        if not selected_ids:
+            self.logger.warning('No genomes left after filtering.')
+            return None
+
+        self.cur.execute("SELECT id, accession " +
+                         "FROM metadata_view " +
+                         "WHERE id IN %s", (tuple(selected_ids),))
+        external_ids = dict(self.cur.fetchall())
+
+        # copy rows of selected genomes, in order of their database identifiers
+        subset_ids = sorted(selected_ids)
+        missing_ids = [db_genome_id for db_genome_id in subset_ids if db_genome_id not in external_ids]
+        if missing_ids:
+            raise GenomeDatabaseError('Genomes in stored alignment are no longer in the database: %s'
+                                      % ', '.join(map(str, missing_ids)))
+        source_rows = np.array([stored_rows[db_genome_id][0] for db_genome_id in subset_ids], dtype=np.int64)
+
+        tree_store = TreeMSACache(self.cur,
+                                  directory,
+                                  source_store.marker_ids,
+                                  {marker_id: {'size': size} for marker_id, size in source_store.marker_sizes.iteritems()},
+                                  name=prefix + '_msa')
+        msa_matrix_file = tree_store.newDataFile()
+        msa = np.memmap(msa_matrix_file, dtype=np.uint8, mode='w+', shape=(len(subset_ids), source_store.align_len))
+        for start in xrange(0, len(subset_ids), self.TRIM_BLOCK_ROWS):
+            msa[start:start + self.TRIM_BLOCK_ROWS] = source_matrix[source_rows[start:start + self.TRIM_BLOCK_ROWS]]
+        msa.flush()
+        source_matrix = None
+
+        versions = {db_genome_id: stored_rows[db_genome_id][1] for db_genome_id in subset_ids}
+        hit_types = {db_genome_id: stored_rows[db_genome_id][2] for db_genome_id in subset_ids}
+        char_counts = self._columnCounts(msa)
+        tree_store.writeIndex(msa_matrix_file, subset_ids, versions, hit_types)
+        tree_store.writeCounts(char_counts)
+
+        good_genomes = open(os.path.join(directory, prefix + '_good_genomes.tsv'), 'w')
+        for db_genome_id in subset_ids:
+            good_genomes.write("{0}\n".format(db_genome_id))
+        good_genomes.close()
+
+        # trim alignment using only the selected genomes
+        self.logger.info('Trimming columns of alignment for %d genomes.' % len(subset_ids))
+        mask, pruned, count_wrong_pa, count_wrong_cons = self._trim_seqs(
+            msa, min_perc_taxa / 100.0, consensus / 100.0, min_perc_aa / 100.0, char_counts)
+        mask_cols = np.flatnonzero(mask)
+        self.logger.info('Trimmed alignment from %d to %d AA (%d by minimum taxa percent, %d by consensus).' % (source_store.align_len,
+                                                                                                                len(mask_cols), count_wrong_pa, count_wrong_cons))
+        self.logger.info('After trimming %d taxa have amino acids in <%.1f%% of columns.' % (
+            pruned.sum(), min_perc_aa))
+
+        msa_mask_out = open(os.path.join(directory, prefix + "_mask.txt"), 'w')
+        msa_mask_out.write(''.join(['1' if m else '0' for m in mask]))
+        msa_mask_out.close()
+
+        msa_ids = [external_ids[db_genome_id] for db_genome_id in subset_ids]
+        fasta_concat_filename = os.path.join(directory, prefix + "_concatenated.faa")
+        fasta_concat_fh = open(fasta_concat_filename, 'wb')
+        for row, genome_id in enumerate(msa_ids):
+            fasta_outstr = ">%s\n%s\n" % (genome_id, msa[row, mask_cols].tostring())
+            fasta_concat_fh.write(fasta_outstr)
+        fasta_concat_fh.close()
+
+        if binary:
+            AlignmentContainer.write(os.path.join(directory, prefix + "_concatenated.bin"),
+                                     msa_ids,
+                                     msa,
+                                     mask)
+
+        del msa
+
+        # output the marker info and multiple hit info
+        _marker_order, chosen_markers = self._chosenMarkers(source_store.marker_ids)
+        missing_markers = [marker_id for marker_id in source_store.marker_ids if marker_id not in chosen_markers]
+        if missing_markers:
+            raise GenomeDatabaseError('Markers of stored alignment are not in the database: %s'
+                                      % ', '.join(map(str, missing_markers)))
+
+        multi_hits_fh = open(
+            os.path.join(directory, prefix + "_multi_hits.tsv"), 'wb')
+        multi_hits_header = ["Genome_ID"]
+        for marker_id in source_store.marker_ids:
             external_id = chosen_markers[marker_id][
                 'external_id_prefix'] + "_" + chosen_markers[marker_id]['id_in_database']
+            multi_hits_header.append(external_id)
+        multi_hits_fh.write("\t".join(multi_hits_header) + "\n")
 
-            sc = single_copy.get(marker_id, 0) * 100.0 / len(genomes_to_retain)
-            u = ubiquitous.get(marker_id, 0) * 100.0 / len(genomes_to_retain)
+        single_copy = defaultdict(int)
+        ubiquitous = defaultdict(int)
+        for db_genome_id, external_genome_id in itertools.izip(subset_ids, msa_ids):
+            for marker_id, hit_type in itertools.izip(source_store.marker_ids, hit_types[db_genome_id]):
+                if hit_type != 'Missing':
+                    ubiquitous[marker_id] += 1
+                if hit_type == 'Single':
+                    single_copy[marker_id] += 1
 
-            out_str = "\t".join([
-                external_id,
-                chosen_markers[marker_id]['name'],
-                chosen_markers[marker_id]['description'],
-                str(chosen_markers[marker_id]['size']),
-                '%.2f' % sc,
-                '%.2f' % u
-            ]) + "\n"
-            marker_info_fh.write(out_str)
-        marker_info_fh.close()
+            multi_hits_fh.write('%s\t%s\n' % (external_genome_id, '\t'.join(hit_types[db_genome_id])))
+        multi_hits_fh.close()
 
-        # write out individual marker gene alignments
-        if individual:
-            self.logger.info('Writing individual alignments.')
-            for marker_id in chosen_markers.keys():
-                fasta_individual_fh = open(os.path.join(
-                    directory, prefix + "_" + chosen_markers[marker_id]['id_in_database'] + ".faa"), 'wb')
-                fasta_individual_fh.write(
-                    ''.join(individual_marker_fasta[marker_id]))
-                fasta_individual_fh.close()
+        self._writeMarkersInfo(os.path.join(directory, prefix + "_markers_info.tsv"),
+                               source_store.marker_ids,
+                               chosen_markers,
+                               single_copy,
+                               ubiquitous,
+                               len(subset_ids))
+
+        self.writeArbMetadata(directory, prefix, alignment)
 
         return fasta_concat_filename
 
-    def _trim_seqs(self, seqs, min_per_taxa, consensus, min_per_bp):
-        """Trim multiple sequence alignment.
+    @staticmethod
+    def _zstandard():
+        """Get zstandard module, which is only required for zstd compression."""
+
+        try:
+            import zstandard
+        except ImportError:
+            raise GenomeDatabaseError('The zstandard package is required to write zstd compressed files.')
+
+        return zstandard
 
-        Adapted from the biolib package.
+    def _openMarkerFile(self, output_file, compression):
+        """Open file for writing, with optional compression.
 
         Parameters
         ----------
-        seqs : d[seq_id] -> sequence
-            Aligned sequences.
-        min_per_taxa : float
-            Minimum percentage of taxa required to retain a column [0,1].
-        min_per_bp : float
-            Minimum percentage of base pairs required to keep trimmed sequence [0,1].
+        output_file : str
+            Path to output file, without compression extension.
+        compression : str
+            Compression of file (None, 'gzip' or 'zstd').
+
         Returns
         -------
-        dict : d[seq_id] -> sequence
-            Dictionary of trimmed sequences.
-        dict : d[seq_id] -> sequence
-            Dictionary of pruned sequences.
+        file
+            File opened for writing.
         """
 
-        alignment_length = len(seqs.values()[0])
-
-        # count number of taxa represented in each column
-        column_count = [0] * alignment_length
-        column_chars = [list() for _ in xrange(alignment_length)]
-        for seq in seqs.values():
-            for i, ch in enumerate(seq):
-                if ch != '.' and ch != '-':
-                    column_count[i] += 1
-                    column_chars[i].append(ch)
-
-        mask = [False] * alignment_length
-        count_wrong_pa = 0
-        count_wrong_cons = 0
-        for i, count in enumerate(column_count):
-            if count >= min_per_taxa * len(seqs):
-                c = Counter(column_chars[i])
-                if len(c.most_common(1)) == 0:
-                    ratio = 0
-                else:
-                    _letter, count = c.most_common(1)[0]
-                    ratio = float(count) / len(column_chars[i])
-                if ratio >= consensus:
-                    mask[i] = True
-                else:
-                    count_wrong_cons += 1
+        if not compression:
+            return open(output_file, 'wb')
+        elif compression == 'gzip':
+            return gzip.open(output_file + '.gz', 'wb', self.INDIVIDUAL_GZIP_LEVEL)
+        elif compression == 'zstd':
+            fh = open(output_file + '.zst', 'wb')
+            return self._zstandard().ZstdCompressor().stream_writer(fh)
+
+        raise GenomeDatabaseError('Unknown compression: %s' % compression)
+
+    def _writeMarker(self, msa, msa_ids, start, end, output_file, compression):
+        """Write alignment of a single marker.
+
+        Parameters
+        ----------
+        msa : numpy.ndarray
+            Concatenated alignment of genomes as a matrix of uint8 character codes.
+        msa_ids : list
+            Identifier of genome in each row of the matrix.
+        start : int
+            First column of marker in the concatenated alignment.
+        end : int
+            Column following the marker in the concatenated alignment.
+        output_file : str
+            Path to output file, without compression extension.
+        compression : str
+            Compression of file (None, 'gzip' or 'zstd').
+        """
+
+        fout = self._openMarkerFile(output_file, compression)
+        for block_start in xrange(0, len(msa_ids), self.TRIM_BLOCK_ROWS):
+            block = np.ascontiguousarray(msa[block_start:block_start + self.TRIM_BLOCK_ROWS, start:end])
+            fout.write(''.join([">%s\n%s\n" % (genome_id, block[i].tostring())
+                                for i, genome_id in enumerate(msa_ids[block_start:block_start + self.TRIM_BLOCK_ROWS])]))
+        fout.close()
+
+    def _writeIndividualMarkers(self,
+                                msa,
+                                msa_ids,
+                                chosen_markers_order,
+                                chosen_markers,
+                                marker_offsets,
+                                directory,
+                                prefix,
+                                compression):
+        """Write alignment of each marker to a separate FASTA file.
+
+        Markers are written in parallel by a pool of threads which
+        share the memory-mapped alignment matrix, with each thread
+        reading the column range of a single marker.
+
+        Parameters
+        ----------
+        msa : numpy.ndarray
+            Concatenated alignment of genomes as a matrix of uint8 character codes.
+        msa_ids : list
+            Identifier of genome in each row of the matrix.
+        chosen_markers_order : list
+            Identifiers of markers in order of concatenation.
+        chosen_markers : d[marker_id] -> d[attribute] -> value
+            Information about each marker.
+        marker_offsets : d[marker_id] -> int
+            Position of each marker in the concatenated alignment.
+        directory : str
+            Output directory.
+        prefix : str
+            Prefix of output files.
+        compression : str
+            Compression of files (None, 'gzip' or 'zstd').
+        """
+
+        self.logger.info('Writing individual alignments of %d markers.' % len(chosen_markers_order))
+
+        marker_jobs = []
+        for marker_id in chosen_markers_order:
+            start = marker_offsets[marker_id]
+            end = start + chosen_markers[marker_id]['size']
+            output_file = os.path.join(directory, prefix + "_" + chosen_markers[marker_id]['id_in_database'] + ".faa")
+            marker_jobs.append((start, end, output_file))
+
+        def write_marker(job):
+            start, end, output_file = job
+            self._writeMarker(msa, msa_ids, start, end, output_file, compression)
+
+        if self.threads > 1 and len(marker_jobs) > 1:
+            pool = ThreadPool(min(self.threads, len(marker_jobs)))
+            try:
+                pool.map(write_marker, marker_jobs, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for job in marker_jobs:
+                write_marker(job)
+
+    @classmethod
+    def _aaCounts(cls, msa, cols):
+        """Count amino acids in each row of an alignment within the specified columns.
+
+        Parameters
+        ----------
+        msa : numpy.ndarray
+            Aligned sequences as a matrix (sequences x columns) of uint8 character codes.
+        cols : numpy.ndarray
+            Columns to consider.
+
+        Returns
+        -------
+        numpy.ndarray
+            Number of characters which are not gaps ('-') in each row.
+        """
+
+        aa_counts = np.zeros(msa.shape[0], dtype=np.int64)
+        for start in xrange(0, msa.shape[0], cls.TRIM_BLOCK_ROWS):
+            block = np.asarray(msa[start:start + cls.TRIM_BLOCK_ROWS])[:, cols]
+            aa_counts[start:start + cls.TRIM_BLOCK_ROWS] = (block != ord('-')).sum(axis=1)
+
+        return aa_counts
+
+    @classmethod
+    def _columnCounts(cls, msa, rows=None):
+        """Count occurrences of each amino acid in each column of an alignment.
+
+        Parameters
+        ----------
+        msa : numpy.ndarray
+            Aligned sequences as a matrix (sequences x columns) of uint8 character codes.
+        rows : list
+            Rows of the matrix to count, or None to count all rows.
+
+        Returns
+        -------
+        d[code] -> numpy.ndarray
+            Occurrences of each amino acid code in each column.
+        """
+
+        gap_chars = (ord('.'), ord('-'))
+
+        num_rows = msa.shape[0] if rows is None else len(rows)
+        char_counts = {}
+        for start in xrange(0, num_rows, cls.TRIM_BLOCK_ROWS):
+            if rows is None:
+                block = np.asarray(msa[start:start + cls.TRIM_BLOCK_ROWS])
             else:
-                count_wrong_pa += 1
+                block = np.asarray(msa[rows[start:start + cls.TRIM_BLOCK_ROWS]])
+            for code in np.unique(block):
+                if code in gap_chars:
+                    continue
+                count = (block == code).sum(axis=0)
+                if code in char_counts:
+                    char_counts[code] += count
+                else:
+                    char_counts[code] = count
 
-        # trim columns
-        output_seqs = {}
-        pruned_seqs = {}
-        for seq_id, seq in seqs.iteritems():
-            masked_seq = ''.join([seq[i] for i in xrange(0, len(mask)) if mask[i]])
+        return {int(code): count for code, count in char_counts.iteritems()}
 
-            valid_bases = len(masked_seq) - masked_seq.count('.') - masked_seq.count('-')
-            if valid_bases < len(masked_seq) * min_per_bp:
-                pruned_seqs[seq_id] = masked_seq
-                continue
+    @classmethod
+    def _trim_seqs(cls, msa, min_per_taxa, consensus, min_per_bp, char_counts=None):
+        """Trim multiple sequence alignment.
 
-            output_seqs[seq_id] = masked_seq
+        Adapted from the biolib package. Columns are processed
+        with vectorized operations over blocks of sequences.
 
-        return output_seqs, pruned_seqs, count_wrong_pa, count_wrong_cons, mask
+        Parameters
+        ----------
+        msa : numpy.ndarray
+            Aligned sequences as a matrix (sequences x columns) of uint8 character codes.
+        min_per_taxa : float
+            Minimum percentage of taxa required to retain a column [0,1].
+        consensus : float
+            Minimum percentage of the most common amino acid required to retain a column [0,1].
+        min_per_bp : float
+            Minimum percentage of base pairs required to keep trimmed sequence [0,1].
+        char_counts : d[code] -> numpy.ndarray
+            Occurrences of each amino acid code in each column, or None to count them.
+        Returns
+        -------
+        numpy.ndarray
+            Boolean mask indicating retained columns.
+        numpy.ndarray
+            Boolean array indicating pruned sequences.
+        int
+            Number of columns removed due to insufficient taxa.
+        int
+            Number of columns removed due to poor consensus.
+        """
+
+        num_seqs, alignment_length = msa.shape
+        gap_chars = (ord('.'), ord('-'))
+
+        # count occurrences of each amino acid in each column
+        if char_counts is None:
+            char_counts = cls._columnCounts(msa)
+
+        column_count = np.zeros(alignment_length, dtype=np.int64)
+        most_common_count = np.zeros(alignment_length, dtype=np.int64)
+        for count in char_counts.itervalues():
+            column_count += count
+            np.maximum(most_common_count, count, out=most_common_count)
+
+        # columns must be represented across sufficient taxa
+        # and have a consensus amino acid
+        sufficient_taxa = column_count >= min_per_taxa * num_seqs
+        ratio = np.zeros(alignment_length, dtype=np.float64)
+        has_chars = column_count > 0
+        ratio[has_chars] = most_common_count[has_chars].astype(np.float64) / column_count[has_chars]
+        mask = sufficient_taxa & (ratio >= consensus)
+
+        count_wrong_pa = int((~sufficient_taxa).sum())
+        count_wrong_cons = int((sufficient_taxa & ~mask).sum())
+
+        # identify sequences with insufficient amino acids after trimming
+        mask_cols = np.flatnonzero(mask)
+        min_valid_bases = len(mask_cols) * min_per_bp
+        pruned = np.zeros(num_seqs, dtype=bool)
+        for start in xrange(0, num_seqs, cls.TRIM_BLOCK_ROWS):
+            block = np.asarray(msa[start:start + cls.TRIM_BLOCK_ROWS])[:, mask_cols]
+            valid_bases = ((block != gap_chars[0]) & (block != gap_chars[1])).sum(axis=1)
+            pruned[start:start + cls.TRIM_BLOCK_ROWS] = valid_bases < min_valid_bases
+
+        return mask, pruned, count_wrong_pa, count_wrong_cons
 
     def _filterOnGenomeQuality(self, genome_ids, quality_threshold, quality_weight, comp_threshold, cont_threshold):
         """Filter genomes on completeness and contamination thresholds.
@@ -697,82 +1490,3 @@ class TreeManager(object):
         genome_ids_from_taxa = set([x[0] for x in self.cur])
 
         return genome_ids_from_taxa
-
-    def _arbImportFilter(self, metadata_fields, output_file):
-        """Create ARB import filter.
-
-        Parameters
-        ----------
-        metadata_fields : list
-            Names of fields to import.
-        output_file : str
-            Name of output file.
-        """
-        fout = open(output_file, 'w')
-        fout.write('AUTODETECT\t"BEGIN"\n\n')
-        fout.write('BEGIN\t"BEGIN*"\n\n')
-
-        fout.write('MATCH\t"%s\\=*"\n' % 'db_name')
-        fout.write('\tSRT "*\\=="\n')
-        fout.write('\tWRITE "%s"\n\n' % 'name')
-
-        # place organism name near top for convenience
-        fout.write('MATCH\t"%s\\=*"\n' % 'organism_name')
-        fout.write('\tSRT "*\\=="\n')
-        fout.write('\tWRITE "%s"\n\n' % 'organism_name')
-
-        fields = metadata_fields + ['msa_gene_count',
-                                    'msa_num_marker_genes',
-                                    'msa_aa_count',
-                                    'msa_length',
-                                    'multiple_homologs']
-        for field in fields:
-            if field != 'organism_name':
-                fout.write('MATCH\t"%s\\=*"\n' % field)
-                fout.write('\tSRT "*\\=="\n')
-                fout.write('\tWRITE "%s"\n\n' % field)
-
-        fout.write('SEQUENCEAFTER\t"multiple_homologs*"\n')
-        fout.write('SEQUENCESRT\t"*\\=="\n')
-        fout.write('SEQUENCEEND\t"END"\n\n')
-        fout.write('END\t"END"\n')
-
-        fout.close()
-
-    def _arbRecord(self, fout,
-                   external_genome_id,
-                   metadata_fields,
-                   metadata_values,
-                   multiple_hit_count,
-                   msa_gene_count,
-                   num_marker_genes,
-                   aligned_seq):
-        """Write out ARB record for genome."""
-
-        # customize output relative to raw database table
-        if external_genome_id.startswith('GB') or external_genome_id.startswith('RS'):
-            metadata_values = list(metadata_values)
-            organism_name_index = metadata_fields.index('organism_name')
-            ncbi_organism_name_index = metadata_fields.index('ncbi_organism_name')
-            metadata_values[organism_name_index] = metadata_values[ncbi_organism_name_index]
-
-        fout.write("BEGIN\n")
-        fout.write("db_name=%s\n" % external_genome_id)
-        for col_header, value in zip(metadata_fields, metadata_values):
-            if isinstance(value, float):
-                value = '%.4g' % value
-
-            # replace equal signs as these are incompatible with the ARB parser
-            value = str(value)
-            if value:
-                value = value.replace('=', '/')
-
-            fout.write("%s=%s\n" % (col_header, value))
-
-        fout.write("msa_gene_count=%d\n" % msa_gene_count)
-        fout.write("msa_num_marker_genes=%d\n" % num_marker_genes)
-        fout.write("msa_aa_count=%d\n" % (len(aligned_seq) - aligned_seq.count('-')))
-        fout.write("msa_length=%d\n" % len(aligned_seq))
-        fout.write("multiple_homologs=%d\n" % multiple_hit_count)
-        fout.write("aligned_seq=%s\n" % (aligned_seq))
-        fout.write("END\n\n")